@@ -16,8 +16,41 @@ def parse():
     parser_handle_interface.add_argument("-r", "--reader", nargs="?", dest="reader", type=int, 
         const=0, default=0, required=False, 
         help="index of the available ACR1552 readers to use (default: 0)")
-    parser_handle_interface.add_argument("-t", "--trace", action="store_true", dest="trace", 
-        help="trace all raw ISO15693 communication")
+    parser_handle_recording = parser_handle_interface.add_mutually_exclusive_group()
+    parser_handle_recording.add_argument("-t", "--trace", nargs="?", dest="trace", type=str, 
+        const="ntag5sensor.trace", default=None, metavar="FILE", 
+        help="record all raw ISO15693 communication, written to a binary trace file on exit (default: ntag5sensor.trace)")
+    parser_handle_recording.add_argument("-rec", "--record", dest="record", type=str, 
+        default=None, metavar="FILE", 
+        help="record the complete session without size limit, written to a binary trace file on exit for replay")
+    parser_handle_source = parser_handle_interface.add_mutually_exclusive_group()
+    parser_handle_source.add_argument("-e", "--emulate", action="store_true", dest="emulate", 
+        help="use an emulated NTAG 5 Link and sensor instead of a reader")
+    parser_handle_source.add_argument("-rp", "--replay", dest="replay", type=str, 
+        default=None, metavar="FILE", 
+        help="replay a recorded session instead of using a reader")
+    parser_handle_interface.add_argument("-u", "--unthrottled", action="store_true", dest="unthrottled", 
+        help="replay recorded responses as fast as possible instead of in real time")
+    parser_handle_interface.add_argument("-s", "--stats", action="store_true", dest="stats", 
+        help="print exchange latency and retry statistics per command on exit")
+    parser_handle_interface.add_argument("-nc", "--no-cache", action="store_true", dest="no_cache", 
+        help="always query the tag capabilities and configure the sensor from scratch instead of using the caches in ~/.cache/ntag5sensor")
+    
+    # Inventory options
+    parser_handle_inventory = argparse.ArgumentParser(add_help=False)
+    parser_handle_inventory.add_argument("-sl", "--slots", nargs="?", dest="slots", type=int, 
+        const=16, default=16, choices=[1, 16], 
+        help="number of anticollision slots per inventory round (default: 16)")
+
+    # Acquisition from multiple readers or tags
+    parser_handle_multi = argparse.ArgumentParser(add_help=False, parents=[parser_handle_inventory])
+    parser_handle_multi_source = parser_handle_multi.add_mutually_exclusive_group()
+    parser_handle_multi_source.add_argument("-A", "--all-readers", action="store_true", dest="all_readers", 
+        help="read from all available readers in parallel, merging the samples into one stream")
+    parser_handle_multi_source.add_argument("-T", "--all-tags", action="store_true", dest="all_tags", 
+        help="read from all tags in the field of the reader, polling them in turn, merging the samples into one stream")
+    parser_handle_multi.add_argument("-se", "--select", action="store_true", dest="select", 
+        help="with -T, select each tag for its turn instead of addressing every command by UID")
     
     # Persistent configuration options
     parser_handle_config = argparse.ArgumentParser(add_help=False)
@@ -28,6 +61,14 @@ def parse():
         const="1.8", default="1.8", choices=["1.8", "2.4", "3.0"], 
         help="regulated voltage output of active energy harvesting, in V (default: 1.8)")
 
+    # Energy harvesting tuning options
+    parser_handle_tune = argparse.ArgumentParser(add_help=False)
+    parser_handle_tune.add_argument("-d", "--duration", nargs="?", dest="duration", type=float, 
+        const=2.0, default=2.0, 
+        help="time to sample the sensor at each operating point, in s (default: 2.0)")
+    parser_handle_tune.add_argument("-p", "--persist", action="store_true", dest="persist", 
+        help="write the best operating point into the persistent energy harvesting configuration")
+
     # Sensor interfacing
     parser_handle_sensor_interface = argparse.ArgumentParser(add_help=False)
     parser_handle_sensor_interface.add_argument("-a", "--address", nargs="?", dest="address", type=int, 
@@ -40,6 +81,12 @@ def parse():
         const="oneshot", default="oneshot", choices=["oneshot", "continuous"], 
         help="Mode to operate the connected sensor chip in (default: oneshot)")
 
+    # TMP oneshot sampling options
+    parser_handle_tmp_period = argparse.ArgumentParser(add_help=False)
+    parser_handle_tmp_period.add_argument("-pe", "--period", nargs="?", dest="period", type=float, 
+        const=2.0, default=2.0, 
+        help="time between the starts of two oneshot conversions, in s (default: 2.0)")
+
     # TMP117 configuration options
     parser_handle_tmp117_settings = argparse.ArgumentParser(add_help=False)
     parser_handle_tmp117_settings.add_argument("-av", "--average", nargs="?", dest="average", type=int, 
@@ -60,6 +107,35 @@ def parse():
         parents=[parser_handle_interface, parser_handle_config],
         help="write persistent configuration settings into the NTAG5 Link EEPROM")
 
+    # DUMP action
+    parser_dump = actions.add_parser("dump", 
+        parents=[parser_handle_interface],
+        help="read the complete user memory of the NTAG5 Link")
+    parser_dump.add_argument("-o", "--output", dest="output", type=str, 
+        default=None, metavar="FILE", 
+        help="write the memory content to a binary file instead of printing it")
+
+    # WRITE action
+    parser_write = actions.add_parser("write", 
+        parents=[parser_handle_interface],
+        help="write a file into the user memory of the NTAG5 Link and verify it")
+    parser_write.add_argument("file", type=str, 
+        help="binary file to write")
+    parser_write.add_argument("-b", "--block", nargs="?", dest="block", type=int, 
+        const=0, default=0, 
+        help="first user memory block to write (default: 0)")
+
+    # INVENTORY action
+    parser_inventory = actions.add_parser("inventory", 
+        parents=[parser_handle_interface, parser_handle_inventory],
+        help="list the UIDs of all tags in the field of the reader")
+
+    # TRACE action
+    parser_trace = actions.add_parser("trace", 
+        help="decode and print a binary trace file recorded with --trace")
+    parser_trace.add_argument("file", type=str, 
+        help="binary trace file to decode")
+
 
     # TMP117 action
     parser_tmp117 = actions.add_parser('tmp117', help='manage connected TMP117 sensor')
@@ -79,9 +155,14 @@ def parse():
 
     # TMP117 READ action
     parser_tmp117_info = subparsers_tmp117.add_parser('read', 
-        parents=[parser_handle_interface, parser_handle_sensor_interface, parser_handle_tmp], 
+        parents=[parser_handle_interface, parser_handle_multi, parser_handle_sensor_interface, parser_handle_tmp, parser_handle_tmp_period], 
         help='read measurement data from the connected TMP117 sensor')
 
+    # TMP117 TUNE action
+    parser_tmp117_tune = subparsers_tmp117.add_parser('tune', 
+        parents=[parser_handle_interface, parser_handle_sensor_interface, parser_handle_tune], 
+        help='find the energy harvesting operating point with the highest reliable sample rate of the connected TMP117 sensor')
+
 
     # TMP112 action
     parser_tmp112 = actions.add_parser('tmp112', help='manage connected TMP112 sensor')
@@ -96,9 +177,14 @@ def parse():
 
     # TMP117 READ action
     parser_tmp112_info = parser_tmp112.add_parser('read', 
-        parents=[parser_handle_interface, parser_handle_sensor_interface, parser_handle_tmp], 
+        parents=[parser_handle_interface, parser_handle_multi, parser_handle_sensor_interface, parser_handle_tmp, parser_handle_tmp_period], 
         help='read measurement data from the connected TMP112 sensor')
 
+    # TMP112 TUNE action
+    parser_tmp112_tune = parser_tmp112.add_parser('tune', 
+        parents=[parser_handle_interface, parser_handle_sensor_interface, parser_handle_tune], 
+        help='find the energy harvesting operating point with the highest reliable sample rate of the connected TMP112 sensor')
+
 
     # SI1143 action
     parser_si1143 = actions.add_parser('si1143', help='manage connected SI1143 sensor')
@@ -113,9 +199,15 @@ def parse():
 
     # SI1143 READ action
     parser_si1143_read = subparsers_si1143.add_parser('read',
-        parents=[parser_handle_interface],
+        parents=[parser_handle_interface, parser_handle_multi],
         help='read measurement data from the connected SI1143 sensor')
 
+    # SI1143 TUNE action
+    parser_si1143_tune = subparsers_si1143.add_parser('tune',
+        parents=[parser_handle_interface, parser_handle_tune],
+        help='find the energy harvesting operating point with the highest reliable sample rate of the connected SI1143 sensor')
+
+    parser.set_defaults(all_readers=False, all_tags=False)
     args = parser.parse_args()
     return (parser, args)
 
@@ -142,3 +234,19 @@ def validate(parser, args):
     if(args.action is None):
         parser.print_help()
         exit(1)
+
+    if(args.all_readers and args.replay != None):
+        print("error: A recorded session can only be replayed as a single reader")
+        exit(1)
+
+    if(args.all_tags and args.replay != None):
+        print("error: Polling several tags depends on timing and cannot be replayed")
+        exit(1)
+
+    if(getattr(args, "period", 0.0) < 0.0):
+        print("error: The oneshot period cannot be negative")
+        exit(1)
+
+    if(getattr(args, "verb", None) == "tune" and args.replay != None):
+        print("error: Tuning samples for a fixed time and cannot be replayed")
+        exit(1)
@@ -163,3 +163,27 @@ def print_si1143_info(info):
         print(f" - Revision ID: {info["rev_id"]}")
     if("seq_id" in info):
         print(f" - Sequencer ID: {info["seq_id"]}")
+
+def print_trace(frames, describe):
+    if(len(frames) == 0):
+        return
+    start = frames[0][0]
+    for timestamp, direction, outcome, data in frames:
+        print(f" - {timestamp - start:10.6f} {describe(direction, outcome, data)}")
+
+def print_memory(image):
+    # Hex dump with one line per block, locked blocks are marked
+    for index in range(image.num_blocks):
+        block = image.start_block + index
+        marker = " locked" if image.is_locked(block) else ""
+        print(f" - {block:04x}: {image.block(block).hex(' ')}{marker}")
+
+def print_tune_results(results, best):
+    for res in results:
+        marker = "*" if res is best else " "
+        if(res["time_to_stable"] == None):
+            print(f" {marker} {res['current']:>4} mA {res['voltage']} V: load did not stabilize")
+            continue
+        print(f" {marker} {res['current']:>4} mA {res['voltage']} V: stable after {res['time_to_stable'] * 1000.0:7.1f} ms, " +
+            f"{res['rate']:6.1f} samples/s, NAK {res['nak']}, WDT {res['wdt']}, other errors {res['errors']}, " +
+            f"RF errors {res['rf_errors']} of {res['exchanges']} ({100.0 * res['rf_error_rate']:.2f} %)")
@@ -0,0 +1,115 @@
+import time
+
+from vicinity.ntag5link import *
+from vicinity.harvester import EnergyHarvester
+from reader.stats import OUTCOME_SUCCESS
+from protocol.errors import TransportError
+
+
+# Operating points in sweep order, from the lowest to the highest demand on the field
+TUNE_CURRENTS = {
+    "0.4": NXP_EH_CONFIG_EH_VOUT_I_SEL_0_4,
+    "0.6": NXP_EH_CONFIG_EH_VOUT_I_SEL_0_6,
+    "1.4": NXP_EH_CONFIG_EH_VOUT_I_SEL_1_4,
+    "2.7": NXP_EH_CONFIG_EH_VOUT_I_SEL_2_7,
+    "4.0": NXP_EH_CONFIG_EH_VOUT_I_SEL_4_0,
+    "6.5": NXP_EH_CONFIG_EH_VOUT_I_SEL_6_5,
+    "9.0": NXP_EH_CONFIG_EH_VOUT_I_SEL_9_0,
+    "12.5": NXP_EH_CONFIG_EH_VOUT_I_SEL_12_5,
+}
+TUNE_VOLTAGES = {
+    "1.8": NXP_EH_CONFIG_EH_VOUT_V_SEL_1_8,
+    "2.4": NXP_EH_CONFIG_EH_VOUT_V_SEL_2_4,
+    "3.0": NXP_EH_CONFIG_EH_VOUT_V_SEL_3_0,
+}
+
+# Sampling time per operating point, in seconds
+TUNE_DURATION =                             2.0
+# Operating points that do not reach a stable load within this time are skipped, in seconds
+TUNE_STABLE_TIMEOUT =                       2.0
+# Time without harvesting between two operating points, lets the sensor supply discharge, in seconds
+TUNE_SETTLE =                               0.2
+
+
+class EnergyTuner:
+    def __init__(self, chip, setup, sample, duration = TUNE_DURATION,
+            timeout = TUNE_STABLE_TIMEOUT, settle = TUNE_SETTLE):
+        # setup() configures the freshly powered sensor, sample() takes one measurement from it
+        self.chip = chip
+        self.setup = setup
+        self.sample = sample
+        self.duration = duration
+        self.timeout = timeout
+        self.settle = settle
+
+    def _exchanges(self):
+        # Total and failed exchanges so far, failures include those recovered by a retry
+        total = 0
+        failed = 0
+        for row in self.chip.reader.stats.summary():
+            total += row["count"]
+            if(row["outcome"] != OUTCOME_SUCCESS):
+                failed += row["count"]
+        return (total, failed)
+
+    def measure(self, current, voltage):
+        # Power the sensor at one operating point and sample it for the configured duration
+        res = { "current": current, "voltage": voltage, "time_to_stable": None, "samples": 0, "rate": 0.0,
+            "nak": 0, "wdt": 0, "errors": 0, "rf_errors": 0, "exchanges": 0, "rf_error_rate": 0.0 }
+        harvester = EnergyHarvester(self.chip, timeout = self.timeout,
+            current = TUNE_CURRENTS[current], voltage = TUNE_VOLTAGES[voltage])
+        harvester.stop()
+        time.sleep(self.settle)
+        total, failed = self._exchanges()
+        try:
+            harvester.start()
+        except Exception as e:
+            print(f"warning: {e}")
+            return res
+        res["time_to_stable"] = harvester.time_to_stable
+        start = time.monotonic()
+        configured = False
+        while(time.monotonic() - start < self.duration):
+            try:
+                if(not configured):
+                    self.setup()
+                    configured = True
+                self.sample()
+                res["samples"] += 1
+            except I2CNakError:
+                res["nak"] += 1
+                configured = False
+            except I2CWatchdogError:
+                res["wdt"] += 1
+                configured = False
+            except TransportError:
+                # Failed exchanges are counted from the reader statistics below
+                configured = False
+            except Exception:
+                # Other I2C master or sensor errors, e.g. a sensor that browned out during a command
+                res["errors"] += 1
+                configured = False
+        elapsed = time.monotonic() - start
+        now_total, now_failed = self._exchanges()
+        res["rate"] = res["samples"] / elapsed
+        res["exchanges"] = now_total - total
+        res["rf_errors"] = now_failed - failed
+        if(res["exchanges"] > 0):
+            res["rf_error_rate"] = res["rf_errors"] / res["exchanges"]
+        return res
+
+    def sweep(self, currents = TUNE_CURRENTS, voltages = TUNE_VOLTAGES):
+        results = []
+        for voltage in voltages:
+            for current in currents:
+                print(f"info: Measuring {current} mA, {voltage} V")
+                results.append(self.measure(current, voltage))
+        return results
+
+    @staticmethod
+    def best(results):
+        # Highest rate of successful samples, faster startup breaks ties, points that never stabilized are skipped
+        candidates = [ res for res in results if res["time_to_stable"] != None and res["samples"] > 0 ]
+        if(len(candidates) == 0):
+            return None
+        return max(candidates, key = lambda res: (res["rate"], -res["time_to_stable"]))
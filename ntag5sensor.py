@@ -11,10 +11,21 @@
 # ]
 # ///
 
-import time, sys
+import time, sys, atexit, signal, asyncio
 
 from reader.acr1552 import ACR1552
+from reader.emulator import NTAG5Emulator
+from reader.trace import TraceRecorder
+from reader.replay import ReplayReader
+from reader.iothread import ReaderThread, AsyncProxy
+from reader.multireader import MultiReaderAcquisition
+from reader.multitag import MultiTagAcquisition
+from reader.stats import OPCODE_NAMES
 from vicinity.ntag5link import *
+from vicinity.harvester import *
+from vicinity.tagcache import TagCache
+from vicinity.resume import *
+from vicinity.oneshot import *
 from vicinity.tmp117 import *
 from vicinity.tmp112 import *
 from vicinity.si1143 import *
@@ -22,6 +33,7 @@ from vicinity.si1143 import *
 from cli import argparser, display
 from cli.graph import RealtimeGraph
 from cli.heartbeat import HeartRateCalculator
+from cli.tuner import *
 
 
 # Energy selection options from CLI
@@ -79,16 +91,338 @@ SI1143_CHANNELS = {
 }
 
 
-def start_eh(chip):
-    # Start energy harvesting
-    print("info: Triggering energy harvesting")
-    chip.eh_control(trigger = True, enable = False)
-    while(not chip.check_eh_load_ok()):
-        print("info: Waiting for energy harvesting load stabilization")
-        time.sleep(0.1)
-    print("info: Energy harvesting load is stable, enabling")
-    chip.eh_control(trigger = True, enable = True)
-    print("info: Energy harvesting active")
+def start_eh(chip, watch_every = EH_WATCH_EVERY):
+    # Start energy harvesting, the returned harvester re-arms it when the load drops
+    harvester = EnergyHarvester(chip, watch_every = watch_every)
+    harvester.start()
+    return harvester
+
+def tune_eh(chip, args, setup, sample):
+    # Sweep all energy harvesting operating points with the sensor workload, without EEPROM writes
+    print(f"info: Tuning energy harvesting, {len(TUNE_CURRENTS) * len(TUNE_VOLTAGES)} operating points " +
+        f"of {args.duration} s each")
+    tuner = EnergyTuner(chip, setup, sample, duration = args.duration)
+    results = tuner.sweep()
+    best = EnergyTuner.best(results)
+    print("info: Energy harvesting operating points:")
+    display.print_tune_results(results, best)
+    if(best == None):
+        print("warning: No operating point powered the sensor reliably")
+        return
+    current, voltage = TUNE_CURRENTS[best["current"]], TUNE_VOLTAGES[best["voltage"]]
+    print(f"info: Best operating point is {best['current']} mA, {best['voltage']} V " +
+        f"with {best['rate']:.1f} samples/s")
+    # Keep harvesting at the best operating point for the rest of the session
+    EnergyHarvester(chip, current = current, voltage = voltage).start()
+    if(not args.persist):
+        print(f"info: Persist it with -p, or with: setup -c {best['current']} -v {best['voltage']}")
+        return
+    plan = chip.apply_config_profile({
+        NXP_CONFIG_ADDR_EH_CONFIG: [ chip.build_eh_ed_config(current = current, voltage = voltage)[0], None, None, None ]
+    })
+    if(len(plan) == 0):
+        print("info: Persistent configuration already uses this operating point")
+    else:
+        print("info: Wrote operating point into the persistent configuration, verified")
+
+def attach_diagnostics(acr, args, name = None, suffix = ""):
+    if(args.trace != None or args.record != None):
+        # Frames are kept in memory and written out on exit, or on demand with SIGUSR1
+        if(args.record != None):
+            acr.trace = TraceRecorder(args.record + suffix, capacity = None)
+        else:
+            acr.trace = TraceRecorder(args.trace + suffix)
+        atexit.register(acr.trace.flush)
+        if(hasattr(signal, "SIGUSR1")):
+            previous = signal.getsignal(signal.SIGUSR1)
+            def flush(signum, frame):
+                acr.trace.flush()
+                if(callable(previous)):
+                    previous(signum, frame)
+            signal.signal(signal.SIGUSR1, flush)
+    if(args.stats):
+        atexit.register(acr.stats.dump, name = name)
+        atexit.register(acr.retry.dump, name = name)
+
+def si1143_steps(si1143):
+    # Configuration steps of the SI1143 in order, with the register bytes each one leaves behind
+    # Parameter RAM writes and the start of autonomous mode cannot be read back
+    def param_set(param, value):
+        return ConfigStep(f"param_{param:02x}", lambda: si1143.command(SI1143_CMD_PARAM_SET | param, value), [ value ])
+    def register(name, register, value):
+        return ConfigStep(name, lambda: si1143.write_register(register, [ value ]), [ value ], register)
+    return [
+        # The hardware key register is needed to transition to standby mode
+        ConfigStep("hw_key", si1143.initialize, [ SI1143_HW_KEY_VALUE ], SI1143_I2C_REG_HW_KEY),
+        # Configure channel list, enable AUX, ALS IR, ALS visible, PS1 and PS2
+        param_set(SI1143_PARAM_CHLIST,
+            SI1143_CHLIST_EN_AUX | SI1143_CHLIST_EN_ALS_IR | SI1143_CHLIST_EN_ALS_VIS | SI1143_CHLIST_EN_PS1 | SI1143_CHLIST_EN_PS2),
+        # Configure which LED is driver for each channel
+        # LED1 for PS1, LED2 for PS2, and none for PS3
+        param_set(SI1143_PARAM_PSLED12_SELECT, SI1143_PSLED12_SELECT_PS1_LED1 | SI1143_PSLED12_SELECT_PS2_LED2),
+        param_set(SI1143_PARAM_PSLED3_SELECT, SI1143_PSLED3_SELECT_PS3_NONE),
+        # Configure PS ADC parameters
+        param_set(SI1143_PARAM_PS_ADC_MISC, SI1143_PS_ADC_MISC_NORMAL_SIGNAL_RANGE | SI1143_PS_ADC_MISC_NORMAL_PROX_MEAS_MODE),
+        param_set(SI1143_PARAM_PS_ADC_GAIN, SI1143_PS_ADC_GAIN_DIV_2),
+        # Setup interrupts
+        register("int_cfg", SI1143_I2C_REG_INT_CFG, 0x00), # SI1143_INT_CFG_AUTO_CLEAR | SI1143_INT_CFG_PIN_EN
+        register("irq_enable", SI1143_I2C_REG_IRQ_ENABLE, SI1143_IRQ_ENABLE_PS1_INT_EN | SI1143_IRQ_ENABLE_PS2_INT_EN),
+        register("irq_mode1", SI1143_I2C_REG_IRQ_MODE1, 0x00), # SI1143_CMD_INT_FLAG
+        # register("irq_mode2", SI1143_I2C_REG_IRQ_MODE2, SI1143_CMD_INT_RESP_ERROR),
+        # Setup measurement rate, 20ms cycle = 50Hz
+        register("meas_rate", SI1143_I2C_REG_MEAS_RATE, SI1143.compute_meas_rate(20)),
+        register("als_rate", SI1143_I2C_REG_ALS_RATE, SI1143_MEAS_AFTER_EVERY_WAKEUP),
+        register("ps_rate", SI1143_I2C_REG_PS_RATE, SI1143_MEAS_AFTER_EVERY_WAKEUP),
+        # Setup LED current, 22.4 mA for both
+        register("ps_led21", SI1143_I2C_REG_PS_LED21, (SI1143_PSLED_CURRENT_22_4 << 4) | SI1143_PSLED_CURRENT_22_4),
+        # Set auto mode for both PS and ALS
+        ConfigStep("psals_auto", lambda: si1143.command(SI1143_CMD_PSALS_AUTO), []),
+    ]
+
+def configure_si1143(si1143):
+    # Run every configuration step, including the start of the sensor
+    for step in si1143_steps(si1143):
+        step.apply()
+
+def tmp117_steps(tmp117):
+    # Continuous conversions, only the mode bits of the configuration register are compared
+    return [ ConfigStep("mode", lambda: tmp117.write_config(conversion_mode = TMP117_CONFIG_FLAG_MOD_CONT),
+        TMP117_CONFIG_FLAG_MOD_CONT.to_bytes(2, byteorder="big"), TMP117_I2C_REG_CONFIG,
+        TMP117_CONFIG_FLAG_MOD_MASK.to_bytes(2, byteorder="big")) ]
+
+def tmp112_steps(tmp112):
+    # Continuous conversions, only the shutdown bit of the configuration register is compared
+    # Oneshot conversions need no setup, every trigger writes the complete configuration
+    return [ ConfigStep("shutdown", lambda: tmp112.write_config(shutdown_mode = False, oneshot = False),
+        (0x0000).to_bytes(2, byteorder="big"), TMP112_I2C_REG_CONFIG,
+        TMP112_CONFIG_FLAG_SHUTDOWN_MODE.to_bytes(2, byteorder="big")) ]
+
+def resume_sensor(device, name, steps, store = None, key = None):
+    # Configure the sensor, skipping the steps a previous session left in place
+    session = SensorSession(device, name, steps, store, key)
+    redone = session.resume()
+    if(len(redone) == 0):
+        print(f"info: {name} configuration is still in place, skipping setup")
+    elif(len(redone) < len(steps)):
+        print(f"info: Resumed {name} configuration, redid: {', '.join(redone)}")
+    return session
+
+def process_si1143_sample(combined_data, timestamp, graph, hr_calculator):
+    # Parse data for each channel using their configured offsets
+    channel_readings = {}
+    for channel_id, config in SI1143_CHANNELS.items():
+        channel_value = int.from_bytes(combined_data[config['offset']:config['offset']+2], byteorder="little", signed=False)
+        channel_readings[channel_id] = channel_value
+    # Update the graph with new data
+    graph.update_data(channel_readings)
+    # Use PS1 data for heart rate processing (primary channel)
+    if ('PS1' in channel_readings):
+        hr_calculator.add_sample(channel_readings['PS1'], timestamp)
+    # Periodic heart rate computation
+    measures = hr_calculator.compute_heart_rate()
+    if (measures != None):
+        # Update heart rate display
+        graph.set_info_text(f"BPM: {measures['bpm']:.1f}")
+        # Display heart rate results
+        print(f"info: Heart rate: {measures['bpm']:.2f} bpm, IBI: {measures['ibi']:.2f} ms, SDNN: {measures['sdnn']:.2f} ms, " + 
+            f"RMSSD: {measures['rmssd']:.2f} ms, Peaks: {len(measures.get('peaklist', []))}")
+
+async def read_si1143(si1143, session, io, harvester, graph, hr_calculator, target_period):
+    # Each sample is read on the I/O thread while the previous one is processed
+    sensor = AsyncProxy(si1143, io)
+    sample = None
+    samples = 0
+    lost = 0
+    failed = 0
+    while(True):
+        loop_start = time.time()
+
+        # Check if window was closed
+        if graph.is_closed():
+            break
+
+        # Check the harvested supply right away after a lost sample, else once per watch interval
+        if(not await io.call(harvester.watch, sample == None and samples > 0)):
+            # The sensor lost power with the harvested supply unless the configuration still holds
+            await io.call(session.resume)
+
+        # Read all 6 channels in a single 12-byte I2C transaction
+        # ALS_VIS_DATA0 (0x22) through AUX_DATA0 (0x2C) are consecutive registers
+        read = sensor.read_register(SI1143_I2C_REG_ALS_VIS_DATA0, 12)
+        try:
+            if(sample != None):
+                process_si1143_sample(*sample, graph, hr_calculator)
+        except Exception as e:
+            # A bad sample must not stop the acquisition, count it like a lost one
+            failed += 1
+            print(f"warning: Could not process sample {samples} ({failed} failed in total): {e}")
+        samples += 1
+        try:
+            sample = (await read, loop_start)
+        except KeyboardInterrupt:
+            break
+        except Exception as e:
+            # Transient RF errors are already retried by the reader, count what is left
+            lost += 1
+            print(f"warning: Lost sample {samples} ({lost} lost in total): {e}")
+            sample = None
+
+        # Calculate elapsed time and delay to maintain 50 Hz
+        loop_elapsed = time.time() - loop_start
+        sleep_time = target_period - loop_elapsed
+        if sleep_time > 0:
+            await asyncio.sleep(sleep_time)
+    if(samples > 0):
+        print(f"info: Lost {lost} of {samples} samples ({100.0 * lost / samples:.2f} %)")
+    if(failed > 0):
+        print(f"warning: Could not process {failed} of {samples} samples")
+
+def read_oneshot(device, harvester, period):
+    # Trigger conversions on a fixed schedule, check the load before every one
+    harvester.watch_every = 1
+    print(f"info: Triggering a oneshot measurement every {period} s")
+    scheduler = OneshotScheduler(device, period)
+    try:
+        for reading, delay in scheduler.run():
+            if(reading != None):
+                print(f"info: Temperature is {reading:.3f} °C, {display.celsius_to_fahrenheit(reading):.3f} °F")
+            time.sleep(delay)
+            if(reading != None):
+                harvester.watch()
+    except KeyboardInterrupt:
+        pass
+    if(scheduler.missed > 0):
+        print(f"warning: Skipped {scheduler.missed} conversions that could not start in time")
+    if(scheduler.lost > 0):
+        print(f"warning: Started {scheduler.lost} conversions again after their result did not show up")
+
+def oneshot_samples(device, harvester, period, emit):
+    # Generator version of read_oneshot, yields the conversion waits so other tags can use the reader
+    harvester.watch_every = 1
+    for reading, delay in OneshotScheduler(device, period).run():
+        if(reading != None):
+            emit(temperature = reading)
+        yield delay
+        if(reading != None):
+            harvester.watch()
+
+def read_tmp117_samples(chip, args, emit):
+    # Generator polling the sensor once per step, yields the time until the next step
+    harvester = start_eh(chip)
+    tmp117 = TMP117(chip, args.address)
+    if(args.mode == "oneshot"):
+        yield from oneshot_samples(tmp117, harvester, args.period, emit)
+    elif(args.mode == "continuous"):
+        session = SensorSession(tmp117, "TMP117", tmp117_steps(tmp117))
+        session.resume()
+        # Polls follow the conversion cycle, check the load about once per second
+        cycle = tmp117.read_conversion_cycle()
+        harvester.watch_every = max(1, round(1.0 / cycle))
+        for reading, delay in tmp117.stream_temperature(cycle):
+            if(reading != None):
+                emit(temperature = reading)
+            yield delay
+            if(not harvester.watch()):
+                session.resume()
+
+def read_tmp112_samples(chip, args, emit):
+    harvester = start_eh(chip)
+    tmp112 = TMP112(chip, args.address)
+    if(args.mode == "oneshot"):
+        yield from oneshot_samples(tmp112, harvester, args.period, emit)
+    elif(args.mode == "continuous"):
+        session = SensorSession(tmp112, "TMP112", tmp112_steps(tmp112))
+        session.resume()
+        while(True):
+            if(not harvester.watch()):
+                session.resume()
+            reading = tmp112.read_temperature()
+            if(reading != None):
+                emit(temperature = reading)
+                yield 0.1
+            else:
+                yield 0
+
+def read_si1143_samples(chip, args, emit):
+    harvester = start_eh(chip)
+    si1143 = SI1143(chip)
+    session = SensorSession(si1143, "SI1143", si1143_steps(si1143))
+    session.resume()
+    target_period = 0.02  # 20ms for 50 Hz
+    while(True):
+        loop_start = time.time()
+        if(not harvester.watch()):
+            session.resume()
+        combined_data = si1143.read_register(SI1143_I2C_REG_ALS_VIS_DATA0, 12)
+        emit(channels = { channel_id: int.from_bytes(combined_data[config['offset']:config['offset']+2], byteorder="little", signed=False)
+            for channel_id, config in SI1143_CHANNELS.items() })
+        yield target_period - (time.time() - loop_start)
+
+# Sample generators of the read actions, used when acquiring from several readers or tags
+SAMPLE_WORKERS = {
+    "tmp117": read_tmp117_samples,
+    "tmp112": read_tmp112_samples,
+    "si1143": read_si1143_samples,
+}
+
+def print_samples(samples):
+    # Print a merged stream of samples, each tagged with its time and source
+    hr_calculators = {}
+    for sample in samples:
+        source = f"{sample['time']:.3f} {sample['reader']} [{sample['uid'].hex() if sample['uid'] else 'unknown'}]"
+        if("error" in sample):
+            print(f"error: {source}: {sample['error']}")
+        elif("temperature" in sample):
+            reading = sample["temperature"]
+            print(f"info: {source}: Temperature is {reading:.3f} °C, {display.celsius_to_fahrenheit(reading):.3f} °F")
+        elif("channels" in sample):
+            channels = sample["channels"]
+            print(f"info: {source}: " + ", ".join(f"{channel_id} {value}" for channel_id, value in channels.items()))
+            # Heart rate per source, using PS1 data
+            if(sample["reader"] not in hr_calculators):
+                hr_calculators[sample["reader"]] = HeartRateCalculator(buffer_size = 500, computation_interval = 5.0, min_samples = 150)
+            hr_calculator = hr_calculators[sample["reader"]]
+            hr_calculator.add_sample(channels["PS1"], sample["time"])
+            measures = hr_calculator.compute_heart_rate()
+            if(measures != None):
+                print(f"info: {source}: Heart rate: {measures['bpm']:.2f} bpm, IBI: {measures['ibi']:.2f} ms")
+
+def read_all_readers(args):
+    # Run the selected read action on every reader in its own thread, printing one merged stream
+    if(args.emulate):
+        connections = NTAG5Emulator.cli_create_connect_all(args)
+    else:
+        connections = ACR1552.cli_create_connect_all(args)
+    for index, (name, acr) in enumerate(connections):
+        attach_diagnostics(acr, args, name = name, suffix = f".{index}")
+    worker = SAMPLE_WORKERS[args.action]
+    acquisition = MultiReaderAcquisition([ (name, NTAG5Link(acr)) for name, acr in connections ])
+    try:
+        print_samples(acquisition.run(lambda chip, emit: worker(chip, args, emit)))
+    except KeyboardInterrupt:
+        pass
+    for name, acr in connections:
+        acr.disconnect()
+
+def read_all_tags(acr, args):
+    # Run the selected read action on every tag in the field of one reader, polling them in turn
+    uids = NTAG5Link(acr).inventory(args.slots)
+    if(len(uids) == 0):
+        raise Exception("No tags found in the reader field")
+    print(f"info: Found {len(uids)} tags: {', '.join(uid.hex() for uid in uids)}")
+    chips = []
+    for uid in uids:
+        chip = NTAG5Link(acr)
+        chip.address(uid)
+        chips.append(chip)
+    worker = SAMPLE_WORKERS[args.action]
+    acquisition = MultiTagAcquisition(chips, select = args.select)
+    try:
+        print_samples(acquisition.run(lambda chip, emit: worker(chip, args, emit)))
+    except KeyboardInterrupt:
+        pass
+    for uid in uids:
+        print(f"info: Tag {uid.hex()} used the reader for {acquisition.usage.get(uid, 0.0):.3f} s")
 
 if __name__ == "__main__":
     parser, args = argparser.parse()
@@ -101,12 +435,54 @@ if __name__ == "__main__":
         for i, reader in enumerate(readers):
             print(f"{i}: {reader}")
         exit(1)
+
+    # Decode a recorded trace file, no reader needed
+    if(args.action == "trace"):
+        frames = TraceRecorder.load(args.file)
+        print(f"info: Trace of {len(frames)} frames:")
+        display.print_trace(frames, TraceRecorder.describe)
+        exit(0)
    
-    # Connect to chip on specified reader
-    acr = ACR1552.cli_create_connect(args)
-    acr.trace = args.trace
+    # Read from all readers in parallel if selected
+    if(args.all_readers):
+        read_all_readers(args)
+        exit(0)
+
+    # Connect to chip on specified reader, to the emulated chip, or to a recorded session
+    if(args.emulate):
+        acr = NTAG5Emulator.cli_create_connect(args)
+    elif(args.replay != None):
+        acr = ReplayReader.cli_create_connect(args)
+    else:
+        acr = ACR1552.cli_create_connect(args)
+    attach_diagnostics(acr, args)
+
+    # Read from all tags in the reader field if selected
+    if(args.all_tags):
+        read_all_tags(acr, args)
+        acr.disconnect()
+        exit(0)
+
+    # List the tags in the reader field, before any unaddressed command makes them collide
+    if(args.action == "inventory"):
+        uids = NTAG5Link(acr).inventory(args.slots)
+        print(f"info: Found {len(uids)} tags in the reader field:")
+        for uid in uids:
+            print(f" - {uid.hex()}")
+        acr.disconnect()
+        exit(0)
+
     chip = NTAG5Link(acr)
 
+    # Identify the tag, a known tag is not asked for its capabilities again
+    # Emulated tags do not keep their state between runs, recorded sessions must repeat every exchange
+    # The sensor configuration of the last session on this reader and tag is resumed where it still holds
+    session_store = (None, None)
+    if(not args.no_cache and not args.emulate and args.replay == None and args.record == None):
+        if(chip.identify(TagCache())):
+            print(f"info: Known tag with UID {chip.uid.hex()}, using cached capabilities")
+        session_store = (SessionStore(), SessionStore.key(acr.name, chip.uid))
+
     # Perform selected action
     if(args.action == "info"):
         # Display system information
@@ -131,21 +507,70 @@ if __name__ == "__main__":
     elif(args.action == "setup"):
         # Setup chip for energy harvesting and I2C transfer
         # These write command work despite the reader claiming they timed out (TODO: investigate)
-        print("info: Writing persistent configuration")
-        print("info: Writing CONFIG_0 defaults, except low field strength energy harvesting mode")
-        chip.write_config0(eh_mode = NXP_CONFIG_0_EH_MODE_LOW_FIELD_STRENGTH)
-        print("info: Writing CONFIG_1 defaults, except SRAM enable, I2C master mode")
-        chip.write_config1(sram_enable = True, use_case = NXP_CONFIG_1_USE_CASE_CONF_I2C_MASTER)
-        print("info: Writing CONFIG_2 defaults, except GPIO 0 and GPIO 1 disable")
-        chip.write_config2(gpio0_in = NXP_CONFIG_2_GPIO0_PAD_IN_DISABLED, gpio1_in = NXP_CONFIG_2_GPIO1_PAD_IN_DISABLED)
-        print(f"info: Writing output voltage: {args.voltage} V, energy harvesting trigger current: {args.current} mA")
-        chip.write_eh_ed_config(current = I_SEL_CLI.get(args.current, NXP_EH_CONFIG_EH_VOUT_I_SEL_0_4), 
-            voltage = V_SEL_CLI.get(args.voltage, NXP_EH_CONFIG_EH_VOUT_V_SEL_1_8))
-        print("warning: If the configuration has changed, power-cycle the chip once now")
+        profile = {
+            # CONFIG_0, CONFIG_1 and CONFIG_2 defaults, except low field strength energy harvesting mode,
+            # SRAM enable, I2C master mode, GPIO 0 and GPIO 1 disable
+            NXP_CONFIG_ADDR_CONFIG: [
+                chip.build_config0(eh_mode = NXP_CONFIG_0_EH_MODE_LOW_FIELD_STRENGTH),
+                chip.build_config1(sram_enable = True, use_case = NXP_CONFIG_1_USE_CASE_CONF_I2C_MASTER),
+                chip.build_config2(gpio0_in = NXP_CONFIG_2_GPIO0_PAD_IN_DISABLED, gpio1_in = NXP_CONFIG_2_GPIO1_PAD_IN_DISABLED),
+                None
+            ],
+            NXP_CONFIG_ADDR_EH_CONFIG: list(chip.build_eh_ed_config(
+                current = I_SEL_CLI.get(args.current, NXP_EH_CONFIG_EH_VOUT_I_SEL_0_4), 
+                voltage = V_SEL_CLI.get(args.voltage, NXP_EH_CONFIG_EH_VOUT_V_SEL_1_8)))
+        }
+        print(f"info: Applying persistent configuration, output voltage: {args.voltage} V, " +
+            f"energy harvesting trigger current: {args.current} mA")
+        plan = chip.apply_config_profile(profile)
+        if(len(plan) == 0):
+            print("info: Persistent configuration is already up to date")
+        else:
+            for address, current, target in plan:
+                print(f"info: Wrote config block 0x{address:02x}: {current.hex()} -> {target.hex()}, verified")
+            print("warning: The configuration has changed, power-cycle the chip once now")
+
+    elif(args.action == "dump"):
+        # Read the complete user memory in as few frames as possible
+        info = chip.get_extended_system_info()
+        image = MemoryImage(0, info["numblocks"], info["blocksize"])
+        start = time.time()
+        for chunk in chip.stream_memory(image):
+            pass
+        elapsed = time.time() - start
+        throughput = len(image.data) / elapsed if elapsed > 0 else 0.0
+        print(f"info: Read {len(image.data)} bytes in {elapsed:.3f} s, {throughput:.0f} bytes/s, " +
+            f"up to {chip.read_chunk} blocks per frame")
+        if(args.output != None):
+            with open(args.output, "wb") as file:
+                file.write(image.data)
+            print(f"info: Wrote user memory to {args.output}, locked blocks: {image.locked_blocks()}")
+        else:
+            print("info: User memory:")
+            display.print_memory(image)
+
+    elif(args.action == "write"):
+        # Stream a file into user memory, verified by reading it back
+        with open(args.file, "rb") as file:
+            content = file.read()
+        info = chip.get_extended_system_info()
+        end_block = args.block + (len(content) + info["blocksize"] - 1) // info["blocksize"]
+        if(args.block < 0 or end_block > info["numblocks"]):
+            print(f"error: Writing {len(content)} bytes from block {args.block} exceeds the " +
+                f"{info['numblocks']} blocks of user memory")
+            acr.disconnect()
+            exit(1)
+        print(f"info: Writing {len(content)} bytes from block {args.block}")
+        result = chip.write_memory(args.block, content, info["blocksize"], info["cmdlist"])
+        print(f"info: Wrote {result['bytes']} bytes in {result['frames']} frames of " +
+            f"{OPCODE_NAMES.get(result['command'], 'UNKNOWN')} in {result['elapsed']:.3f} s, " +
+            f"{result['throughput']:.0f} bytes/s, verified")
+        if(len(result["rewrites"]) > 0):
+            print(f"warning: Blocks {result['rewrites']} did not verify at first and were written again")
 
     elif(args.action == "tmp117"):
         # Start energy harvesting
-        start_eh(chip)
+        harvester = start_eh(chip)
 
         # Connect to attached TMP117 sensor
         print("info: Connecting to TMP117 sensor")
@@ -175,39 +600,37 @@ if __name__ == "__main__":
                 conversion_averaging = avg, eeprom_persistent = True)
             print("info: Successfully wrote persistent configuration")
 
+        elif(args.verb == "tune"):
+            # Sample the temperature register as fast as possible at every operating point
+            tune_eh(chip, args, 
+                lambda: tmp117.write_config(conversion_mode = TMP117_CONFIG_FLAG_MOD_CONT),
+                lambda: tmp117.read_register(TMP117_I2C_REG_TEMP_RESULT, 2))
+
         elif(args.verb == "read"):
             # Sample temperature data from the sensor
             if(args.mode == "oneshot"):
                 # In oneshot mode, manually trigger conversions
-                while(True):
-                    try:
-                        print("info: Triggering oneshot measurement")
-                        tmp117.write_config(conversion_mode = TMP117_CONFIG_FLAG_MOD_ONESHOT)
-                        # Poll for data available
-                        while(True):
-                            reading = tmp117.read_temperature()
-                            if(reading != None):
-                                print(f"info: Temperature is {reading:.3f} °C, {display.celsius_to_fahrenheit(reading):.3f} °F")
-                                break
-                        print("info: Waiting for 2 seconds")
-                        time.sleep(2)
-                    except KeyboardInterrupt:
-                        break
+                read_oneshot(tmp117, harvester, args.period)
             elif(args.mode == "continuous"):
                 print("info: Running in continuous measurement mode")
-                tmp117.write_config(conversion_mode = TMP117_CONFIG_FLAG_MOD_CONT)
-                # In continuous mode, just poll for data available
-                while(True):
-                    try:
-                        reading = tmp117.read_temperature()
+                session = resume_sensor(tmp117, "TMP117", tmp117_steps(tmp117), *session_store)
+                # In continuous mode, poll once per conversion cycle, check the load about once per second
+                cycle = tmp117.read_conversion_cycle()
+                print(f"info: Conversion cycle is {cycle * 1000.0:g} ms")
+                harvester.watch_every = max(1, round(1.0 / cycle))
+                try:
+                    for reading, delay in tmp117.stream_temperature(cycle):
                         if(reading != None):
                             print(f"info: Temperature is {reading:.3f} °C, {display.celsius_to_fahrenheit(reading):.3f} °F")
-                    except KeyboardInterrupt:
-                        break
+                        time.sleep(delay)
+                        if(not harvester.watch()):
+                            session.resume()
+                except KeyboardInterrupt:
+                    pass
 
     elif(args.action == "tmp112"):
         # Start energy harvesting
-        start_eh(chip)
+        harvester = start_eh(chip)
 
         # Connect to attached TMP112 sensor
         print("info: Connecting to TMP112 sensor")
@@ -219,31 +642,25 @@ if __name__ == "__main__":
             tmp112_config_info = tmp112.get_config_info()
             display.print_tmp112_config_info(tmp112_config_info)
 
+        elif(args.verb == "tune"):
+            # Sample the temperature register as fast as possible at every operating point
+            tune_eh(chip, args, 
+                lambda: tmp112.write_config(shutdown_mode = False, oneshot = False),
+                lambda: tmp112.read_register(TMP112_I2C_REG_TEMP_RESULT, 2))
+
         elif(args.verb == "read"):
             # Sample temperature data from the sensor
             if(args.mode == "oneshot"):
                 # In oneshot mode, manually trigger conversions
-                tmp112.write_config(shutdown_mode = True, oneshot = False)
-                while(True):
-                    try:
-                        print("info: Triggering oneshot measurement")
-                        tmp112.write_config(oneshot = True)
-                        # Poll for data available
-                        while(True):
-                            reading = tmp112.read_temperature()
-                            if(reading != None):
-                                print(f"info: Temperature is {reading:.3f} °C, {display.celsius_to_fahrenheit(reading):.3f} °F")
-                                break
-                        print("info: Waiting for 2 seconds")
-                        time.sleep(2)
-                    except KeyboardInterrupt:
-                        break
+                read_oneshot(tmp112, harvester, args.period)
             elif(args.mode == "continuous"):
                 print("info: Running in continuous measurement mode")
-                tmp112.write_config(shutdown_mode = False, oneshot = False)
+                session = resume_sensor(tmp112, "TMP112", tmp112_steps(tmp112), *session_store)
                 # In continuous mode, just poll for data available
                 while(True):
                     try:
+                        if(not harvester.watch()):
+                            session.resume()
                         reading = tmp112.read_temperature()
                         if(reading != None):
                             print(f"info: Temperature is {reading:.3f} °C, {display.celsius_to_fahrenheit(reading):.3f} °F")
@@ -253,46 +670,30 @@ if __name__ == "__main__":
 
     elif(args.action == "si1143"):
         # Start energy harvesting
-        start_eh(chip)
+        harvester = start_eh(chip)
 
         # Connect to attached SI1143 sensor
         print("info: Connecting to SI1143 sensor")
         si1143 = SI1143(chip)
 
-        # Start the sensor
-        si1143.initialize()
-
         if(args.verb == "info"):
+            # Start the sensor
+            si1143.initialize()
+
             # Display SI1143 info
             print("info: SI1143 information:")
             si1143_info = si1143.get_info()
             display.print_si1143_info(si1143_info)
 
+        elif(args.verb == "tune"):
+            # Read all channels as fast as possible at every operating point
+            tune_eh(chip, args, 
+                lambda: configure_si1143(si1143),
+                lambda: si1143.read_register(SI1143_I2C_REG_ALS_VIS_DATA0, 12))
+
         elif(args.verb == "read"):
             print("info: Configuring SI1143 sensor for measurements")
-            # Configure channel list, enable AUX, ALS IR, ALS visible, PS1 and PS2
-            si1143.command(SI1143_CMD_PARAM_SET | SI1143_PARAM_CHLIST, 
-                SI1143_CHLIST_EN_AUX | SI1143_CHLIST_EN_ALS_IR | SI1143_CHLIST_EN_ALS_VIS | SI1143_CHLIST_EN_PS1 | SI1143_CHLIST_EN_PS2)
-            # Configure which LED is driver for each channel
-            # LED1 for PS1, LED2 for PS2, and none for PS3
-            si1143.command(SI1143_CMD_PARAM_SET | SI1143_PARAM_PSLED12_SELECT, SI1143_PSLED12_SELECT_PS1_LED1 | SI1143_PSLED12_SELECT_PS2_LED2)
-            si1143.command(SI1143_CMD_PARAM_SET | SI1143_PARAM_PSLED3_SELECT, SI1143_PSLED3_SELECT_PS3_NONE)
-            # Configure PS ADC parameters
-            si1143.command(SI1143_CMD_PARAM_SET | SI1143_PARAM_PS_ADC_MISC, SI1143_PS_ADC_MISC_NORMAL_SIGNAL_RANGE | SI1143_PS_ADC_MISC_NORMAL_PROX_MEAS_MODE)
-            si1143.command(SI1143_CMD_PARAM_SET | SI1143_PARAM_PS_ADC_GAIN, SI1143_PS_ADC_GAIN_DIV_2)
-            # Setup interrupts
-            si1143.write_register(SI1143_I2C_REG_INT_CFG, [ 0x00 ]) # [SI1143_INT_CFG_AUTO_CLEAR | SI1143_INT_CFG_PIN_EN])
-            si1143.write_register(SI1143_I2C_REG_IRQ_ENABLE, [SI1143_IRQ_ENABLE_PS1_INT_EN | SI1143_IRQ_ENABLE_PS2_INT_EN])
-            si1143.write_register(SI1143_I2C_REG_IRQ_MODE1, [ 0x00 ]) # [SI1143_CMD_INT_FLAG])
-            # si1143.write_register(SI1143_I2C_REG_IRQ_MODE2, [SI1143_CMD_INT_RESP_ERROR])
-            # Setup measurement rate, 20ms cycle = 50Hz
-            si1143.write_register(SI1143_I2C_REG_MEAS_RATE, [SI1143.compute_meas_rate(20)])
-            si1143.write_register(SI1143_I2C_REG_ALS_RATE, [SI1143_MEAS_AFTER_EVERY_WAKEUP])
-            si1143.write_register(SI1143_I2C_REG_PS_RATE, [SI1143_MEAS_AFTER_EVERY_WAKEUP])
-            # Setup LED current, 22.4 mA for both
-            si1143.write_register(SI1143_I2C_REG_PS_LED21, [(SI1143_PSLED_CURRENT_22_4 << 4) | SI1143_PSLED_CURRENT_22_4])
-            # Set auto mode for both PS and ALS
-            si1143.command(SI1143_CMD_PSALS_AUTO)
+            session = resume_sensor(si1143, "SI1143", si1143_steps(si1143), *session_store)
 
             # Read sensor measurements continuously
             print("info: Reading SI1143 sensor data")
@@ -304,44 +705,17 @@ if __name__ == "__main__":
             # Create heart rate calculator (using PS1 for heart rate calculation)
             hr_calculator = HeartRateCalculator(buffer_size = 500, computation_interval = 5.0, min_samples = 150)
             target_period = 0.02  # 20ms for 50 Hz
-
-            while(True):
-                loop_start = time.time()
-
-                # Check if window was closed
-                if graph.is_closed():
-                    break
-
-                try:
-                    # Read all 6 channels in a single 12-byte I2C transaction
-                    # ALS_VIS_DATA0 (0x22) through AUX_DATA0 (0x2C) are consecutive registers
-                    combined_data = si1143.read_register(SI1143_I2C_REG_ALS_VIS_DATA0, 12)
-                    # Parse data for each channel using their configured offsets
-                    channel_readings = {}
-                    for channel_id, config in SI1143_CHANNELS.items():
-                        channel_value = int.from_bytes(combined_data[config['offset']:config['offset']+2], byteorder="little", signed=False)
-                        channel_readings[channel_id] = channel_value
-                    # Update the graph with new data
-                    graph.update_data(channel_readings)
-                    # Use PS1 data for heart rate processing (primary channel)
-                    if ('PS1' in channel_readings):
-                        hr_calculator.add_sample(channel_readings['PS1'], loop_start)
-                    # Periodic heart rate computation
-                    measures = hr_calculator.compute_heart_rate()
-                    if (measures != None):
-                        # Update heart rate display
-                        graph.set_info_text(f"BPM: {measures['bpm']:.1f}")
-                        # Display heart rate results
-                        print(f"info: Heart rate: {measures['bpm']:.2f} bpm, IBI: {measures['ibi']:.2f} ms, SDNN: {measures['sdnn']:.2f} ms, " + 
-                            f"RMSSD: {measures['rmssd']:.2f} ms, Peaks: {len(measures.get('peaklist', []))}")
-                except Exception as e:
-                    pass
-
-                # Calculate elapsed time and delay to maintain 50 Hz
-                loop_elapsed = time.time() - loop_start
-                sleep_time = target_period - loop_elapsed
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
+            if(args.replay != None and args.unthrottled):
+                # Run the pipeline as fast as the recorded traffic can be replayed
+                target_period = 0
+
+            # Exchanges run on a dedicated I/O thread, so the graph and heart rate analysis do not stall the RF link
+            io = ReaderThread(acr)
+            try:
+                asyncio.run(read_si1143(si1143, session, io, harvester, graph, hr_calculator, target_period))
+            except KeyboardInterrupt:
+                pass
+            io.close()
 
             print("info: Window closed, exiting...")
             
@@ -0,0 +1,59 @@
+# Command codes, flags and error codes of the air interface, shared by the tag drivers and the reader backends
+
+# Command flags
+ISO_FLAG_SUB_CARRIER =                      (1 << 0)
+ISO_FLAG_DATA_RATE =                        (1 << 1)
+ISO_FLAG_INVENTORY =                        (1 << 2)
+ISO_FLAG_PROTOCOL_EXTENSION =               (1 << 3)
+
+# Request flags when inventory flag is NOT set
+ISO_FLAG_SELECT =                           (1 << 4)
+ISO_FLAG_ADDRESS =                          (1 << 5)
+ISO_FLAG_OPTION =                           (1 << 6)
+ISO_FLAG_RFU =                              (1 << 7)
+
+# Request flags when inventory flag is set. Bits 7 to 8 are the same as before.
+ISO_FLAG_AFI =                              (1 << 4)
+ISO_FLAG_NB_SLOTS =                         (1 << 5)
+
+# Response flags
+ISO_FLAG_ERROR =                            (1 << 0)
+
+# ISO15693 command codes
+ISO_CMD_INVENTORY =                         0x01
+ISO_CMD_SELECT =                            0x25
+ISO_CMD_RESET_TO_READY =                    0x26
+ISO_CMD_SYSTEM_INFO =                       0x2B
+ISO_CMD_EXTENDED_SYSTEM_INFO =              0x3B
+ISO_CMD_READ_SINGLE_BLOCK =                 0x20
+ISO_CMD_READ_MULTIPLE_BLOCKS =              0x23
+ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS =     0x3D
+ISO_CMD_WRITE_SINGLE_BLOCK =                0x21
+ISO_CMD_WRITE_MULTIPLE_BLOCKS =             0x24
+ISO_CMD_EXT_WRITE_SINGLE_BLOCK =            0x31
+ISO_CMD_EXT_WRITE_MULTIPLE_BLOCKS =         0x34
+
+# Custom and proprietary commands take the UID after the manufacturer code when addressed
+ISO_CMD_CUSTOM_FIRST =                      0xA0
+
+# NXP custom command codes
+NXP_CMD_SYSTEM_INFO =                       0xAB
+NXP_CMD_READ_CONFIG =                       0xC0
+NXP_CMD_WRITE_CONFIG =                      0xC1
+NXP_CMD_READ_SRAM =                         0xD2
+NXP_CMD_READ_I2C =                          0xD5
+NXP_CMD_WRITE_I2C =                         0xD4
+
+# Command parameters
+NXP_CMD_MANUF_CODE_NXP =                    0x04
+
+# ISO15693 error codes
+ISO_ERROR_UNSUPPORTED_CMD =                 0x01
+ISO_ERROR_UNRECOGNIZED_CMD =                0x02
+ISO_ERROR_UNSUPPORTED_OPTION =              0x03
+ISO_ERROR_UNKNOWN =                         0x0F
+ISO_ERROR_UNAVAILABLE_BLOCK =               0x10
+ISO_ERROR_ALREADY_LOCKED_BLOCK =            0x11
+ISO_ERROR_LOCKED_BLOCK =                    0x12
+ISO_ERROR_UNSUCCESSFUL_PROGRAMMING =        0x13
+ISO_ERROR_UNSUCCESSFUL_LOCKING =            0x14
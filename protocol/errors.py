@@ -0,0 +1,45 @@
+class TransportError(Exception):
+    # Base class of all errors reported by a reader exchange
+    pass
+
+
+class TransmissionError(TransportError):
+    # The RF frame was corrupted on the air, the exchange can be attempted again
+    pass
+
+
+class CRCError(TransmissionError):
+    pass
+
+
+class CollisionError(TransmissionError):
+    pass
+
+
+class ParityError(TransmissionError):
+    pass
+
+
+class FramingError(TransmissionError):
+    pass
+
+
+class NoResponseError(TransportError):
+    # The tag did not answer within the frame waiting time
+    pass
+
+
+class PseudoAPDUError(TransportError):
+    # The reader rejected the pseudo APDU or one of its data objects
+    pass
+
+
+class ISO15693Error(TransportError):
+    # The tag answered with the ISO15693 error flag set
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+# Errors that may clear up when the same exchange is repeated
+TRANSIENT_ERRORS = (TransmissionError, NoResponseError)
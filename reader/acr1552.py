@@ -1,6 +1,22 @@
-from ber_tlv.tlv import *
+import time
 
+from ber_tlv.tlv import Tlv
+
+from protocol.errors import (
+    CRCError, CollisionError, FramingError, ISO15693Error, NoResponseError, ParityError, PseudoAPDUError,
+    TransportError)
+from protocol.commands import (
+    ISO_CMD_INVENTORY, ISO_ERROR_ALREADY_LOCKED_BLOCK, ISO_ERROR_LOCKED_BLOCK, ISO_ERROR_UNAVAILABLE_BLOCK,
+    ISO_ERROR_UNKNOWN, ISO_ERROR_UNRECOGNIZED_CMD, ISO_ERROR_UNSUCCESSFUL_LOCKING,
+    ISO_ERROR_UNSUCCESSFUL_PROGRAMMING, ISO_ERROR_UNSUPPORTED_CMD, ISO_ERROR_UNSUPPORTED_OPTION,
+    ISO_FLAG_ADDRESS, ISO_FLAG_ERROR, NXP_CMD_READ_SRAM)
+
+from .stats import (
+    ExchangeStats, OPCODE_BATCH, OUTCOME_COLLISION, OUTCOME_CRC, OUTCOME_ERROR, OUTCOME_FRAMING,
+    OUTCOME_PARITY, OUTCOME_SUCCESS, OUTCOME_TIMEOUT)
 from . import pcscreader
+from .timeout import TimeoutPolicy
+from .retry import RetryPolicy
 
 
 # Wrapping APDU fields
@@ -41,6 +57,25 @@ TLV_TAG_RESP_STATUS_ERROR_RFU =             0xF0
 
 TLV_TAG_RESP_FRAMING_FIELD_NBITS_MASK =     0x07
 
+# Precompiled transparent exchange frame, timeout and FWTI are patched in per command
+# FWTI: 0 ~ 15, FWT/Timeout = 302.07 x 2FWTI us
+EXCHANGE_HEADER =                           bytes([CLA_PSEUDO, INS_TRANS, 0x00, TRANS_FUNC_EXCHANGE, 0x00])
+EXCHANGE_PARAMETERS =                       bytes(Tlv.build([
+                                                (TLV_TAG_CMD_TIMEOUT, (1000000).to_bytes(4, "big")),
+                                                (TLV_TAG_CMD_FWTI, TLV_TAG_CMD_FWTI_PREFIX + bytes([ 15 ]))]))
+EXCHANGE_DATA_OFFSET =                      len(EXCHANGE_HEADER) + len(EXCHANGE_PARAMETERS)
+EXCHANGE_TIMEOUT_OFFSET =                   len(EXCHANGE_HEADER) + 3
+EXCHANGE_FWTI_OFFSET =                      EXCHANGE_DATA_OFFSET - 1
+# Short APDU: Lc is one byte, the data object header takes up to three bytes
+EXCHANGE_MAX_OBJECTS =                      0xFF - len(EXCHANGE_PARAMETERS)
+EXCHANGE_MAX_DATA =                         EXCHANGE_MAX_OBJECTS - 3
+# Short response: 256 bytes before the status word, the error status object takes five of them
+EXCHANGE_MAX_RESPONSE =                     0x100 - 5
+# Framing, status and data object headers of every exchange in the response
+EXCHANGE_RESPONSE_HEADERS =                 3 + 4 + 3
+# Expected response without headers, flags and one block, unless the frame is an SRAM read
+EXCHANGE_RESPONSE_DEFAULT =                 1 + 4
+
 # PCSC error code
 PCSC_SUCCESS =                              (0x90, 0x00)
 PCSC_ERROR_UNAVAILABLE_INFORMATION =        (0x62, 0x82)
@@ -53,24 +88,29 @@ PCSC_EXECUTION_ERROR_IFD =                  (0x64, 0x00)
 PCSC_EXECUTION_ERROR_ICC =                  (0x64, 0x01)
 PCSC_DATA_OBJECT_FAILED =                   (0x6F, 0x00)
 
-# ISO15693 flags
-ISO_FLAG_ERROR =                            (1 << 0)
-
-# ISO15693 error codes 
-ISO_ERROR_UNSUPPORTED_CMD =                 0x01
-ISO_ERROR_UNRECOGNIZED_CMD =                0x02
-ISO_ERROR_UNSUPPORTED_OPTION =              0x03
-ISO_ERROR_UNKNOWN =                         0x0F
-ISO_ERROR_UNAVAILABLE_BLOCK =               0x10
-ISO_ERROR_ALREADY_LOCKED_BLOCK =            0x11
-ISO_ERROR_LOCKED_BLOCK =                    0x12
-ISO_ERROR_UNSUCCESSFUL_PROGRAMMING =        0x13
-ISO_ERROR_UNSUCCESSFUL_LOCKING =            0x14
+# Error codes of readers not accepting several exchange data objects in one APDU
+PCSC_BATCH_UNSUPPORTED = (
+    PCSC_UNSUPPORTED_DATA_OBJECT,
+    PCSC_UNEXPECTED_LENGTH,
+    PCSC_UNEXPECTED_VALUE,
+)
 
 
 class ACR1552(pcscreader.PCSCReader):
     def __init__(self):
-        self.trace = False
+        # Trace recorder receiving every frame, see reader.trace
+        self.trace = None
+        # Exchange frames are assembled in place, only the data object changes per command
+        self._frame = bytearray(EXCHANGE_HEADER + EXCHANGE_PARAMETERS + bytes(EXCHANGE_MAX_DATA + 4))
+        self._frame_view = memoryview(self._frame)
+        # Per-command timeout, learned from observed response times
+        self.timeouts = TimeoutPolicy()
+        # Latency and byte counts of every exchange, by opcode and outcome
+        self.stats = ExchangeStats()
+        # Repeats idempotent exchanges that failed on the air
+        self.retry = RetryPolicy()
+        # Cleared once the reader rejects several exchanges in one APDU
+        self.batch_supported = True
         super().__init__()
 
     @classmethod
@@ -106,11 +146,28 @@ class ACR1552(pcscreader.PCSCReader):
         print(f"found card with ATR: {reader.atr.hex()}")
         return reader
 
+    @staticmethod
+    def cli_create_connect_all(args):
+        # Connect to the cards on all available readers, as (reader name, reader) pairs
+        readers = ACR1552.list_readers()
+        readers.sort(key=str)
+        if(len(readers) == 0):
+            print("error: No ACR1552 readers found")
+            exit(1)
+        connections = []
+        for name in readers:
+            reader = ACR1552()
+            print(f"info: Waiting for card on {name} ... ", end="", flush=True)
+            reader.connect(name)
+            print(f"found card with ATR: {reader.atr.hex()}")
+            connections.append((name, reader))
+        return connections
+
     def disconnect(self):
         # End transparent NFC session
         self._transmit_pseudo(TRANS_FUNC_MANAGE, MANAGE_END_TRANSPARENT_SESSION)
 
-    def _check_pseudo_error(self, error, allow_no_response = False):
+    def _check_pseudo_error(self, error, allow_no_response = False, warn = True):
         # Check the inner response of the pseudo APDU
         bad_data, sw1, sw2 = error
         code = (sw1, sw2)
@@ -130,45 +187,134 @@ class ACR1552(pcscreader.PCSCReader):
 
         message = messages.get(code)
         if(allow_no_response and code == PCSC_EXECUTION_ERROR_ICC):
-            print(f"warning: Ignoring error: {message}")
+            if(warn):
+                print(f"warning: Ignoring error: {message}")
             return False
+        elif(code == PCSC_EXECUTION_ERROR_ICC):
+            raise NoResponseError(message.replace("XX", str(bad_data)))
         else:
             if message:
-                raise Exception(message.replace("XX", str(bad_data)))
+                raise PseudoAPDUError(message.replace("XX", str(bad_data)))
             else:
-                raise Exception(f"Unknown error: 0x{error.hex()}")
+                raise PseudoAPDUError(f"Unknown error: 0x{bytes(error).hex()}")
 
     def _transmit_pseudo(self, function, data, allow_no_response = False):
         # Send command data TLV as pseudo PCSC APDU
-        res = self.transmit_pcsc(bytes([CLA_PSEUDO, INS_TRANS, 
-            0x00, function, 
-            len(data)]) + data + bytes([ 0x00 ]))
+        start = time.perf_counter()
+        try:
+            res = self.transmit_pcsc(bytes([CLA_PSEUDO, INS_TRANS, 
+                0x00, function, 
+                len(data)]) + data + bytes([ 0x00 ]))
+        except Exception:
+            self.stats.record(data[0], OUTCOME_ERROR, time.perf_counter() - start, len(data))
+            raise
+        elapsed = time.perf_counter() - start
         # Parse PCSC response as TLV
         tlv = dict(Tlv.parse(res))
+        self.stats.record(data[0], self._exchange_outcome(tlv), elapsed, len(data), len(res))
         error = tlv[TLV_TAG_ERROR]
         if(self._check_pseudo_error(error, allow_no_response)):
             return tlv
         else:
             return None
 
+    def _build_exchange(self, frames, timeout):
+        # Splice timeout and ISO15693 frames into the precompiled exchange frame, one data object per frame
+        length = sum(len(data) + (2 if len(data) < 0x80 else 3) for data in frames)
+        if(length > EXCHANGE_MAX_OBJECTS):
+            raise Exception(f"Data objects of {length} bytes exceed the maximum of {EXCHANGE_MAX_OBJECTS} bytes")
+        frame = self._frame
+        frame[EXCHANGE_TIMEOUT_OFFSET:EXCHANGE_TIMEOUT_OFFSET + 4] = int(timeout * 1000000).to_bytes(4, "big")
+        frame[EXCHANGE_FWTI_OFFSET] = TimeoutPolicy.fwti(timeout)
+        offset = EXCHANGE_DATA_OFFSET
+        for data in frames:
+            length = len(data)
+            frame[offset] = TLV_TAG_CMD_DATA
+            if(length < 0x80):
+                frame[offset + 1] = length
+                offset += 2
+            else:
+                frame[offset + 1] = 0x81
+                frame[offset + 2] = length
+                offset += 3
+            frame[offset:offset + length] = data
+            offset += length
+        # Lc covers everything after the APDU header, Le follows the data
+        frame[len(EXCHANGE_HEADER) - 1] = offset - len(EXCHANGE_HEADER)
+        frame[offset] = 0x00
+        return self._frame_view[:offset + 1]
+
+    @staticmethod
+    def _parse_objects(res):
+        # Walk the flat response data objects, multi byte tags are reported as None, none of them are of interest
+        view = memoryview(res)
+        index = 0
+        while(index < len(view)):
+            tag = view[index]
+            index += 1
+            if(tag & 0x1F == 0x1F):
+                while(view[index] & 0x80):
+                    index += 1
+                index += 1
+                tag = None
+            length = view[index]
+            index += 1
+            if(length & 0x80):
+                num_bytes = length & 0x7F
+                length = int.from_bytes(view[index:index + num_bytes], "big")
+                index += num_bytes
+            yield tag, view[index:index + length]
+            index += length
+
+    @staticmethod
+    def _parse_exchange(res):
+        # Keep only the known tags
+        return { tag: value for tag, value in ACR1552._parse_objects(res) if(tag != None) }
+
+    @staticmethod
+    def _exchange_outcome(fields):
+        # Classify a parsed response for the statistics, the checks raise the actual errors
+        bad_data, sw1, sw2 = fields[TLV_TAG_ERROR]
+        if((sw1, sw2) == PCSC_EXECUTION_ERROR_ICC):
+            return OUTCOME_TIMEOUT
+        if(bad_data != 0x00 or (sw1, sw2) != PCSC_SUCCESS):
+            return OUTCOME_ERROR
+        status = fields.get(TLV_TAG_RESP_STATUS, b'\x00')[0]
+        if(status & TLV_TAG_RESP_STATUS_ERROR_CRC):
+            return OUTCOME_CRC
+        if(status & TLV_TAG_RESP_STATUS_ERROR_TRANSMISSION):
+            return OUTCOME_COLLISION
+        if(status & TLV_TAG_RESP_STATUS_ERROR_PARITY):
+            return OUTCOME_PARITY
+        if(status & TLV_TAG_RESP_STATUS_ERROR_FRAMING):
+            return OUTCOME_FRAMING
+        if(status & TLV_TAG_RESP_STATUS_ERROR_RFU):
+            return OUTCOME_ERROR
+        if(fields.get(TLV_TAG_RESP_FRAMING, b'\x00')[0] & TLV_TAG_RESP_FRAMING_FIELD_NBITS_MASK):
+            return OUTCOME_FRAMING
+        data = fields.get(TLV_TAG_RESP_DATA)
+        if(data and data[0] & ISO_FLAG_ERROR):
+            return OUTCOME_ERROR
+        return OUTCOME_SUCCESS
+
     def _check_transmit_error(self, status):
         # Check the response status field
         if(status & TLV_TAG_RESP_STATUS_ERROR_CRC):
-           raise Exception("CRC check failed")
+           raise CRCError("CRC check failed")
         if(status & TLV_TAG_RESP_STATUS_ERROR_TRANSMISSION):
-            raise Exception("Collision detected")
+            raise CollisionError("Collision detected")
         if(status & TLV_TAG_RESP_STATUS_ERROR_PARITY):
-            raise Exception("Parity error detected")
+            raise ParityError("Parity error detected")
         if(status & TLV_TAG_RESP_STATUS_ERROR_FRAMING):
-            raise Exception("Framing error detected")
+            raise FramingError("Framing error detected")
         if(status & TLV_TAG_RESP_STATUS_ERROR_RFU):
-            raise Exception(f"RFU error detected {status:02x}")
+            raise TransportError(f"RFU error detected {status:02x}")
 
     def _check_transmit_framing(self, framing):
         # Check number of valid bits in response, encoded in bits [2:0]
         # Zero means all are valid
         if((framing & TLV_TAG_RESP_FRAMING_FIELD_NBITS_MASK) != 0x00):
-            raise Exception(f"Invalid bits in response, framing {framing:02x}")
+            raise FramingError(f"Invalid bits in response, framing {framing:02x}")
 
     def _check_iso15693_error(self, data):
         if(not (data[0] & ISO_FLAG_ERROR)):
@@ -184,32 +330,178 @@ class ACR1552(pcscreader.PCSCReader):
             ISO_ERROR_UNSUCCESSFUL_PROGRAMMING: "The specified block was not successfully programmed.",
             ISO_ERROR_UNSUCCESSFUL_LOCKING: "The specified block was not successfully locked.",
         }
-        if 0xA0 <= data[1] <= 0xDF:
-            raise Exception(f"Custom command error code {data[1]:02x}.")
+        code = data[1]
+        if 0xA0 <= code <= 0xDF:
+            raise ISO15693Error(f"Custom command error code {code:02x}.", code)
         elif code in error_map:
-            raise Exception(error_map[code])
+            raise ISO15693Error(error_map[code], code)
         else:
-            raise Exception(f"Reserved for future use (RFU) code {data[1]:02x}")
-
-    def transmit_iso15693(self, data, allow_no_response = False):
-        # Transmit data in transparent NFC session with 1 second timeout
-        # FWTI: 0 ~ 15, FWT/Timeout = 302.07 x 2FWTI us
-        if(self.trace):
-            print(f"trace: > {data.hex()}")
-        tlv = self._transmit_pseudo(TRANS_FUNC_EXCHANGE, Tlv.build([
-            (TLV_TAG_CMD_TIMEOUT, (1000000).to_bytes(4, "big")), 
-            (TLV_TAG_CMD_FWTI, TLV_TAG_CMD_FWTI_PREFIX + bytes([ 15 ])),
-            (TLV_TAG_CMD_DATA, bytes(data))]), allow_no_response)
-        if(tlv != None):
-            # Byte 0 is response status code, byte 1 is RFU
-            self._check_transmit_error(tlv[TLV_TAG_RESP_STATUS][0])
-            self._check_transmit_framing(tlv[TLV_TAG_RESP_FRAMING][0])
-            data = tlv[TLV_TAG_RESP_DATA]
-            # Check for inner protocol errors
-            self._check_iso15693_error(data)
-            # Strip flags
-            if(self.trace):
-                print(f"trace: < {data.hex()}")
-            return data[1:]
+            raise ISO15693Error(f"Reserved for future use (RFU) code {code:02x}", code)
+
+    def transmit_iso15693(self, data, allow_no_response = False, timeout = None):
+        # Transmit data in transparent NFC session, timeout in seconds defaults to the learned one
+        # Idempotent commands are repeated on transient errors
+        return self.retry.call(data[1], self._exchange_iso15693, data, allow_no_response, timeout)
+
+    def _exchange_iso15693(self, data, allow_no_response = False, timeout = None):
+        if(self.trace != None):
+            self.trace.request(data)
+        command = data[1]
+        if(timeout == None):
+            timeout = self.timeouts.get(command)
+        frame = self._build_exchange((data,), timeout)
+        start = time.perf_counter()
+        try:
+            res = self.transmit_pcsc(frame)
+        except Exception:
+            self.stats.record(command, OUTCOME_ERROR, time.perf_counter() - start, len(data))
+            if(self.trace != None):
+                self.trace.response(b'', OUTCOME_ERROR)
+            raise
+        elapsed = time.perf_counter() - start
+        fields = self._parse_exchange(res)
+        outcome = self._exchange_outcome(fields)
+        response = fields.get(TLV_TAG_RESP_DATA, b'')
+        self.stats.record(command, outcome, elapsed, len(data), len(response))
+        if(self.trace != None):
+            self.trace.response(response, outcome)
+        if(outcome == OUTCOME_TIMEOUT):
+            self.timeouts.observe_timeout(command, timeout)
         else:
+            self.timeouts.observe(command, elapsed)
+        # Inventory slots without a tag are the normal case, not worth a warning
+        return self._check_response(fields, allow_no_response, command != ISO_CMD_INVENTORY)
+
+    def _check_response(self, fields, allow_no_response = False, warn = True):
+        if(not self._check_pseudo_error(fields[TLV_TAG_ERROR], allow_no_response, warn)):
             return b''
+        # Byte 0 is response status code, byte 1 is RFU
+        self._check_transmit_error(fields[TLV_TAG_RESP_STATUS][0])
+        self._check_transmit_framing(fields[TLV_TAG_RESP_FRAMING][0])
+        data = fields[TLV_TAG_RESP_DATA]
+        # Check for inner protocol errors
+        self._check_iso15693_error(data)
+        # Strip flags
+        return bytes(data[1:])
+
+    @staticmethod
+    def _parse_batch(res):
+        # Split the response into the error status and one group of data objects per executed exchange
+        error = None
+        groups = []
+        group = {}
+        for tag, value in ACR1552._parse_objects(res):
+            if(tag == TLV_TAG_ERROR):
+                error = value
+            elif(tag in (TLV_TAG_RESP_STATUS, TLV_TAG_RESP_FRAMING, TLV_TAG_RESP_DATA)):
+                group[tag] = value
+                # The response data object closes the group of an exchange
+                if(tag == TLV_TAG_RESP_DATA):
+                    groups.append(group)
+                    group = {}
+        return error, groups
+
+    @staticmethod
+    def _response_size(data):
+        # Expected response length of a frame, SRAM reads return up to 256 bytes
+        if(data[1] != NXP_CMD_READ_SRAM):
+            return EXCHANGE_RESPONSE_DEFAULT
+        # The block count follows the manufacturer code, the UID and the address
+        offset = 12 if(data[0] & ISO_FLAG_ADDRESS) else 4
+        return 1 + (data[offset] + 1) * 4
+
+    def _batch_size(self, frames, index):
+        # Number of frames from index on whose requests and responses fit into one APDU
+        length = 0
+        response = 0
+        count = 0
+        for data in frames[index:]:
+            length += len(data) + (2 if len(data) < 0x80 else 3)
+            response += EXCHANGE_RESPONSE_HEADERS + self._response_size(data)
+            if(length > EXCHANGE_MAX_OBJECTS or response > EXCHANGE_MAX_RESPONSE):
+                break
+            count += 1
+        return max(1, count)
+
+    def transmit_iso15693_batch(self, frames):
+        # Transmit several frames in as few transparent exchanges as the APDU size allows
+        # Returns per frame the response data without flags, the exception raised for it,
+        # or None if it was not executed because an earlier frame failed
+        # Batches are not repeated on errors, they may contain I2C transactions
+        results = []
+        index = 0
+        while(index < len(frames)):
+            if(not self.batch_supported):
+                count = 1
+                results.extend(self._exchange_sequential(frames[index:index + 1]))
+            else:
+                count = self._batch_size(frames, index)
+                results.extend(self._exchange_batch(frames[index:index + count]))
+            index += count
+            if(isinstance(results[-1], Exception) or results[-1] == None):
+                break
+        return results + [ None ] * (len(frames) - len(results))
+
+    def _exchange_sequential(self, frames):
+        results = []
+        for data in frames:
+            try:
+                results.append(self._exchange_iso15693(data))
+            except TransportError as e:
+                results.append(e)
+                break
+        return results + [ None ] * (len(frames) - len(results))
+
+    def _exchange_batch(self, frames):
+        if(len(frames) == 1):
+            return self._exchange_sequential(frames)
+        # The slowest command determines the timeout of the whole batch
+        timeout = max(self.timeouts.get(data[1]) for data in frames)
+        frame = self._build_exchange(frames, timeout)
+        tx_bytes = sum(len(data) for data in frames)
+        start = time.perf_counter()
+        try:
+            res = self.transmit_pcsc(frame)
+        except Exception:
+            self.stats.record(OPCODE_BATCH, OUTCOME_ERROR, time.perf_counter() - start, tx_bytes)
+            if(self.trace != None):
+                # The batch is replayed frame by frame, it stops at the first one
+                self.trace.request(frames[0])
+                self.trace.response(b'', OUTCOME_ERROR)
+            raise
+        elapsed = time.perf_counter() - start
+        error, groups = self._parse_batch(res)
+        if(len(groups) == 0 and error != None and (error[1], error[2]) in PCSC_BATCH_UNSUPPORTED):
+            # The reader does not accept several exchanges in one APDU, send them one by one from now on
+            print("warning: Reader does not support batched exchanges, falling back to single exchanges")
+            self.batch_supported = False
+            return self._exchange_sequential(frames)
+        # The reader only reports the time of the whole batch, it is recorded as one exchange with the
+        # outcome of the first failed frame. Batched frames are left out of the per command timeout learning
+        batch_outcome = OUTCOME_SUCCESS
+        rx_bytes = 0
+        results = []
+        for index, data in enumerate(frames):
+            if(index < len(groups)):
+                fields = dict(groups[index])
+                fields[TLV_TAG_ERROR] = bytes([0x00]) + bytes(PCSC_SUCCESS)
+            elif(error != None and (error[1], error[2]) != PCSC_SUCCESS):
+                # First exchange without a response is the one that failed
+                fields = { TLV_TAG_ERROR: error }
+            else:
+                fields = { TLV_TAG_ERROR: bytes([index]) + bytes(PCSC_DATA_OBJECT_FAILED) }
+            outcome = self._exchange_outcome(fields)
+            response = fields.get(TLV_TAG_RESP_DATA, b'')
+            rx_bytes += len(response)
+            if(batch_outcome == OUTCOME_SUCCESS):
+                batch_outcome = outcome
+            if(self.trace != None):
+                self.trace.request(data)
+                self.trace.response(response, outcome)
+            try:
+                results.append(self._check_response(fields))
+            except TransportError as e:
+                results.append(e)
+                break
+        self.stats.record(OPCODE_BATCH, batch_outcome, elapsed, tx_bytes, rx_bytes)
+        return results + [ None ] * (len(frames) - len(results))
@@ -0,0 +1,567 @@
+import time, math, random
+
+from protocol.errors import CRCError, CollisionError, ISO15693Error, NoResponseError, TransportError
+from protocol.commands import (
+    ISO_CMD_CUSTOM_FIRST, ISO_CMD_EXTENDED_SYSTEM_INFO, ISO_CMD_EXT_WRITE_SINGLE_BLOCK,
+    ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS, ISO_CMD_INVENTORY, ISO_CMD_READ_SINGLE_BLOCK, ISO_CMD_RESET_TO_READY,
+    ISO_CMD_SELECT, ISO_CMD_SYSTEM_INFO, ISO_CMD_WRITE_SINGLE_BLOCK, ISO_ERROR_LOCKED_BLOCK,
+    ISO_ERROR_UNAVAILABLE_BLOCK, ISO_ERROR_UNSUPPORTED_CMD, ISO_FLAG_ADDRESS, ISO_FLAG_AFI,
+    ISO_FLAG_ERROR, ISO_FLAG_INVENTORY, ISO_FLAG_NB_SLOTS, ISO_FLAG_OPTION, ISO_FLAG_SELECT,
+    NXP_CMD_MANUF_CODE_NXP, NXP_CMD_READ_CONFIG, NXP_CMD_READ_I2C, NXP_CMD_READ_SRAM, NXP_CMD_SYSTEM_INFO,
+    NXP_CMD_WRITE_CONFIG, NXP_CMD_WRITE_I2C)
+from vicinity.iso15693 import (
+    ISO_EXTENDED_SYSTEM_INFO_MOI, ISO_EXTENDED_SYSTEM_INFO_VICC_CMD_LIST, ISO_FLAG_SECURITY_STATUS_LOCKED,
+    ISO_SYSTEM_INFO_FLAG_AFI, ISO_SYSTEM_INFO_FLAG_DSFID, ISO_SYSTEM_INFO_FLAG_IC_REFERENCE,
+    ISO_SYSTEM_INFO_FLAG_VICC_MEMORY_SIZE)
+from vicinity.ntag5link import (
+    NXP_CONFIG_ADDR_CONFIG, NXP_CONFIG_ADDR_EH_CONFIG, NXP_CONFIG_ADDR_EH_CONFIG_REG,
+    NXP_CONFIG_ADDR_I2C_M_STATUS_REG, NXP_EH_CONFIG_EH_VOUT_I_SEL_12_5, NXP_EH_ENABLE, NXP_EH_LOAD_OK,
+    NXP_EH_TRIGGER, NXP_I2C_M_BUSY_MASK, NXP_I2C_M_TRANS_STATUS_ADDRESS_NAK, NXP_I2C_M_TRANS_STATUS_RESET,
+    NXP_I2C_M_TRANS_STATUS_SUCCESS)
+from vicinity.si1143 import (
+    SI1143_CMD_NOP, SI1143_CMD_PARAM_QUERY, SI1143_CMD_PARAM_SET, SI1143_CMD_RESET, SI1143_I2C_ADDRESS,
+    SI1143_I2C_REG_ALS_VIS_DATA0, SI1143_I2C_REG_AUX_DATA1, SI1143_I2C_REG_COMMAND,
+    SI1143_I2C_REG_PARAM_RD, SI1143_I2C_REG_PARAM_WR, SI1143_I2C_REG_PART_ID, SI1143_I2C_REG_PS1_DATA0,
+    SI1143_I2C_REG_PS2_DATA1, SI1143_I2C_REG_RESPONSE, SI1143_I2C_REG_REV_ID, SI1143_I2C_REG_SEQ_ID,
+    SI1143_PART_ID_SI1143, SI1143_SEQ_ID_A10)
+from vicinity.tmp112 import (
+    TMP112_I2C_REG_CONFIG, TMP112_I2C_REG_TEMP_RESULT, TMP112_I2C_REG_THIGH_LIMIT,
+    TMP112_I2C_REG_TLOW_LIMIT)
+from vicinity.tmp117 import (
+    TMP117_CONFIG_FLAG_DATA_READY, TMP117_I2C_REG_CONFIG, TMP117_I2C_REG_DEVICE_ID,
+    TMP117_I2C_REG_TEMP_RESULT, TMP117_I2C_REG_THIGH_LIMIT, TMP117_I2C_REG_TLOW_LIMIT)
+from vicinity.i2cbase import I2C_CALL_RESET_CMD
+
+from .stats import (
+    ExchangeStats, OUTCOME_COLLISION, OUTCOME_CRC, OUTCOME_ERROR, OUTCOME_SUCCESS, OUTCOME_TIMEOUT)
+from .retry import RetryPolicy
+
+
+# Emulated tag identity, taken from a factory default NTAG 5 Link
+EMULATOR_UID =                          bytes([0xE0, 0x04, 0x01, 0x58, 0x50, 0x8D, 0x11, 0x00])
+EMULATOR_ATR =                          bytes.fromhex("3b8f8001804f0ca0000003060b00350000000056")
+EMULATOR_NXP_INFO =                     bytes([0xFF, 0x00, 0x00, 0xFF, 0xF1, 0x07, 0x64])
+EMULATOR_IC_REFERENCE =                 0x01
+EMULATOR_NUM_BLOCKS =                   512
+EMULATOR_BLOCK_SIZE =                   4
+EMULATOR_SRAM_SIZE =                    256
+# Number of emulated readers when acquiring from all readers
+EMULATOR_READERS =                      2
+# Number of emulated tags in the field when acquiring from all tags, their UIDs share the lowest four bits
+EMULATOR_TAGS =                         3
+# Harvesting trigger currents in mA, indexed by the EH_VOUT_I_SEL field
+EMULATOR_EH_CURRENTS =                  (0.4, 0.6, 1.4, 2.7, 4.0, 6.5, 9.0, 12.5)
+
+# Factory default persistent configuration blocks
+EMULATOR_CONFIG_DEFAULTS = {
+    NXP_CONFIG_ADDR_CONFIG:             bytes([0x08, 0x12, 0xFF, 0x00]),
+    NXP_CONFIG_ADDR_EH_CONFIG:          bytes([0x00, 0x00, 0x00, 0x00]),
+}
+
+# Supported command list reported in the extended system information, as read from an NTAG 5 Link
+# Neither WRITE MULTIPLE BLOCKS nor EXTENDED WRITE MULTIPLE BLOCKS is supported
+EMULATOR_CMD_LIST =                     bytes.fromhex("ef7f6f00")
+
+
+class EmulatedI2CDevice:
+    def __init__(self, registers = None, register_width = 1, auto_increment = True):
+        self.registers = dict(registers or {})
+        self.register_width = register_width
+        self.auto_increment = auto_increment
+        self.pointer = 0x00
+
+    def read_register(self, register):
+        return self.registers.get(register, 0x00)
+
+    def write_register(self, register, value):
+        self.registers[register] = value
+
+    def reset(self):
+        pass
+
+    def write(self, data):
+        # The first byte sets the register pointer, the remainder is register data
+        self.pointer = data[0]
+        payload = data[1:]
+        width = self.register_width
+        register = self.pointer
+        for i in range(0, len(payload) - (len(payload) % width), width):
+            self.write_register(register, int.from_bytes(payload[i:i + width], byteorder="big"))
+            if(self.auto_increment):
+                register += 1
+        return True
+
+    def read(self, length):
+        data = bytearray()
+        register = self.pointer
+        while(len(data) < length):
+            data += self.read_register(register).to_bytes(self.register_width, byteorder="big")
+            if(self.auto_increment):
+                register += 1
+        if(self.auto_increment):
+            self.pointer = register
+        return bytes(data[:length])
+
+
+class EmulatedTMP117(EmulatedI2CDevice):
+    def __init__(self, temperature = 25.0):
+        super().__init__({
+            TMP117_I2C_REG_CONFIG: 0x0220 | TMP117_CONFIG_FLAG_DATA_READY,
+            TMP117_I2C_REG_THIGH_LIMIT: 0x6000,
+            TMP117_I2C_REG_TLOW_LIMIT: 0x8000,
+            TMP117_I2C_REG_DEVICE_ID: 0x0117,
+        }, register_width = 2, auto_increment = False)
+        self.temperature = temperature
+
+    def read_register(self, register):
+        if(register == TMP117_I2C_REG_TEMP_RESULT):
+            return int(round(self.temperature * 1000.0 / 7.8125)) & 0xFFFF
+        return super().read_register(register)
+
+    def write_register(self, register, value):
+        if(register == TMP117_I2C_REG_CONFIG):
+            # Conversions complete instantly, data is always ready
+            value |= TMP117_CONFIG_FLAG_DATA_READY
+        super().write_register(register, value)
+
+
+class EmulatedTMP112(EmulatedI2CDevice):
+    def __init__(self, temperature = 25.0):
+        super().__init__({
+            TMP112_I2C_REG_CONFIG: 0x60A0,
+            TMP112_I2C_REG_TLOW_LIMIT: 0x4B00,
+            TMP112_I2C_REG_THIGH_LIMIT: 0x5000,
+        }, register_width = 2, auto_increment = False)
+        self.temperature = temperature
+
+    def read_register(self, register):
+        if(register == TMP112_I2C_REG_TEMP_RESULT):
+            return (int(round(self.temperature * 1000.0 / 62.5)) << 4) & 0xFFFF
+        return super().read_register(register)
+
+
+class EmulatedSI1143(EmulatedI2CDevice):
+    def __init__(self, heart_rate = 72.0):
+        super().__init__({
+            SI1143_I2C_REG_PART_ID: SI1143_PART_ID_SI1143,
+            SI1143_I2C_REG_REV_ID: 0x00,
+            SI1143_I2C_REG_SEQ_ID: SI1143_SEQ_ID_A10,
+        })
+        self.heart_rate = heart_rate
+        self.parameters = {}
+        self.command_counter = 0
+
+    def _channel_value(self, register):
+        # Synthesize a pulse on the proximity channels and constant ambient light
+        if(SI1143_I2C_REG_PS1_DATA0 <= register <= SI1143_I2C_REG_PS2_DATA1):
+            phase = 2 * math.pi * (self.heart_rate / 60.0) * time.time()
+            value = int(2000 + 150 * math.sin(phase))
+        else:
+            value = 500
+        return (value >> 8) if (register & 0x01) else (value & 0xFF)
+
+    def read_register(self, register):
+        if(SI1143_I2C_REG_ALS_VIS_DATA0 <= register <= SI1143_I2C_REG_AUX_DATA1):
+            return self._channel_value(register)
+        return super().read_register(register)
+
+    def write_register(self, register, value):
+        super().write_register(register, value)
+        if(register != SI1143_I2C_REG_COMMAND):
+            return
+        if(value == SI1143_CMD_NOP):
+            self.command_counter = 0
+            self.registers[SI1143_I2C_REG_RESPONSE] = 0x00
+            return
+        if(value == SI1143_CMD_RESET):
+            self.parameters = {}
+            self.registers = {
+                SI1143_I2C_REG_PART_ID: SI1143_PART_ID_SI1143,
+                SI1143_I2C_REG_SEQ_ID: SI1143_SEQ_ID_A10,
+            }
+            return
+        param = value & 0x1F
+        if((value & 0xE0) == SI1143_CMD_PARAM_SET):
+            self.parameters[param] = self.registers.get(SI1143_I2C_REG_PARAM_WR, 0x00)
+        if(value & SI1143_CMD_PARAM_QUERY):
+            self.registers[SI1143_I2C_REG_PARAM_RD] = self.parameters.get(param, 0x00)
+        # The response counter increments for every successful command
+        self.command_counter = (self.command_counter % 0x0F) + 1
+        self.registers[SI1143_I2C_REG_RESPONSE] = self.command_counter
+
+
+class NTAG5Emulator:
+    def __init__(self, uid = EMULATOR_UID, latency = None, default_latency = 0.0,
+            eh_delay = 0.0, i2c_time = 0.0, fault_rate = 0.0, eh_field_current = None, eh_load_current = None):
+        self.trace = None
+        self.atr = EMULATOR_ATR
+        self.uid = bytes(uid)
+        # Per-command latency in seconds, keyed by ISO15693/NXP command code
+        self.latency = dict(latency or {})
+        self.default_latency = default_latency
+        # Time until the energy harvesting load is reported as stable
+        self.eh_delay = eh_delay
+        # Current in mA the field can supply, harvesting never stabilizes above it and takes longer close to it
+        self.eh_field_current = eh_field_current
+        # Current in mA the attached sensors draw, I2C transactions fail if harvesting was triggered below it
+        self.eh_load_current = eh_load_current
+        # Time the I2C master stays busy after each transaction
+        self.i2c_time = i2c_time
+        # Probability of a response being corrupted on the air, the command itself is executed
+        self.fault_rate = fault_rate
+        self.config = { address: bytearray(block) for address, block in EMULATOR_CONFIG_DEFAULTS.items() }
+        self.memory = bytearray(EMULATOR_NUM_BLOCKS * EMULATOR_BLOCK_SIZE)
+        self.locked = set()
+        self.sram = bytearray(EMULATOR_SRAM_SIZE)
+        self.devices = {}
+        self.i2c_status = NXP_I2C_M_TRANS_STATUS_RESET
+        self.i2c_busy_until = 0.0
+        self.eh_triggered_at = None
+        self.stats = ExchangeStats()
+        self.retry = RetryPolicy()
+        # Tags in the field of this reader, all of them receive every frame
+        self.field = [ self ]
+        self.selected = False
+
+    @staticmethod
+    def cli_create_connect(args, uid = EMULATOR_UID):
+        reader = NTAG5Emulator(uid)
+        reader.cli_attach(args)
+        print(f"info: Using emulated card with UID: {reader.uid.hex()}")
+        if(getattr(args, "all_tags", False)):
+            # Further cards with their own sensor in the same field
+            for index in range(1, EMULATOR_TAGS):
+                tag = NTAG5Emulator(uid[:-1] + bytes([uid[-1] + (index << 4)]))
+                tag.cli_attach(args)
+                reader.place(tag)
+                print(f"info: Using emulated card with UID: {tag.uid.hex()}")
+        return reader
+
+    def cli_attach(self, args):
+        # Attach the emulated sensor that matches the selected action
+        if(args.action == "tmp117"):
+            self.attach(args.address, EmulatedTMP117())
+        elif(args.action == "tmp112"):
+            self.attach(args.address, EmulatedTMP112())
+        elif(args.action == "si1143"):
+            self.attach(SI1143_I2C_ADDRESS, EmulatedSI1143())
+
+    @staticmethod
+    def cli_create_connect_all(args):
+        # Emulate several readers, each with its own card, sensor and UID
+        connections = []
+        for index in range(EMULATOR_READERS):
+            reader = NTAG5Emulator.cli_create_connect(args, EMULATOR_UID[:-1] + bytes([index]))
+            connections.append((f"Emulated reader {index}", reader))
+        return connections
+
+    def attach(self, address, device):
+        self.devices[address] = device
+
+    def place(self, tag):
+        # Put another emulated tag into the field of this reader
+        self.field.append(tag)
+
+    def brownout(self):
+        # Simulate a field drop: harvesting stops, session registers and attached sensors reset
+        self.eh_triggered_at = None
+        self.config.pop(NXP_CONFIG_ADDR_EH_CONFIG_REG, None)
+        self.i2c_status = NXP_I2C_M_TRANS_STATUS_RESET
+        for device in self.devices.values():
+            device.reset()
+
+    def connect(self, reader_name = None):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def _error(self, code):
+        if 0xA0 <= code <= 0xDF:
+            raise ISO15693Error(f"Custom command error code {code:02x}.", code)
+        elif(code == ISO_ERROR_UNSUPPORTED_CMD):
+            raise ISO15693Error("The command is not supported (request code not recognized).", code)
+        elif(code == ISO_ERROR_UNAVAILABLE_BLOCK):
+            raise ISO15693Error("The specified block is not available (doesn't exist).", code)
+        elif(code == ISO_ERROR_LOCKED_BLOCK):
+            raise ISO15693Error("The specified block is locked and its content cannot be changed.", code)
+        raise ISO15693Error(f"Reserved for future use (RFU) code {code:02x}", code)
+
+    def _config_block(self, address):
+        if(address == NXP_CONFIG_ADDR_I2C_M_STATUS_REG):
+            busy = NXP_I2C_M_BUSY_MASK if time.monotonic() < self.i2c_busy_until else 0x00
+            return bytes([self.i2c_status | busy, 0x00, 0x00, 0x00])
+        if(address == NXP_CONFIG_ADDR_EH_CONFIG_REG):
+            flags = self.config.get(address, bytearray(4))[0]
+            if(self._eh_stable()):
+                flags |= NXP_EH_LOAD_OK
+            return bytes([flags, 0x00, 0x00, 0x00])
+        return bytes(self.config.get(address, bytes(4)))
+
+    def _eh_current(self):
+        flags = self.config.get(NXP_CONFIG_ADDR_EH_CONFIG_REG, bytearray(4))[0]
+        return EMULATOR_EH_CURRENTS[(flags & NXP_EH_CONFIG_EH_VOUT_I_SEL_12_5) >> 4]
+
+    def _eh_stable(self):
+        if(self.eh_triggered_at == None):
+            return False
+        delay = self.eh_delay
+        if(self.eh_field_current != None):
+            if(self._eh_current() > self.eh_field_current):
+                return False
+            delay *= 1.0 + self._eh_current() / self.eh_field_current
+        return time.monotonic() - self.eh_triggered_at >= delay
+
+    def _i2c_powered(self):
+        # Without a load model the sensors are always powered
+        return self.eh_load_current == None or (self._eh_stable() and self._eh_current() >= self.eh_load_current)
+
+    def _read_config(self, params):
+        address, num_blocks = params[1], params[2] + 1
+        return b''.join(self._config_block(address + i) for i in range(num_blocks))
+
+    def _write_config(self, params):
+        address, block = params[1], bytearray(params[2:6])
+        if(address == NXP_CONFIG_ADDR_I2C_M_STATUS_REG):
+            # Status register is read-only, the write is acknowledged without effect
+            return b''
+        if(address == NXP_CONFIG_ADDR_EH_CONFIG_REG):
+            # Triggering starts energy harvesting, clearing both flags stops it
+            if(block[0] & NXP_EH_TRIGGER):
+                if(self.eh_triggered_at == None):
+                    self.eh_triggered_at = time.monotonic()
+            elif(not (block[0] & NXP_EH_ENABLE)):
+                self.eh_triggered_at = None
+            block[0] &= ~NXP_EH_LOAD_OK
+        self.config[address] = block
+        # The tag answers once the block is programmed
+        return b''
+
+    def _write_i2c(self, params):
+        param, length = params[1], params[2] + 1
+        data = bytes(params[3:3 + length])
+        address = param & 0x7F
+        self.i2c_busy_until = time.monotonic() + self.i2c_time
+        if(address == 0x00):
+            # General call, acknowledged if any device is attached
+            if(data[0] == I2C_CALL_RESET_CMD):
+                for device in self.devices.values():
+                    device.reset()
+            acked = len(self.devices) > 0
+        else:
+            device = self.devices.get(address)
+            acked = device != None and self._i2c_powered() and device.write(data)
+        self.i2c_status = NXP_I2C_M_TRANS_STATUS_SUCCESS if acked else NXP_I2C_M_TRANS_STATUS_ADDRESS_NAK
+        return b''
+
+    def _read_i2c(self, params):
+        param, length = params[1], params[2] + 1
+        device = self.devices.get(param & 0x7F)
+        self.i2c_busy_until = time.monotonic() + self.i2c_time
+        if(device == None or not self._i2c_powered()):
+            self.i2c_status = NXP_I2C_M_TRANS_STATUS_ADDRESS_NAK
+            return b''
+        self.sram[0:length] = device.read(length)
+        self.i2c_status = NXP_I2C_M_TRANS_STATUS_SUCCESS
+        return b''
+
+    def _read_sram(self, params):
+        address, num_blocks = params[1], params[2] + 1
+        return bytes(self.sram[address * 4:(address + num_blocks) * 4])
+
+    def _read_blocks(self, start_block, num_blocks, security):
+        if(start_block + num_blocks > EMULATOR_NUM_BLOCKS):
+            self._error(ISO_ERROR_UNAVAILABLE_BLOCK)
+        data = bytearray()
+        for block in range(start_block, start_block + num_blocks):
+            if(security):
+                data.append(ISO_FLAG_SECURITY_STATUS_LOCKED if block in self.locked else 0x00)
+            data += self.memory[block * EMULATOR_BLOCK_SIZE:(block + 1) * EMULATOR_BLOCK_SIZE]
+        return bytes(data)
+
+    def _write_blocks(self, start_block, num_blocks, data):
+        if(start_block + num_blocks > EMULATOR_NUM_BLOCKS):
+            self._error(ISO_ERROR_UNAVAILABLE_BLOCK)
+        if(any(block in self.locked for block in range(start_block, start_block + num_blocks))):
+            self._error(ISO_ERROR_LOCKED_BLOCK)
+        self.memory[start_block * EMULATOR_BLOCK_SIZE:(start_block + num_blocks) * EMULATOR_BLOCK_SIZE] = \
+            data[:num_blocks * EMULATOR_BLOCK_SIZE]
+        return b''
+
+    def _system_info(self):
+        return bytes([ISO_SYSTEM_INFO_FLAG_DSFID | ISO_SYSTEM_INFO_FLAG_AFI |
+            ISO_SYSTEM_INFO_FLAG_VICC_MEMORY_SIZE | ISO_SYSTEM_INFO_FLAG_IC_REFERENCE]) + \
+            self.uid[::-1] + bytes([0x00, 0x00, min(EMULATOR_NUM_BLOCKS, 256) - 1,
+                EMULATOR_BLOCK_SIZE - 1, EMULATOR_IC_REFERENCE])
+
+    def _extended_system_info(self):
+        # MOI is only a flag, set for two byte block addressing. Crypto suite identifiers are not emulated
+        return bytes([ISO_SYSTEM_INFO_FLAG_DSFID | ISO_SYSTEM_INFO_FLAG_AFI |
+            ISO_SYSTEM_INFO_FLAG_VICC_MEMORY_SIZE | ISO_SYSTEM_INFO_FLAG_IC_REFERENCE |
+            ISO_EXTENDED_SYSTEM_INFO_MOI | ISO_EXTENDED_SYSTEM_INFO_VICC_CMD_LIST]) + \
+            self.uid[::-1] + bytes([0x00, 0x00]) + \
+            (EMULATOR_NUM_BLOCKS - 1).to_bytes(2, byteorder="little") + \
+            bytes([EMULATOR_BLOCK_SIZE - 1, EMULATOR_IC_REFERENCE]) + EMULATOR_CMD_LIST
+
+    def _receive(self, data):
+        # The request as this tag executes it, without its UID, or None if the tag stays silent
+        flags, command = data[0], data[1]
+        if(flags & ISO_FLAG_INVENTORY):
+            return data if(command == ISO_CMD_INVENTORY and self._inventory_match(data)) else None
+        if(flags & ISO_FLAG_ADDRESS):
+            split = 3 if(command >= ISO_CMD_CUSTOM_FIRST) else 2
+            if(data[split:split + 8] != self.uid[::-1]):
+                if(command == ISO_CMD_SELECT):
+                    # Selecting another tag returns this one to the ready state
+                    self.selected = False
+                return None
+            return bytes([flags & ~ISO_FLAG_ADDRESS & 0xFF]) + data[1:split] + data[split + 8:]
+        if(flags & ISO_FLAG_SELECT and not self.selected):
+            return None
+        return data
+
+    def _inventory_match(self, data):
+        # The mask holds the least significant UID bits, taken from the reversed UID
+        flags = data[0]
+        index = 2
+        if(flags & ISO_FLAG_AFI):
+            if(data[index] != 0x00):
+                # The emulated tag has no application family
+                return False
+            index += 1
+        mask_length = data[index]
+        mask = int.from_bytes(data[index + 1:index + 1 + (mask_length + 7) // 8], "little")
+        uid = int.from_bytes(self.uid, "big")
+        if((uid & ((1 << mask_length) - 1)) != mask):
+            return False
+        if(not flags & ISO_FLAG_NB_SLOTS):
+            # With 16 slots a tag answers in the slot numbered by its next 4 UID bits. The reader sends
+            # a single request per exchange and no end of frame opens the next slot, so only slot 0 is answered
+            return (uid >> mask_length) & 0x0F == 0
+        return True
+
+    def _field_execute(self, data):
+        # Every tag in the field receives the frame, answers of more than one tag collide
+        answers = []
+        for tag in self.field:
+            frame = tag._receive(data)
+            if(frame == None):
+                continue
+            try:
+                answer = tag._execute(frame)
+            except ISO15693Error as e:
+                answer = e
+            if(answer != None):
+                answers.append(answer)
+        if(len(answers) > 1):
+            raise CollisionError("Collision detected")
+        if(len(answers) == 0):
+            return None
+        if(isinstance(answers[0], Exception)):
+            raise answers[0]
+        return answers[0]
+
+    def _execute(self, data):
+        flags, command = data[0], data[1]
+        if(command == ISO_CMD_INVENTORY):
+            # DSFID is followed by the UID in reverse byte order
+            return bytes([0x00]) + self.uid[::-1]
+        if(command == ISO_CMD_SELECT):
+            self.selected = True
+            return bytes()
+        if(command == ISO_CMD_RESET_TO_READY):
+            self.selected = False
+            return bytes()
+        if(command == ISO_CMD_SYSTEM_INFO):
+            return self._system_info()
+        if(command == ISO_CMD_EXTENDED_SYSTEM_INFO):
+            return self._extended_system_info()
+        if(command == ISO_CMD_READ_SINGLE_BLOCK):
+            return self._read_blocks(data[2], 1, flags & ISO_FLAG_OPTION)
+        if(command == ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS):
+            start_block = int.from_bytes(data[2:4], byteorder="little")
+            num_blocks = int.from_bytes(data[4:6], byteorder="little") + 1
+            return self._read_blocks(start_block, num_blocks, flags & ISO_FLAG_OPTION)
+        if(command == ISO_CMD_WRITE_SINGLE_BLOCK):
+            return self._write_blocks(data[2], 1, data[3:])
+        if(command == ISO_CMD_EXT_WRITE_SINGLE_BLOCK):
+            return self._write_blocks(int.from_bytes(data[2:4], byteorder="little"), 1, data[4:])
+        # Custom commands carry the manufacturer code after the command code
+        params = data[2:]
+        if(command >= 0xA0 and (len(params) < 1 or params[0] != NXP_CMD_MANUF_CODE_NXP)):
+            self._error(ISO_ERROR_UNSUPPORTED_CMD)
+        if(command == NXP_CMD_SYSTEM_INFO):
+            return EMULATOR_NXP_INFO
+        if(command == NXP_CMD_READ_CONFIG):
+            return self._read_config(params)
+        if(command == NXP_CMD_WRITE_CONFIG):
+            return self._write_config(params)
+        if(command == NXP_CMD_READ_SRAM):
+            return self._read_sram(params)
+        if(command == NXP_CMD_WRITE_I2C):
+            return self._write_i2c(params)
+        if(command == NXP_CMD_READ_I2C):
+            return self._read_i2c(params)
+        self._error(ISO_ERROR_UNSUPPORTED_CMD)
+
+    def transmit_iso15693(self, data, allow_no_response = False, timeout = None):
+        # Idempotent commands are repeated on transient errors, like on the real reader
+        return self.retry.call(data[1], self._exchange_iso15693, data, allow_no_response, timeout)
+
+    def transmit_iso15693_batch(self, frames):
+        # Frames are executed in order until one fails, like in a batched reader exchange
+        results = []
+        for data in frames:
+            try:
+                results.append(self._exchange_iso15693(data))
+            except TransportError as e:
+                results.append(e)
+                break
+        return results + [ None ] * (len(frames) - len(results))
+
+    def _exchange_iso15693(self, data, allow_no_response = False, timeout = None):
+        data = bytes(data)
+        if(self.trace != None):
+            self.trace.request(data)
+        latency = self.latency.get(data[1], self.default_latency)
+        start = time.perf_counter()
+        try:
+            if(timeout != None and latency > timeout):
+                # The tag answers too late, the command has no effect
+                time.sleep(timeout)
+                res = None
+            else:
+                if(latency > 0):
+                    time.sleep(latency)
+                res = self._field_execute(data)
+        except CollisionError:
+            self.stats.record(data[1], OUTCOME_COLLISION, time.perf_counter() - start, len(data))
+            if(self.trace != None):
+                self.trace.response(b'', OUTCOME_COLLISION)
+            raise
+        except ISO15693Error as e:
+            # The tag answers with the error flag set
+            self.stats.record(data[1], OUTCOME_ERROR, time.perf_counter() - start, len(data), 2)
+            if(self.trace != None):
+                self.trace.response(bytes([ISO_FLAG_ERROR, e.code]), OUTCOME_ERROR)
+            raise
+        except Exception:
+            self.stats.record(data[1], OUTCOME_ERROR, time.perf_counter() - start, len(data))
+            if(self.trace != None):
+                self.trace.response(b'', OUTCOME_ERROR)
+            raise
+        outcome = OUTCOME_TIMEOUT if res == None else OUTCOME_SUCCESS
+        if(res != None and self.fault_rate > 0 and random.random() < self.fault_rate):
+            outcome = OUTCOME_CRC
+        response = b'' if res == None else bytes([0x00]) + res
+        self.stats.record(data[1], outcome, time.perf_counter() - start, len(data), len(response))
+        if(self.trace != None):
+            self.trace.response(response, outcome)
+        if(outcome == OUTCOME_CRC):
+            raise CRCError("CRC check failed")
+        if(res == None):
+            # No tag answered in time
+            if(not allow_no_response):
+                raise NoResponseError("Data object 0 execution error (no response from ICC)")
+            return b''
+        return res
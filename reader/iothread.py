@@ -0,0 +1,48 @@
+import asyncio, functools, time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ReaderThread:
+    def __init__(self, reader):
+        # A single worker thread owns the reader, so exchanges never interleave
+        self.reader = reader
+        self.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "reader-io")
+
+    def submit(self, function, *args, **kwargs):
+        # Queue a call on the I/O thread, returns a concurrent future
+        return self.executor.submit(function, *args, **kwargs)
+
+    def call(self, function, *args, **kwargs):
+        # Queue a call on the I/O thread right away, returns an asyncio future to await
+        return asyncio.wrap_future(self.submit(function, *args, **kwargs))
+
+    async def poll(self, function, interval = 0.1, timeout = None):
+        # Repeat a check on the I/O thread until it returns a truthy value, waiting in between
+        # without holding the I/O thread, so other queued exchanges can run
+        deadline = None if timeout == None else time.monotonic() + timeout
+        while(True):
+            result = await self.call(function)
+            if(result):
+                return result
+            if(deadline != None and time.monotonic() >= deadline):
+                raise TimeoutError("Polled condition was not met in time")
+            await asyncio.sleep(interval)
+
+    def close(self):
+        self.executor.shutdown(wait = True)
+
+
+class AsyncProxy:
+    def __init__(self, target, io):
+        # Exposes every method of the wrapped chip or sensor driver as an awaitable call on the I/O thread
+        self._target = target
+        self._io = io
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if(not callable(attribute)):
+            return attribute
+        @functools.wraps(attribute)
+        def method(*args, **kwargs):
+            return self._io.call(attribute, *args, **kwargs)
+        return method
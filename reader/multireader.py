@@ -0,0 +1,48 @@
+import time, threading, queue
+
+
+class MultiReaderAcquisition:
+    def __init__(self, connections):
+        # Tag drivers of the connected readers as (reader name, driver) pairs, each gets its own worker thread
+        self.connections = connections
+        self.queue = queue.Queue()
+        self.stop = threading.Event()
+
+    def _acquire(self, name, chip, worker):
+        uid = None
+        def emit(**values):
+            # Tag every sample with its time of acquisition and its source
+            self.queue.put(dict(time = time.time(), reader = name, uid = uid, **values))
+        try:
+            uid = chip.get_system_info()["uid"]
+            # Every step of the worker generator polls the sensor once, then waits as long as it asks for
+            for delay in worker(chip, emit):
+                if(self.stop.is_set()):
+                    break
+                if(delay != None and delay > 0):
+                    self.stop.wait(delay)
+        except Exception as e:
+            emit(error = str(e))
+        finally:
+            self.queue.put(None)
+
+    def run(self, worker):
+        # Run worker(chip, emit) on every reader in parallel and yield the merged samples
+        # The workers are stopped once the consumer stops iterating
+        self.stop.clear()
+        threads = [ threading.Thread(target = self._acquire, args = (name, chip, worker),
+            name = f"reader-{name}", daemon = True) for name, chip in self.connections ]
+        for thread in threads:
+            thread.start()
+        running = len(threads)
+        try:
+            while(running > 0):
+                sample = self.queue.get()
+                if(sample == None):
+                    running -= 1
+                    continue
+                yield sample
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
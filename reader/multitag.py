@@ -0,0 +1,75 @@
+import time
+
+
+# Reader time each tag is granted per round, in seconds
+MULTITAG_QUANTUM =                          0.05
+
+
+class MultiTagAcquisition:
+    def __init__(self, chips, quantum = MULTITAG_QUANTUM, select = False):
+        # Tags found in the field of one reader, each driver addressed to its UID, polled one after the other
+        # Selected mode saves the UID in every frame for one SELECT at the start of each slice
+        self.chips = chips
+        self.quantum = quantum
+        self.select = select
+        self.samples = []
+        # Reader time used by each tag, keyed by UID, in seconds
+        self.usage = {}
+
+    def _error(self, tag, error):
+        self.samples.append(dict(time = time.time(), reader = tag["name"], uid = tag["uid"], error = str(error)))
+        tag["done"] = True
+
+    def _slice(self, tag):
+        # Poll one tag until its share of reader time is used up or it waits for its sensor
+        # Time used beyond the share is taken from its next one, so slow tags cannot starve the others
+        tag["budget"] = min(tag["budget"], 0.0) + self.quantum
+        if(self.select):
+            try:
+                # Selecting this tag returns the one of the previous slice to the ready state
+                tag["chip"].select(tag["uid"])
+            except Exception as e:
+                self._error(tag, e)
+                return
+        while(tag["budget"] > 0 and tag["ready"] <= time.monotonic()):
+            start = time.monotonic()
+            try:
+                delay = next(tag["steps"])
+            except StopIteration:
+                tag["done"] = True
+            except Exception as e:
+                self._error(tag, e)
+            end = time.monotonic()
+            tag["budget"] -= end - start
+            self.usage[tag["uid"]] = self.usage.get(tag["uid"], 0.0) + end - start
+            if(tag["done"]):
+                return
+            tag["ready"] = end + (delay if(delay != None and delay > 0) else 0.0)
+
+    def run(self, worker):
+        # Run worker(chip, emit) on every tag and yield the merged samples
+        # Every step of the worker generator polls the sensor once and yields the time in seconds
+        # until it needs the reader again, None or zero for right away
+        tags = []
+        for index, chip in enumerate(self.chips):
+            tag = { "uid": chip.uid, "name": f"tag {index}", "chip": chip, "budget": 0.0, "ready": 0.0, "done": False }
+            def emit(tag = tag, **values):
+                # Tag every sample with its time of acquisition and its source
+                self.samples.append(dict(time = time.time(), reader = tag["name"], uid = tag["uid"], **values))
+            tag["steps"] = worker(chip, emit)
+            tags.append(tag)
+        try:
+            while(len(tags) > 0):
+                now = time.monotonic()
+                ready = [ tag for tag in tags if tag["ready"] <= now ]
+                if(len(ready) == 0):
+                    time.sleep(min(tag["ready"] for tag in tags) - now)
+                    continue
+                for tag in ready:
+                    self._slice(tag)
+                    while(len(self.samples) > 0):
+                        yield self.samples.pop(0)
+                tags = [ tag for tag in tags if not tag["done"] ]
+        finally:
+            for tag in tags:
+                tag["steps"].close()
@@ -10,6 +10,7 @@ class PCSCReader():
         super().__init__()
         self.card = None
         self.atr = None
+        self.name = None
 
     @classmethod
     def list_readers(cls):
@@ -20,6 +21,7 @@ class PCSCReader():
         self.card = request.waitforcard()
         self.card.connection.connect()
         self.atr = bytes(self.card.connection.getATR())
+        self.name = reader_name
 
     def disconnect(self):
         self.card.connection.disconnect()
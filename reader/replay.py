@@ -0,0 +1,113 @@
+import time
+
+from protocol.errors import (
+    CRCError, CollisionError, FramingError, ISO15693Error, NoResponseError, ParityError, TransportError)
+from protocol.commands import ISO_FLAG_ERROR
+
+from .stats import (
+    ExchangeStats, OUTCOME_COLLISION, OUTCOME_CRC, OUTCOME_ERROR, OUTCOME_FRAMING, OUTCOME_PARITY,
+    OUTCOME_SUCCESS, OUTCOME_TIMEOUT)
+from .trace import TRACE_REQUEST, TraceRecorder
+from .retry import RetryPolicy
+
+
+# Errors raised for the recorded outcomes
+REPLAY_ERRORS = {
+    OUTCOME_CRC:                            (CRCError, "CRC check failed"),
+    OUTCOME_COLLISION:                      (CollisionError, "Collision detected"),
+    OUTCOME_PARITY:                         (ParityError, "Parity error detected"),
+    OUTCOME_FRAMING:                        (FramingError, "Framing error detected"),
+    OUTCOME_ERROR:                          (TransportError, "Recorded exchange failed"),
+}
+
+
+class ReplayFinished(KeyboardInterrupt):
+    # The recording is exhausted, ends read loops the same way a user interrupt does
+    pass
+
+
+class ReplayReader:
+    def __init__(self, path, realtime = True):
+        # Pair up recorded requests with their responses, a wrapped ring buffer may start with a response
+        self.path = path
+        self.realtime = realtime
+        self.exchanges = []
+        request = None
+        for timestamp, direction, outcome, data in TraceRecorder.load(path):
+            if(direction == TRACE_REQUEST):
+                request = (timestamp, data)
+            elif(request != None):
+                self.exchanges.append((request[1], request[0], timestamp, outcome, data))
+                request = None
+        if(len(self.exchanges) == 0):
+            raise Exception("Recording does not contain any exchanges")
+        self.origin = self.exchanges[0][1]
+        self.position = 0
+        self.start = None
+        self.trace = None
+        self.stats = ExchangeStats()
+        # Recorded retries are replayed by repeating the same exchanges
+        self.retry = RetryPolicy()
+
+    @staticmethod
+    def cli_create_connect(args):
+        reader = ReplayReader(args.replay, realtime = not args.unthrottled)
+        print(f"info: Replaying {len(reader.exchanges)} exchanges from {args.replay}" +
+            ("" if reader.realtime else ", unthrottled"))
+        return reader
+
+    def connect(self, reader_name = None):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def rewind(self):
+        self.position = 0
+        self.start = None
+
+    def transmit_iso15693(self, data, allow_no_response = False, timeout = None):
+        return self.retry.call(data[1], self._exchange_iso15693, data, allow_no_response, timeout)
+
+    def transmit_iso15693_batch(self, frames):
+        # Frames are executed in order until one fails, like in a batched reader exchange
+        results = []
+        for data in frames:
+            try:
+                results.append(self._exchange_iso15693(data))
+            except TransportError as e:
+                results.append(e)
+                break
+        return results + [ None ] * (len(frames) - len(results))
+
+    def _exchange_iso15693(self, data, allow_no_response = False, timeout = None):
+        data = bytes(data)
+        if(self.position >= len(self.exchanges)):
+            raise ReplayFinished()
+        request, requested, responded, outcome, response = self.exchanges[self.position]
+        if(request != data):
+            raise Exception(f"Replay diverged at exchange {self.position}: " +
+                f"recorded {request.hex()}, requested {data.hex()}")
+        self.position += 1
+        if(self.trace != None):
+            self.trace.request(data)
+        if(self.realtime):
+            # Answer at the recorded offset from the first exchange, so delays do not accumulate
+            if(self.start == None):
+                self.start = time.perf_counter() - (requested - self.origin)
+            delay = self.start + (responded - self.origin) - time.perf_counter()
+            if(delay > 0):
+                time.sleep(delay)
+        self.stats.record(data[1], outcome, responded - requested, len(data), len(response))
+        if(self.trace != None):
+            self.trace.response(response, outcome)
+        if(outcome == OUTCOME_TIMEOUT):
+            if(not allow_no_response):
+                raise NoResponseError("Data object 0 execution error (no response from ICC)")
+            return b''
+        if(len(response) >= 2 and (response[0] & ISO_FLAG_ERROR)):
+            raise ISO15693Error(f"Recorded ISO15693 error code {response[1]:02x}", response[1])
+        if(outcome != OUTCOME_SUCCESS):
+            error, message = REPLAY_ERRORS[outcome]
+            raise error(message)
+        return response[1:]
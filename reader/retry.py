@@ -0,0 +1,72 @@
+import sys, time, random
+
+from protocol.commands import (
+    ISO_CMD_EXTENDED_SYSTEM_INFO, ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS, ISO_CMD_READ_MULTIPLE_BLOCKS,
+    ISO_CMD_READ_SINGLE_BLOCK, ISO_CMD_SYSTEM_INFO, NXP_CMD_READ_CONFIG, NXP_CMD_READ_SRAM,
+    NXP_CMD_SYSTEM_INFO)
+from protocol.errors import TRANSIENT_ERRORS
+
+from .stats import OPCODE_NAMES
+
+
+# Commands without side effects on the tag or the I2C bus, safe to repeat
+# I2C reads and writes are never repeated, they run a transaction on the sensor
+RETRY_COMMANDS = (
+    ISO_CMD_READ_SINGLE_BLOCK,
+    ISO_CMD_READ_MULTIPLE_BLOCKS,
+    ISO_CMD_SYSTEM_INFO,
+    ISO_CMD_EXTENDED_SYSTEM_INFO,
+    ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS,
+    NXP_CMD_SYSTEM_INFO,
+    NXP_CMD_READ_CONFIG,
+    NXP_CMD_READ_SRAM,
+)
+
+# Additional attempts per exchange, and the randomized delay before each in seconds
+RETRY_BUDGET =                              3
+RETRY_DELAY =                               0.002
+RETRY_JITTER =                              0.002
+
+
+class RetryPolicy:
+    def __init__(self, commands = RETRY_COMMANDS, budget = RETRY_BUDGET, delay = RETRY_DELAY, jitter = RETRY_JITTER):
+        self.commands = set(commands)
+        self.budget = budget
+        self.delay = delay
+        self.jitter = jitter
+        # Counters keyed by command code
+        self.retries = {}
+        self.recoveries = {}
+        self.give_ups = {}
+
+    def call(self, command, function, *args, **kwargs):
+        # Run the exchange, repeating it on transient errors if the command is idempotent
+        if(command not in self.commands):
+            return function(*args, **kwargs)
+        attempt = 0
+        while(True):
+            try:
+                result = function(*args, **kwargs)
+            except TRANSIENT_ERRORS:
+                if(attempt >= self.budget):
+                    self.give_ups[command] = self.give_ups.get(command, 0) + 1
+                    raise
+                attempt += 1
+                self.retries[command] = self.retries.get(command, 0) + 1
+                time.sleep(self.delay + random.uniform(0, self.jitter))
+                continue
+            if(attempt > 0):
+                self.recoveries[command] = self.recoveries.get(command, 0) + 1
+            return result
+
+    def reset(self):
+        self.retries = {}
+        self.recoveries = {}
+        self.give_ups = {}
+
+    def dump(self, file = sys.stdout, name = None):
+        print(f"info: Exchange retries{'' if name == None else ' of ' + name}:", file=file)
+        for command in sorted(set(self.retries) | set(self.give_ups)):
+            print(f" - 0x{command:02x} {OPCODE_NAMES.get(command, 'UNKNOWN')}: " +
+                f"retries {self.retries.get(command, 0)}, recoveries {self.recoveries.get(command, 0)}, " +
+                f"give-ups {self.give_ups.get(command, 0)}", file=file)
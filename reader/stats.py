@@ -0,0 +1,145 @@
+import sys
+
+from protocol.commands import (
+    ISO_CMD_EXTENDED_SYSTEM_INFO, ISO_CMD_EXT_WRITE_MULTIPLE_BLOCKS, ISO_CMD_EXT_WRITE_SINGLE_BLOCK,
+    ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS, ISO_CMD_INVENTORY, ISO_CMD_READ_MULTIPLE_BLOCKS,
+    ISO_CMD_READ_SINGLE_BLOCK, ISO_CMD_RESET_TO_READY, ISO_CMD_SELECT, ISO_CMD_SYSTEM_INFO,
+    ISO_CMD_WRITE_MULTIPLE_BLOCKS, ISO_CMD_WRITE_SINGLE_BLOCK, NXP_CMD_READ_CONFIG, NXP_CMD_READ_I2C,
+    NXP_CMD_READ_SRAM, NXP_CMD_SYSTEM_INFO, NXP_CMD_WRITE_CONFIG, NXP_CMD_WRITE_I2C)
+
+
+# Exchange outcomes
+OUTCOME_SUCCESS =                           "success"
+OUTCOME_CRC =                               "crc"
+OUTCOME_COLLISION =                         "collision"
+OUTCOME_PARITY =                            "parity"
+OUTCOME_FRAMING =                           "framing"
+OUTCOME_TIMEOUT =                           "timeout"
+OUTCOME_ERROR =                             "error"
+
+# Histogram buckets per power of two, as bits, 5 bits keeps the error around 3 %
+HISTOGRAM_SUB_BITS =                        5
+
+# Batched exchanges are recorded as a whole, under a key outside the one byte command codes
+OPCODE_BATCH =                              0x100
+
+# Readable names of the recorded opcodes, session management uses the pseudo APDU command byte
+OPCODE_NAMES = {
+    OPCODE_BATCH:                           "BATCH",
+    0x81:                                   "BEGIN_SESSION",
+    0x82:                                   "END_SESSION",
+    0x8F:                                   "SWITCH_PROTOCOL",
+    ISO_CMD_INVENTORY:                      "INVENTORY",
+    ISO_CMD_SELECT:                         "SELECT",
+    ISO_CMD_RESET_TO_READY:                 "RESET_TO_READY",
+    ISO_CMD_READ_SINGLE_BLOCK:              "READ_SINGLE_BLOCK",
+    ISO_CMD_READ_MULTIPLE_BLOCKS:           "READ_MULTIPLE_BLOCKS",
+    ISO_CMD_SYSTEM_INFO:                    "SYSTEM_INFO",
+    ISO_CMD_EXTENDED_SYSTEM_INFO:           "EXTENDED_SYSTEM_INFO",
+    ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS:  "FAST_EXT_READ_MULTIPLE_BLOCKS",
+    ISO_CMD_WRITE_SINGLE_BLOCK:             "WRITE_SINGLE_BLOCK",
+    ISO_CMD_WRITE_MULTIPLE_BLOCKS:          "WRITE_MULTIPLE_BLOCKS",
+    ISO_CMD_EXT_WRITE_SINGLE_BLOCK:         "EXT_WRITE_SINGLE_BLOCK",
+    ISO_CMD_EXT_WRITE_MULTIPLE_BLOCKS:      "EXT_WRITE_MULTIPLE_BLOCKS",
+    NXP_CMD_SYSTEM_INFO:                    "NXP_SYSTEM_INFO",
+    NXP_CMD_READ_CONFIG:                    "READ_CONFIG",
+    NXP_CMD_WRITE_CONFIG:                   "WRITE_CONFIG",
+    NXP_CMD_READ_SRAM:                      "READ_SRAM",
+    NXP_CMD_WRITE_I2C:                      "WRITE_I2C",
+    NXP_CMD_READ_I2C:                       "READ_I2C",
+}
+
+
+class LatencyHistogram:
+    def __init__(self):
+        # Sparse log-linear buckets of latencies in microseconds
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+
+    @staticmethod
+    def _index(value):
+        # Values below 2^(SUB_BITS + 1) are exact, above that the low bits are dropped
+        shift = max(0, value.bit_length() - HISTOGRAM_SUB_BITS - 1)
+        return (shift << HISTOGRAM_SUB_BITS) + (value >> shift)
+
+    @staticmethod
+    def _value(index):
+        # Midpoint of the bucket range
+        shift = max(0, (index >> HISTOGRAM_SUB_BITS) - 1)
+        low = (index - (shift << HISTOGRAM_SUB_BITS)) << shift
+        return low + ((1 << shift) - 1) // 2
+
+    def record(self, elapsed, tx_bytes = 0, rx_bytes = 0):
+        value = int(elapsed * 1000000)
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min == None else min(self.min, value)
+        self.max = max(self.max, value)
+        self.tx_bytes += tx_bytes
+        self.rx_bytes += rx_bytes
+
+    def percentile(self, percent):
+        # Latency in microseconds below which the given percentage of exchanges fall
+        if(self.count == 0):
+            return None
+        rank = max(1, int(round(self.count * percent / 100.0)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if(seen >= rank):
+                return min(self.max, max(self.min, self._value(index)))
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class ExchangeStats:
+    def __init__(self):
+        self.histograms = {}
+
+    def record(self, opcode, outcome, elapsed, tx_bytes = 0, rx_bytes = 0):
+        key = (opcode, outcome)
+        histogram = self.histograms.get(key)
+        if(histogram == None):
+            histogram = self.histograms[key] = LatencyHistogram()
+        histogram.record(elapsed, tx_bytes, rx_bytes)
+
+    def histogram(self, opcode, outcome = OUTCOME_SUCCESS):
+        return self.histograms.get((opcode, outcome))
+
+    def reset(self):
+        self.histograms = {}
+
+    def summary(self):
+        rows = []
+        for (opcode, outcome), histogram in sorted(self.histograms.items()):
+            rows.append({
+                "opcode": opcode,
+                "name": OPCODE_NAMES.get(opcode, "UNKNOWN"),
+                "outcome": outcome,
+                "count": histogram.count,
+                "p50": histogram.percentile(50),
+                "p99": histogram.percentile(99),
+                "min": histogram.min,
+                "max": histogram.max,
+                "mean": histogram.mean(),
+                "tx_bytes": histogram.tx_bytes,
+                "rx_bytes": histogram.rx_bytes,
+            })
+        return rows
+
+    def dump(self, file = sys.stdout, name = None):
+        print(f"info: Exchange latency statistics{'' if name == None else ' of ' + name} (ms):", file=file)
+        for row in self.summary():
+            print(f" - 0x{row['opcode']:02x} {row['name']} {row['outcome']}: count {row['count']}, " +
+                f"p50 {row['p50'] / 1000:.3f}, p99 {row['p99'] / 1000:.3f}, " +
+                f"min {row['min'] / 1000:.3f}, max {row['max'] / 1000:.3f}, " +
+                f"bytes sent {row['tx_bytes']}, received {row['rx_bytes']}", file=file)
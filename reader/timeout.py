@@ -0,0 +1,86 @@
+import math
+
+from protocol.commands import (
+    ISO_CMD_EXTENDED_SYSTEM_INFO, ISO_CMD_EXT_WRITE_MULTIPLE_BLOCKS, ISO_CMD_EXT_WRITE_SINGLE_BLOCK,
+    ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS, ISO_CMD_INVENTORY, ISO_CMD_READ_MULTIPLE_BLOCKS,
+    ISO_CMD_READ_SINGLE_BLOCK, ISO_CMD_RESET_TO_READY, ISO_CMD_SELECT, ISO_CMD_SYSTEM_INFO,
+    ISO_CMD_WRITE_MULTIPLE_BLOCKS, ISO_CMD_WRITE_SINGLE_BLOCK, NXP_CMD_READ_CONFIG, NXP_CMD_READ_I2C,
+    NXP_CMD_READ_SRAM, NXP_CMD_SYSTEM_INFO, NXP_CMD_WRITE_CONFIG, NXP_CMD_WRITE_I2C)
+
+
+# Frame waiting time unit, FWT = 302.07 x 2^FWTI us
+FWT_UNIT_US =                               302.07
+FWTI_MAX =                                  15
+
+# Timeout bounds in seconds as (floor, ceiling), keyed by command code
+TIMEOUT_BOUNDS_DEFAULT =                    (0.02, 1.0)
+TIMEOUT_BOUNDS_READ =                       (0.02, 0.1)
+# EEPROM writes keep the 1 s every exchange was allowed before timeouts were learned
+TIMEOUT_BOUNDS_WRITE =                      (0.05, 1.0)
+# Most inventory slots stay empty, waiting long for them makes the inventory slow
+TIMEOUT_BOUNDS_INVENTORY =                  (0.005, 0.02)
+TIMEOUT_BOUNDS = {
+    ISO_CMD_INVENTORY:                      TIMEOUT_BOUNDS_INVENTORY,
+    ISO_CMD_SELECT:                         TIMEOUT_BOUNDS_READ,
+    ISO_CMD_RESET_TO_READY:                 TIMEOUT_BOUNDS_READ,
+    ISO_CMD_SYSTEM_INFO:                    TIMEOUT_BOUNDS_READ,
+    ISO_CMD_EXTENDED_SYSTEM_INFO:           TIMEOUT_BOUNDS_READ,
+    ISO_CMD_READ_SINGLE_BLOCK:              TIMEOUT_BOUNDS_READ,
+    ISO_CMD_READ_MULTIPLE_BLOCKS:           TIMEOUT_BOUNDS_READ,
+    ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS:  TIMEOUT_BOUNDS_READ,
+    NXP_CMD_SYSTEM_INFO:                    TIMEOUT_BOUNDS_READ,
+    NXP_CMD_READ_CONFIG:                    TIMEOUT_BOUNDS_READ,
+    NXP_CMD_READ_SRAM:                      TIMEOUT_BOUNDS_READ,
+    NXP_CMD_READ_I2C:                       TIMEOUT_BOUNDS_READ,
+    NXP_CMD_WRITE_I2C:                      TIMEOUT_BOUNDS_READ,
+    NXP_CMD_WRITE_CONFIG:                   TIMEOUT_BOUNDS_WRITE,
+    ISO_CMD_WRITE_SINGLE_BLOCK:             TIMEOUT_BOUNDS_WRITE,
+    ISO_CMD_WRITE_MULTIPLE_BLOCKS:          TIMEOUT_BOUNDS_WRITE,
+    ISO_CMD_EXT_WRITE_SINGLE_BLOCK:         TIMEOUT_BOUNDS_WRITE,
+    ISO_CMD_EXT_WRITE_MULTIPLE_BLOCKS:      TIMEOUT_BOUNDS_WRITE,
+}
+
+# Learned timeout is the decaying peak response time times the margin
+# Response times are host round trips, they include the USB and PC/SC overhead on top of the RF exchange
+# the reader times against this timeout. The learned timeout therefore overestimates the RF time and
+# errs on the long side, the bounds clamp it
+TIMEOUT_MARGIN =                            3.0
+TIMEOUT_DECAY =                             0.99
+# Number of responses to observe before leaving the ceiling
+TIMEOUT_WARMUP =                            3
+
+
+class TimeoutPolicy:
+    def __init__(self, bounds = None, margin = TIMEOUT_MARGIN, decay = TIMEOUT_DECAY, warmup = TIMEOUT_WARMUP):
+        self.bounds = dict(TIMEOUT_BOUNDS)
+        self.bounds.update(bounds or {})
+        self.margin = margin
+        self.decay = decay
+        self.warmup = warmup
+        self.peaks = {}
+        self.counts = {}
+
+    def get(self, command):
+        floor, ceiling = self.bounds.get(command, TIMEOUT_BOUNDS_DEFAULT)
+        if(self.counts.get(command, 0) < self.warmup):
+            return ceiling
+        return max(floor, min(ceiling, self.peaks[command] * self.margin))
+
+    def observe(self, command, elapsed):
+        # Track a slowly decaying peak, so single slow responses are remembered for a while
+        self.peaks[command] = max(elapsed, self.peaks.get(command, 0.0) * self.decay)
+        self.counts[command] = self.counts.get(command, 0) + 1
+
+    def observe_timeout(self, command, timeout):
+        # Back off towards the ceiling, the learned value was too tight
+        # A timeout counts as an observation, so it is remembered once the warm-up is over
+        self.peaks[command] = max(self.peaks.get(command, 0.0), 2 * timeout / self.margin)
+        self.counts[command] = self.counts.get(command, 0) + 1
+
+    @staticmethod
+    def fwti(timeout):
+        # Smallest frame waiting time integer covering the timeout
+        fwt = (timeout * 1000000) / FWT_UNIT_US
+        if(fwt <= 1):
+            return 0
+        return min(FWTI_MAX, math.ceil(math.log2(fwt)))
@@ -0,0 +1,117 @@
+import struct, time
+from collections import deque
+
+from protocol.commands import (
+    ISO_FLAG_ERROR, NXP_CMD_READ_CONFIG, NXP_CMD_READ_I2C, NXP_CMD_READ_SRAM, NXP_CMD_SYSTEM_INFO,
+    NXP_CMD_WRITE_CONFIG, NXP_CMD_WRITE_I2C)
+
+from .stats import (
+    OPCODE_NAMES, OUTCOME_COLLISION, OUTCOME_CRC, OUTCOME_ERROR, OUTCOME_FRAMING, OUTCOME_PARITY,
+    OUTCOME_SUCCESS, OUTCOME_TIMEOUT)
+
+
+# Binary trace file layout: header, followed by one record per frame
+TRACE_MAGIC =                               b"NTAG5TRC"
+TRACE_VERSION =                             1
+TRACE_HEADER =                              struct.Struct("<8sB")
+# Record: timestamp in seconds, direction, outcome index, payload length
+TRACE_RECORD =                              struct.Struct("<dBBH")
+
+# Frame directions
+TRACE_REQUEST =                             0x00
+TRACE_RESPONSE =                            0x01
+
+# Outcomes are stored by index, requests always use the first one
+TRACE_OUTCOMES = (
+    OUTCOME_SUCCESS,
+    OUTCOME_CRC,
+    OUTCOME_COLLISION,
+    OUTCOME_PARITY,
+    OUTCOME_FRAMING,
+    OUTCOME_TIMEOUT,
+    OUTCOME_ERROR,
+)
+TRACE_OUTCOME_INDEX = { outcome: index for index, outcome in enumerate(TRACE_OUTCOMES) }
+
+# Number of frames kept in memory, about two minutes of a 50 Hz read loop
+TRACE_CAPACITY_DEFAULT =                    65536
+TRACE_FILE_DEFAULT =                        "ntag5sensor.trace"
+
+# Commands carrying a manufacturer code in front of their parameters
+TRACE_NXP_COMMANDS = (
+    NXP_CMD_SYSTEM_INFO,
+    NXP_CMD_READ_CONFIG,
+    NXP_CMD_WRITE_CONFIG,
+    NXP_CMD_READ_SRAM,
+    NXP_CMD_READ_I2C,
+    NXP_CMD_WRITE_I2C,
+)
+
+
+class TraceRecorder:
+    def __init__(self, path = TRACE_FILE_DEFAULT, capacity = TRACE_CAPACITY_DEFAULT):
+        # Ring buffer of (timestamp, direction, outcome, payload), oldest frames drop out
+        # A capacity of None keeps the complete session, e.g. for replay
+        self.path = path
+        self.frames = deque(maxlen = capacity)
+
+    def request(self, data):
+        self.frames.append((time.time(), TRACE_REQUEST, OUTCOME_SUCCESS, bytes(data)))
+
+    def response(self, data, outcome = OUTCOME_SUCCESS):
+        self.frames.append((time.time(), TRACE_RESPONSE, outcome, bytes(data)))
+
+    def clear(self):
+        self.frames.clear()
+
+    def flush(self, path = None):
+        # Write the buffered frames to a binary trace file, the buffer is kept
+        path = path or self.path
+        frames = list(self.frames)
+        with open(path, "wb") as file:
+            file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION))
+            for timestamp, direction, outcome, data in frames:
+                file.write(TRACE_RECORD.pack(timestamp, direction, TRACE_OUTCOME_INDEX[outcome], len(data)))
+                file.write(data)
+        return len(frames)
+
+    @staticmethod
+    def load(path):
+        # Read a binary trace file back into a list of (timestamp, direction, outcome, payload)
+        with open(path, "rb") as file:
+            content = file.read()
+        if(len(content) < TRACE_HEADER.size):
+            raise Exception("Trace file is truncated")
+        magic, version = TRACE_HEADER.unpack_from(content, 0)
+        if(magic != TRACE_MAGIC):
+            raise Exception("Not a trace file")
+        if(version != TRACE_VERSION):
+            raise Exception(f"Unsupported trace file version {version}")
+        frames = []
+        offset = TRACE_HEADER.size
+        while(offset < len(content)):
+            if(offset + TRACE_RECORD.size > len(content)):
+                raise Exception("Trace file is truncated")
+            timestamp, direction, outcome, length = TRACE_RECORD.unpack_from(content, offset)
+            offset += TRACE_RECORD.size
+            data = content[offset:offset + length]
+            if(len(data) != length):
+                raise Exception("Trace file is truncated")
+            offset += length
+            frames.append((timestamp, direction, TRACE_OUTCOMES[outcome], data))
+        return frames
+
+    @staticmethod
+    def describe(direction, outcome, data):
+        # Human readable description of a single frame
+        if(direction == TRACE_REQUEST):
+            if(len(data) < 2):
+                return f"> {data.hex()}"
+            command = data[1]
+            params = data[3:] if(command in TRACE_NXP_COMMANDS) else data[2:]
+            return f"> {OPCODE_NAMES.get(command, 'UNKNOWN')} (0x{command:02x}), flags 0x{data[0]:02x}, params {params.hex()}"
+        if(outcome != OUTCOME_SUCCESS):
+            return f"< {outcome} {data.hex()}"
+        if(len(data) >= 2 and (data[0] & ISO_FLAG_ERROR)):
+            return f"< error code 0x{data[1]:02x}"
+        return f"< {data[1:].hex()}"
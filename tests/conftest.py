@@ -0,0 +1,23 @@
+import os, sys
+
+import pytest
+
+# The packages are imported from the repository root, like ntag5sensor.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reader.emulator import NTAG5Emulator
+from reader.retry import RetryPolicy
+from vicinity.ntag5link import NTAG5Link
+
+
+@pytest.fixture
+def emulator():
+    # Emulated reader and tag, transient errors are repeated without waiting
+    reader = NTAG5Emulator()
+    reader.retry = RetryPolicy(delay = 0.0, jitter = 0.0)
+    return reader
+
+
+@pytest.fixture
+def chip(emulator):
+    return NTAG5Link(emulator)
@@ -0,0 +1,241 @@
+import pytest
+
+# The reader module needs pyscard even when no reader is connected
+pytest.importorskip("smartcard")
+
+from ber_tlv.tlv import Tlv
+
+from protocol.commands import ISO_ERROR_UNSUPPORTED_CMD, ISO_FLAG_ERROR, NXP_CMD_READ_CONFIG, NXP_CMD_READ_SRAM
+from protocol.errors import CollisionError, ISO15693Error, NoResponseError
+from reader.acr1552 import (ACR1552, EXCHANGE_HEADER, EXCHANGE_MAX_DATA, EXCHANGE_TIMEOUT_OFFSET, TLV_TAG_CMD_DATA,
+    TLV_TAG_CMD_TIMEOUT, TLV_TAG_CMD_FWTI, TLV_TAG_CMD_FWTI_PREFIX, TLV_TAG_ERROR, TLV_TAG_RESP_DATA,
+    TLV_TAG_RESP_FRAMING, TLV_TAG_RESP_STATUS, TLV_TAG_RESP_STATUS_ERROR_TRANSMISSION)
+from reader.emulator import NTAG5Emulator, EmulatedI2CDevice, EMULATOR_CONFIG_DEFAULTS, EMULATOR_UID
+from reader.retry import RetryPolicy
+from reader.stats import OPCODE_BATCH, OUTCOME_ERROR, OUTCOME_SUCCESS, OUTCOME_TIMEOUT
+from reader.timeout import TimeoutPolicy, TIMEOUT_BOUNDS_READ, TIMEOUT_WARMUP
+from vicinity.i2cbase import I2CBase
+from vicinity.ntag5link import NTAG5Link, NXP_CONFIG_ADDR_CONFIG, NXP_CONFIG_ADDR_EH_CONFIG
+
+
+class EmulatedACR1552(ACR1552):
+    # ACR1552 whose pseudo APDUs are answered by the tags of an emulated field
+    def __init__(self, emulator, batches = True, broken = False):
+        super().__init__()
+        self.emulator = emulator
+        self.batches = batches
+        self.broken = broken
+        self.retry = RetryPolicy(delay = 0.0, jitter = 0.0)
+        self.apdus = []
+
+    def transmit_pcsc(self, data):
+        data = bytes(data)
+        self.apdus.append(data)
+        if(self.broken):
+            raise Exception("Reader removed")
+        objects = list(Tlv.parse(data[5:-1]))
+        frames = [ value for tag, value in objects if(tag == TLV_TAG_CMD_DATA) ]
+        if(len(frames) > 1 and not self.batches):
+            return bytes(Tlv.build([ (TLV_TAG_ERROR, bytes([0x00, 0x6A, 0x81])) ]))
+        error = bytes([0x00, 0x90, 0x00])
+        responses = []
+        for index, frame in enumerate(frames):
+            # A tag slower than the timeout sent along is not heard
+            latency = self.emulator.latency.get(frame[1], self.emulator.default_latency)
+            status = 0x00
+            try:
+                answer = self.emulator._field_execute(frame) if(latency <= sent_timeout(data)) else None
+                if(answer != None):
+                    answer = bytes([0x00]) + answer
+            except CollisionError:
+                # Colliding answers are reported as a transmission error without data
+                answer = b''
+                status = TLV_TAG_RESP_STATUS_ERROR_TRANSMISSION
+            except ISO15693Error as e:
+                answer = bytes([ISO_FLAG_ERROR, e.code])
+            if(answer == None):
+                # Execution stops at the silent frame, data objects are counted after the timeout and FWTI
+                error = bytes([len(objects) - len(frames) + index, 0x64, 0x01])
+                break
+            responses += [ (TLV_TAG_RESP_FRAMING, bytes([0x00])), (TLV_TAG_RESP_STATUS, bytes([status, 0x00])),
+                (TLV_TAG_RESP_DATA, answer) ]
+        res = bytes(Tlv.build([ (TLV_TAG_ERROR, error) ] + responses))
+        if(len(res) > 0x100):
+            # A short APDU response does not fit
+            raise Exception("Response too long")
+        return res
+
+
+def sent_timeout(apdu):
+    return int.from_bytes(apdu[EXCHANGE_TIMEOUT_OFFSET:EXCHANGE_TIMEOUT_OFFSET + 4], "big") / 1000000
+
+
+def rows(reader):
+    return { (row["opcode"], row["outcome"]): row["count"] for row in reader.stats.summary() }
+
+
+@pytest.fixture
+def reader():
+    return EmulatedACR1552(NTAG5Emulator())
+
+
+@pytest.mark.parametrize("length", [ 2, 0x7F, 0x80, EXCHANGE_MAX_DATA ])
+@pytest.mark.parametrize("timeout", [ 0.02, 1.0 ])
+def test_exchange_frame_matches_tlv(reader, length, timeout):
+    data = bytes(range(length))
+    objects = bytes(Tlv.build([ (TLV_TAG_CMD_TIMEOUT, int(timeout * 1000000).to_bytes(4, "big")),
+        (TLV_TAG_CMD_FWTI, TLV_TAG_CMD_FWTI_PREFIX + bytes([TimeoutPolicy.fwti(timeout)])), (TLV_TAG_CMD_DATA, data) ]))
+    expected = EXCHANGE_HEADER[:-1] + bytes([len(objects)]) + objects + bytes([0x00])
+    assert bytes(reader._build_exchange((data,), timeout)) == expected
+
+
+def test_exchange_frame_length(reader):
+    with pytest.raises(Exception, match = "the maximum"):
+        reader._build_exchange((bytes(EXCHANGE_MAX_DATA + 1),), 1.0)
+
+
+def test_response_parser_matches_tlv():
+    res = bytes(Tlv.build([ (TLV_TAG_ERROR, bytes([0x00, 0x90, 0x00])), (0x5F46, bytes(4)),
+        (TLV_TAG_RESP_FRAMING, bytes([0x00])), (TLV_TAG_RESP_STATUS, bytes([0x00, 0x00])),
+        (TLV_TAG_RESP_DATA, bytes(range(0x90))) ]))
+    fields = ACR1552._parse_exchange(res)
+    expected = { tag: value for tag, value in Tlv.parse(res) if(tag != 0x5F46) }
+    assert { tag: bytes(value) for tag, value in fields.items() } == expected
+
+
+def test_exchange_through_emulated_reader(reader):
+    chip = NTAG5Link(reader)
+    assert chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)[:4] == EMULATOR_CONFIG_DEFAULTS[NXP_CONFIG_ADDR_CONFIG]
+    chip.write_config_block(NXP_CONFIG_ADDR_CONFIG, bytes([0x01, 0x02, 0x03, 0x04]))
+    assert chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)[:4] == bytes([0x01, 0x02, 0x03, 0x04])
+
+
+def test_learned_timeout_is_sent(reader):
+    chip = NTAG5Link(reader)
+    for index in range(TIMEOUT_WARMUP + 1):
+        chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)
+    floor, ceiling = TIMEOUT_BOUNDS_READ
+    timeouts = [ sent_timeout(apdu) for apdu in reader.apdus ]
+    assert timeouts[:TIMEOUT_WARMUP] == [ ceiling ] * TIMEOUT_WARMUP
+    # The emulated tag answers at once, the learned timeout drops to the floor
+    assert timeouts[-1] == reader.timeouts.get(NXP_CMD_READ_CONFIG) == floor
+
+
+def test_timeout_backs_off(reader):
+    chip = NTAG5Link(reader)
+    for index in range(TIMEOUT_WARMUP):
+        chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)
+    # The tag slows down beyond the learned timeout, the read is repeated with twice the time
+    reader.emulator.latency[NXP_CMD_READ_CONFIG] = 0.03
+    assert chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)[:4] == EMULATOR_CONFIG_DEFAULTS[NXP_CONFIG_ADDR_CONFIG]
+    floor = TIMEOUT_BOUNDS_READ[0]
+    assert [ sent_timeout(apdu) for apdu in reader.apdus[-2:] ] == [ floor, pytest.approx(2 * floor) ]
+    assert reader.retry.recoveries[NXP_CMD_READ_CONFIG] == 1
+
+
+def test_batch_matches_single_exchanges(reader):
+    chip = NTAG5Link(reader)
+    frames = [ chip.read_config_frame(NXP_CONFIG_ADDR_CONFIG), chip.read_config_frame(NXP_CONFIG_ADDR_EH_CONFIG),
+        chip.read_sram_frame(0x00, 2) ]
+    expected = [ reader.transmit_iso15693(frame) for frame in frames ]
+    reader.apdus = []
+    assert reader.transmit_iso15693_batch(frames) == expected
+    assert len(reader.apdus) == 1
+    assert rows(reader)[(OPCODE_BATCH, OUTCOME_SUCCESS)] == 1
+
+
+def test_batch_stops_at_failed_frame(reader):
+    # The SRAM read answers later than any timeout
+    chip = NTAG5Link(reader)
+    reader.emulator.latency[NXP_CMD_READ_SRAM] = 10.0
+    frames = [ chip.read_config_frame(NXP_CONFIG_ADDR_CONFIG), chip.read_sram_frame(),
+        chip.read_config_frame(NXP_CONFIG_ADDR_EH_CONFIG) ]
+    results = reader.transmit_iso15693_batch(frames)
+    assert results[0] == reader.emulator._field_execute(frames[0])
+    assert isinstance(results[1], NoResponseError)
+    assert results[2] == None
+    # Recorded as one exchange, kept out of the per command statistics and timeout learning
+    assert rows(reader) == { (OPCODE_BATCH, OUTCOME_TIMEOUT): 1 }
+    assert reader.timeouts.counts == {}
+
+
+def test_batch_reports_tag_errors(reader):
+    # A custom command with another manufacturer code is not supported by the tag
+    chip = NTAG5Link(reader)
+    unsupported = bytes([0x02, NXP_CMD_READ_CONFIG, 0x00, NXP_CONFIG_ADDR_CONFIG, 0x00])
+    frames = [ chip.read_config_frame(NXP_CONFIG_ADDR_CONFIG), unsupported,
+        chip.read_config_frame(NXP_CONFIG_ADDR_CONFIG) ]
+    results = reader.transmit_iso15693_batch(frames)
+    assert isinstance(results[1], ISO15693Error)
+    assert results[1].code == ISO_ERROR_UNSUPPORTED_CMD
+    assert results[2] == None
+    assert rows(reader) == { (OPCODE_BATCH, OUTCOME_ERROR): 1 }
+
+
+def test_batch_transmit_failure(reader):
+    reader.broken = True
+    with pytest.raises(Exception, match = "Reader removed"):
+        reader.transmit_iso15693_batch([ NTAG5Link(reader).read_config_frame(NXP_CONFIG_ADDR_CONFIG) ] * 2)
+    assert rows(reader) == { (OPCODE_BATCH, OUTCOME_ERROR): 1 }
+
+
+def test_batch_falls_back_to_single_exchanges(reader, capsys):
+    chip = NTAG5Link(reader)
+    frames = [ chip.read_config_frame(NXP_CONFIG_ADDR_CONFIG), chip.read_config_frame(NXP_CONFIG_ADDR_EH_CONFIG) ]
+    expected = [ reader.transmit_iso15693(frame) for frame in frames ]
+    reader.batches = False
+    assert reader.transmit_iso15693_batch(frames) == expected
+    assert not reader.batch_supported
+    assert "does not support batched exchanges" in capsys.readouterr().out
+    # Later batches go out one frame per APDU right away
+    reader.apdus = []
+    assert reader.transmit_iso15693_batch(frames) == expected
+    assert len(reader.apdus) == len(frames)
+
+
+def test_batch_is_split_on_apdu_size(reader):
+    # Three I2C writes of 60 bytes fill the command data
+    chip = NTAG5Link(reader)
+    frames = [ chip.write_i2c_frame(0x48, bytes(60)) ] * 10
+    results = reader.transmit_iso15693_batch(frames)
+    assert results == [ b'' ] * 10
+    assert len(reader.apdus) == 4
+
+
+def test_batch_is_split_on_response_size(reader):
+    # SRAM reads of 240 bytes each need their own response, two of 80 bytes share one
+    chip = NTAG5Link(reader)
+    frames = [ chip.read_sram_frame(0x00, 60), chip.read_sram_frame(0x00, 60), chip.read_sram_frame(0x00, 20),
+        chip.read_sram_frame(0x00, 20) ]
+    expected = [ reader.emulator._field_execute(frame) for frame in frames ]
+    assert reader.transmit_iso15693_batch(frames) == expected
+    assert len(reader.apdus) == 3
+
+
+def test_large_register_bursts(reader):
+    reader.emulator.attach(0x5A, EmulatedI2CDevice({ register: register for register in range(0x100) }))
+    device = I2CBase(NTAG5Link(reader), 0x5A)
+    registers = list(range(0x00, 0x78)) + list(range(0x80, 0xF8))
+    assert device.read_registers(registers, gap = 0) == { register: bytes([register]) for register in registers }
+
+
+def test_inventory_without_warnings(capsys):
+    # Empty slots and collisions are expected during an inventory
+    emulator = NTAG5Emulator()
+    uids = [ EMULATOR_UID[:-1] + bytes([index << 4]) for index in range(3) ]
+    for uid in uids[1:]:
+        emulator.place(NTAG5Emulator(uid))
+    chip = NTAG5Link(EmulatedACR1552(emulator))
+    assert sorted(chip.inventory(16)) == sorted(uids)
+    assert "warning" not in capsys.readouterr().out
+
+
+def test_missing_response_warns(reader, capsys):
+    # Addressed to a tag that is not in the field
+    chip = NTAG5Link(reader)
+    chip.address(bytes(8))
+    frame = chip.read_config_frame(NXP_CONFIG_ADDR_CONFIG)
+    assert chip.transmit(frame, True) == b''
+    assert "Ignoring error" in capsys.readouterr().out
+    with pytest.raises(NoResponseError):
+        chip.transmit(frame)
@@ -0,0 +1,57 @@
+import pytest
+
+from reader.emulator import EMULATOR_CONFIG_DEFAULTS
+from vicinity.ntag5link import (NXP_CMD_WRITE_CONFIG, NXP_CONFIG_ADDR_CONFIG, NXP_CONFIG_ADDR_EH_CONFIG,
+    NXP_CONFIG_ADDR_I2C_M_STATUS_REG, NXP_CONFIG_1_USE_CASE_CONF_I2C_MASTER, NTAG5Link)
+
+
+def writes(emulator):
+    return sum(row["count"] for row in emulator.stats.summary() if(row["opcode"] == NXP_CMD_WRITE_CONFIG))
+
+
+def profile():
+    # I2C master with SRAM, the last configuration byte is kept as it is
+    return {
+        NXP_CONFIG_ADDR_CONFIG: [ NTAG5Link.build_config0(),
+            NTAG5Link.build_config1(sram_enable = True, use_case = NXP_CONFIG_1_USE_CASE_CONF_I2C_MASTER),
+            NTAG5Link.build_config2(gpio0_in = 0, gpio1_in = 0), None ],
+        NXP_CONFIG_ADDR_EH_CONFIG: list(NTAG5Link.build_eh_ed_config(enable = True)),
+    }
+
+
+def test_plan_lists_changed_blocks(emulator, chip):
+    plan = chip.plan_config_profile(profile())
+    assert [ address for address, current, target in plan ] == [ NXP_CONFIG_ADDR_CONFIG, NXP_CONFIG_ADDR_EH_CONFIG ]
+    for address, current, target in plan:
+        assert current == EMULATOR_CONFIG_DEFAULTS[address]
+    # None keeps the byte read from the tag
+    assert plan[0][2][3] == EMULATOR_CONFIG_DEFAULTS[NXP_CONFIG_ADDR_CONFIG][3]
+    assert writes(emulator) == 0
+
+
+def test_plan_skips_matching_blocks(emulator, chip):
+    current = EMULATOR_CONFIG_DEFAULTS[NXP_CONFIG_ADDR_CONFIG]
+    assert chip.plan_config_profile({ NXP_CONFIG_ADDR_CONFIG: list(current) }) == []
+    assert chip.plan_config_profile({ NXP_CONFIG_ADDR_CONFIG: [ None ] * 4 }) == []
+
+
+def test_apply_writes_once_and_reads_back(emulator, chip):
+    plan = chip.apply_config_profile(profile())
+    assert writes(emulator) == len(plan) == 2
+    for address, current, target in plan:
+        assert bytes(emulator.config[address]) == target
+        assert chip.read_config_block(address)[:4] == target
+    # Applying the same profile again finds nothing to write
+    assert chip.apply_config_profile(profile()) == []
+    assert writes(emulator) == 2
+
+
+def test_apply_detects_ignored_write(emulator, chip):
+    # The I2C master status register is read-only, the write is acknowledged without effect
+    with pytest.raises(Exception, match = "after writing"):
+        chip.apply_config_profile({ NXP_CONFIG_ADDR_I2C_M_STATUS_REG: [ 0x55, 0x55, 0x55, 0x55 ] })
+
+
+def test_block_profile_length(chip):
+    with pytest.raises(Exception, match = "four bytes"):
+        chip.plan_config_profile({ NXP_CONFIG_ADDR_CONFIG: [ 0x00 ] })
@@ -0,0 +1,55 @@
+import pytest
+
+from reader.emulator import (EMULATOR_UID, EMULATOR_NUM_BLOCKS, EMULATOR_BLOCK_SIZE, EMULATOR_CONFIG_DEFAULTS,
+    EmulatedTMP117, EmulatedTMP112)
+from vicinity.ntag5link import NXP_CONFIG_ADDR_CONFIG, NXP_CONFIG_ADDR_I2C_M_STATUS_REG
+from vicinity.tmp117 import TMP117, TMP117_I2C_REG_DEVICE_ID
+from vicinity.tmp112 import TMP112
+
+
+def test_system_info(chip):
+    info = chip.get_system_info()
+    assert info["uid"] == EMULATOR_UID
+    # The basic system information counts blocks in one byte, like the tag it caps at 256
+    assert info["numblocks"] == min(EMULATOR_NUM_BLOCKS, 256)
+    assert info["blocksize"] == EMULATOR_BLOCK_SIZE
+
+
+def test_extended_system_info(chip):
+    info = chip.get_extended_system_info()
+    assert info["numblocks"] == EMULATOR_NUM_BLOCKS and info["moi"] == 1
+    # Like the tag, no multiple block write is supported
+    assert info["cmdlist"]["extended_write_single_block"]
+    assert not info["cmdlist"]["write_multiple_blocks"]
+    assert not info["cmdlist"]["extended_write_multiple_blocks"]
+
+
+def test_config_write_reads_back(emulator, chip):
+    assert chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)[:4] == EMULATOR_CONFIG_DEFAULTS[NXP_CONFIG_ADDR_CONFIG]
+    chip.write_config_block(NXP_CONFIG_ADDR_CONFIG, bytes([0x01, 0x02, 0x03, 0x04]))
+    assert chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)[:4] == bytes([0x01, 0x02, 0x03, 0x04])
+
+
+def test_config_write_is_answered(emulator):
+    # The tag answers a configuration write, also the ignored one to the read-only status register
+    for address in (NXP_CONFIG_ADDR_CONFIG, NXP_CONFIG_ADDR_I2C_M_STATUS_REG):
+        frame = bytes([0x02, 0xC1, 0x04, address, 0x55, 0x55, 0x55, 0x55])
+        assert emulator.transmit_iso15693(frame) == b''
+    assert emulator.config.get(NXP_CONFIG_ADDR_I2C_M_STATUS_REG) == None
+
+
+def test_i2c_sensor_registers(emulator, chip):
+    emulator.attach(0x48, EmulatedTMP117(temperature = 21.5))
+    sensor = TMP117(chip, 0x48)
+    assert sensor.read_register(TMP117_I2C_REG_DEVICE_ID, 2) == bytes([0x01, 0x17])
+    assert sensor.read_temperature() == pytest.approx(21.5, abs = 0.01)
+
+
+def test_missing_i2c_device(chip):
+    with pytest.raises(Exception, match = "not acknowledged"):
+        TMP112(chip, 0x49).read_temperature()
+
+
+def test_unsupported_command(emulator):
+    with pytest.raises(Exception, match = "not supported"):
+        emulator.transmit_iso15693(bytes([0x02, 0xC0, 0x00, 0x00, 0x00]))
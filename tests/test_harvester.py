@@ -0,0 +1,55 @@
+import pytest
+
+from vicinity.harvester import EnergyHarvester
+from vicinity.ntag5link import NXP_CMD_WRITE_CONFIG, NXP_CONFIG_ADDR_EH_CONFIG_REG, NXP_EH_ENABLE
+
+
+def config_writes(emulator):
+    return sum(row["count"] for row in emulator.stats.summary() if(row["opcode"] == NXP_CMD_WRITE_CONFIG))
+
+
+def test_start_waits_for_stable_load(emulator, chip):
+    emulator.eh_delay = 0.01
+    harvester = EnergyHarvester(chip)
+    harvester.start()
+    assert harvester.is_active(force = True)
+    assert harvester.time_to_stable >= 0.01
+    # Trigger, then enable
+    assert config_writes(emulator) == 2
+
+
+def test_start_keeps_active_harvesting(emulator, chip):
+    EnergyHarvester(chip).start()
+    writes = config_writes(emulator)
+    harvester = EnergyHarvester(chip)
+    harvester.start()
+    assert harvester.time_to_stable == 0.0
+    assert config_writes(emulator) == writes
+
+
+def test_start_gives_up(emulator, chip):
+    emulator.eh_delay = 10.0
+    with pytest.raises(Exception, match = "did not stabilize"):
+        EnergyHarvester(chip, timeout = 0.02).start()
+
+
+def test_watch_checks_every_few_calls(emulator, chip):
+    harvester = EnergyHarvester(chip, watch_every = 5)
+    harvester.start()
+    emulator.brownout()
+    # The drop goes unnoticed until the fifth call
+    assert [ harvester.watch() for index in range(4) ] == [ True ] * 4
+    assert harvester.watch() == False
+    assert harvester.rearms == 1
+    assert harvester.is_active(force = True)
+    assert harvester.watch() == True
+
+
+def test_watch_forced_after_lost_sample(emulator, chip):
+    harvester = EnergyHarvester(chip, watch_every = 1000)
+    harvester.start()
+    assert harvester.watch(force = True) == True
+    emulator.brownout()
+    assert harvester.watch(force = True) == False
+    assert harvester.rearms == 1
+    assert emulator.config[NXP_CONFIG_ADDR_EH_CONFIG_REG][0] & NXP_EH_ENABLE
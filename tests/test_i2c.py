@@ -0,0 +1,207 @@
+import pytest
+
+from reader.emulator import EmulatedI2CDevice, EmulatedTMP117
+from vicinity.i2cbase import I2CBase, I2C_BURST_MAX_BYTES
+from vicinity.ntag5link import NTAG5Link
+from vicinity.tmp117 import (TMP117, TMP117_I2C_REG_CONFIG, TMP117_I2C_REG_DEVICE_ID, TMP117_I2C_REG_TEMP_RESULT,
+    TMP117_I2C_REG_THIGH_LIMIT, TMP117_CONFIG_FLAG_DATA_READY, TMP117_CONFIG_FLAG_MOD_MASK,
+    TMP117_CONFIG_FLAG_MOD_ONESHOT, TMP117_CONFIG_FLAG_MOD_SHUTDOWN)
+
+
+class CountingReader:
+    # Reader passing every frame on to another one, counting the exchanges
+    def __init__(self, reader):
+        self.reader = reader
+        self.exchanges = 0
+
+    def transmit_iso15693(self, data, *args, **kwargs):
+        self.exchanges += 1
+        return self.reader.transmit_iso15693(data, *args, **kwargs)
+
+
+class BatchingReader(CountingReader):
+    # Counting reader that also passes on batches, counted as one exchange each
+    def transmit_iso15693_batch(self, frames):
+        self.exchanges += 1
+        return self.reader.transmit_iso15693_batch(frames)
+
+
+class StoppingReader(BatchingReader):
+    # Batching reader whose batches stop after a number of frames, like after a failed frame
+    def __init__(self, reader, frames):
+        super().__init__(reader)
+        self.frames = frames
+
+    def transmit_iso15693_batch(self, frames):
+        results = super().transmit_iso15693_batch(frames[:self.frames])
+        return results + [ None ] * (len(frames) - len(results))
+
+
+class RacingTMP117(EmulatedTMP117):
+    # Oneshot conversions finish between the CONFIG and TEMP_RESULT reads, the TEMP_RESULT read clears DATA_READY
+    def write_register(self, register, value):
+        EmulatedI2CDevice.write_register(self, register, value & ~TMP117_CONFIG_FLAG_DATA_READY)
+
+    def read_register(self, register):
+        config = self.registers[TMP117_I2C_REG_CONFIG]
+        mode = config & TMP117_CONFIG_FLAG_MOD_MASK
+        if(register == TMP117_I2C_REG_TEMP_RESULT and mode == TMP117_CONFIG_FLAG_MOD_ONESHOT):
+            config = (config & ~TMP117_CONFIG_FLAG_MOD_MASK) | TMP117_CONFIG_FLAG_MOD_SHUTDOWN
+            self.registers[TMP117_I2C_REG_CONFIG] = config
+        return super().read_register(register)
+
+
+@pytest.fixture
+def sensor(emulator):
+    emulator.attach(0x48, EmulatedTMP117())
+    reader = CountingReader(emulator)
+    return reader, TMP117(NTAG5Link(reader), 0x48)
+
+
+def test_register_read_exchanges(sensor):
+    reader, tmp117 = sensor
+    # The first read checks the bus, after that it is known to be idle
+    assert tmp117.read_register(TMP117_I2C_REG_DEVICE_ID, 2) == bytes([0x01, 0x17])
+    reader.exchanges = 0
+    for index in range(3):
+        assert tmp117.read_register(TMP117_I2C_REG_DEVICE_ID, 2) == bytes([0x01, 0x17])
+    assert reader.exchanges == 3 * 4
+
+
+def test_register_write_exchanges(sensor):
+    reader, tmp117 = sensor
+    tmp117.read_register(TMP117_I2C_REG_DEVICE_ID, 2)
+    reader.exchanges = 0
+    tmp117.write_register(TMP117_I2C_REG_THIGH_LIMIT, [0x3E, 0x80])
+    assert reader.exchanges == 2
+    assert tmp117.read_register(TMP117_I2C_REG_THIGH_LIMIT, 2) == bytes([0x3E, 0x80])
+
+
+def test_busy_bus_is_waited_for(sensor):
+    reader, tmp117 = sensor
+    tmp117.read_register(TMP117_I2C_REG_DEVICE_ID, 2)
+    # An unknown bus state costs one status fetch before the transaction
+    tmp117.chip.i2c_idle = False
+    reader.exchanges = 0
+    tmp117.read_register(TMP117_I2C_REG_DEVICE_ID, 2)
+    assert reader.exchanges == 5
+
+
+def test_missing_device_is_reported(sensor):
+    reader, tmp117 = sensor
+    with pytest.raises(Exception, match = "not acknowledged"):
+        TMP117(tmp117.chip, 0x49).read_register(TMP117_I2C_REG_DEVICE_ID, 2)
+
+
+def test_batched_register_transactions(emulator):
+    emulator.attach(0x48, EmulatedTMP117())
+    reader = BatchingReader(emulator)
+    tmp117 = TMP117(NTAG5Link(reader), 0x48)
+    tmp117.read_register(TMP117_I2C_REG_DEVICE_ID, 2)
+    reader.exchanges = 0
+    # Address write, I2C read, status fetch and SRAM read go out together
+    assert tmp117.read_register(TMP117_I2C_REG_DEVICE_ID, 2) == bytes([0x01, 0x17])
+    assert reader.exchanges == 1
+    reader.exchanges = 0
+    tmp117.write_register(TMP117_I2C_REG_THIGH_LIMIT, [0x3E, 0x80])
+    assert reader.exchanges == 1
+    assert tmp117.read_register(TMP117_I2C_REG_THIGH_LIMIT, 2) == bytes([0x3E, 0x80])
+
+
+def test_plan_bursts_joins_registers():
+    device = I2CBase(None, 0x5A)
+    assert device.plan_bursts([ 0x40, 0x12, 0x10, 0x20, 0x12 ]) == [ (0x10, 3), (0x20, 1), (0x40, 1) ]
+    assert device.plan_bursts([ 0x10, 0x20 ], gap = 16) == [ (0x10, 17) ]
+    # A burst must fit into one SRAM read
+    assert device.plan_bursts([ 0, I2C_BURST_MAX_BYTES - 1, I2C_BURST_MAX_BYTES ], gap = 1000) == \
+        [ (0, I2C_BURST_MAX_BYTES), (I2C_BURST_MAX_BYTES, 1) ]
+
+
+def test_plan_bursts_without_auto_increment():
+    # Every register is read on its own, in the requested order
+    tmp117 = TMP117(None, 0x48)
+    assert tmp117.plan_bursts([ 0x05, 0x01, 0x02, 0x05 ]) == [ (0x05, 1), (0x01, 1), (0x02, 1) ]
+
+
+def burst_device(emulator, reader_class = BatchingReader, *args):
+    emulator.attach(0x5A, EmulatedI2CDevice({ register: (register * 3) & 0xFF for register in range(0x80) }))
+    reader = reader_class(emulator, *args)
+    device = I2CBase(NTAG5Link(reader), 0x5A)
+    device.read_register(0x00, 1)
+    reader.exchanges = 0
+    return reader, device
+
+
+def test_read_registers_in_one_batch(emulator):
+    reader, device = burst_device(emulator)
+    registers = [ 0x22, 0x10, 0x12, 0x48 ]
+    assert device.read_registers(registers) == { register: bytes([register * 3]) for register in registers }
+    # Results keep the requested order, each call is one batch
+    assert list(device.read_registers(registers)) == registers
+    assert reader.exchanges == 2
+
+
+def test_read_registers_repeats_unfinished_bursts(emulator):
+    # Only the first burst completes within the batch, the others are read on their own
+    reader, device = burst_device(emulator, StoppingReader, 4)
+    registers = [ 0x10, 0x30, 0x48 ]
+    assert device.read_registers(registers) == { register: bytes([register * 3]) for register in registers }
+    assert reader.exchanges == 1 + 2
+
+
+def test_shadow_masks_volatile_bits(sensor):
+    reader, tmp117 = sensor
+    config = int.from_bytes(tmp117.read_register(TMP117_I2C_REG_CONFIG, 2), byteorder="big")
+    assert config & TMP117_CONFIG_FLAG_DATA_READY
+    reader.exchanges = 0
+    shadowed = int.from_bytes(tmp117.read_shadowed(TMP117_I2C_REG_CONFIG), byteorder="big")
+    assert shadowed == config & ~TMP117_CONFIG_FLAG_DATA_READY
+    assert reader.exchanges == 0
+    # Registers outside the shadow are not kept
+    tmp117.read_register(TMP117_I2C_REG_DEVICE_ID, 2)
+    assert TMP117_I2C_REG_DEVICE_ID not in tmp117.shadow
+
+
+def test_shadow_write_through(sensor):
+    reader, tmp117 = sensor
+    tmp117.write_register(TMP117_I2C_REG_THIGH_LIMIT, [0x3E, 0x80])
+    reader.exchanges = 0
+    assert tmp117.read_shadowed(TMP117_I2C_REG_THIGH_LIMIT) == bytes([0x3E, 0x80])
+    assert reader.exchanges == 0
+
+
+def test_config_change_is_one_write(sensor):
+    reader, tmp117 = sensor
+    tmp117.read_register(TMP117_I2C_REG_CONFIG, 2)
+    reader.exchanges = 0
+    tmp117.write_config(conversion_mode = TMP117_CONFIG_FLAG_MOD_ONESHOT)
+    assert reader.exchanges == 2
+    config = int.from_bytes(tmp117.read_register(TMP117_I2C_REG_CONFIG, 2), byteorder="big")
+    assert config & TMP117_CONFIG_FLAG_MOD_MASK == TMP117_CONFIG_FLAG_MOD_ONESHOT
+
+
+def test_failed_write_leaves_register_unknown(sensor):
+    reader, tmp117 = sensor
+    missing = TMP117(tmp117.chip, 0x49)
+    missing.shadow[TMP117_I2C_REG_THIGH_LIMIT] = bytes([0x60, 0x00])
+    with pytest.raises(Exception, match = "not acknowledged"):
+        missing.write_register(TMP117_I2C_REG_THIGH_LIMIT, [0x3E, 0x80])
+    assert TMP117_I2C_REG_THIGH_LIMIT not in missing.shadow
+
+
+def test_shadow_is_filled_by_bursts_and_cleared_by_reset(sensor):
+    reader, tmp117 = sensor
+    tmp117.read_registers([ TMP117_I2C_REG_CONFIG, TMP117_I2C_REG_THIGH_LIMIT ])
+    assert set(tmp117.shadow) == { TMP117_I2C_REG_CONFIG, TMP117_I2C_REG_THIGH_LIMIT }
+    tmp117.general_reset()
+    assert tmp117.shadow == {}
+
+
+def test_oneshot_finishing_between_reads(emulator):
+    emulator.attach(0x48, RacingTMP117(temperature = 21.5))
+    tmp117 = TMP117(NTAG5Link(emulator), 0x48)
+    tmp117.trigger_oneshot()
+    assert tmp117.read_temperature() == None
+    # DATA_READY was cleared, the mode back at shutdown marks the result
+    assert tmp117.read_temperature() == pytest.approx(21.5, abs = 0.01)
+    assert tmp117.read_temperature() == None
@@ -0,0 +1,78 @@
+import pytest
+
+from protocol.commands import ISO_CMD_INVENTORY
+from protocol.errors import NoResponseError
+from reader.emulator import NTAG5Emulator, EMULATOR_UID
+from reader.stats import OUTCOME_COLLISION
+from vicinity.ntag5link import NTAG5Link, ISO_MODE_UNADDRESSED, ISO_MODE_SELECTED
+
+
+def field(uids):
+    # Reader with one emulated tag per UID, the first one is the reader's own tag
+    reader = NTAG5Emulator(uids[0])
+    for uid in uids[1:]:
+        reader.place(NTAG5Emulator(uid))
+    return reader
+
+
+def collisions(reader):
+    return sum(row["count"] for row in reader.stats.summary()
+        if(row["opcode"] == ISO_CMD_INVENTORY and row["outcome"] == OUTCOME_COLLISION))
+
+
+# Tags differing in the first slot bits, and tags sharing all but their most significant UID bits
+UIDS_LOW = [ EMULATOR_UID[:-1] + bytes([index << 4]) for index in range(3) ]
+UIDS_HIGH = [ bytes([0xE0, 0x04, 0x01, 0x58 + index, 0x50, 0x8D, 0x11, 0x00]) for index in range(3) ]
+
+
+@pytest.mark.parametrize("slots", [ 1, 16 ])
+@pytest.mark.parametrize("uids", [ UIDS_LOW, UIDS_HIGH ])
+def test_inventory_resolves_collisions(uids, slots):
+    reader = field(uids)
+    found = NTAG5Link(reader).inventory(slots)
+    assert sorted(found) == sorted(uids)
+    assert collisions(reader) > 0
+
+
+def test_inventory_single_tag():
+    reader = field([ EMULATOR_UID ])
+    assert NTAG5Link(reader).inventory(16) == [ EMULATOR_UID ]
+    assert collisions(reader) == 0
+
+
+def test_inventory_empty_field():
+    reader = field([ EMULATOR_UID ])
+    reader.field = []
+    assert NTAG5Link(reader).inventory(16) == []
+
+
+def test_inventory_slot_count():
+    with pytest.raises(Exception):
+        NTAG5Link(field([ EMULATOR_UID ])).inventory(4)
+
+
+def test_addressed_commands_reach_one_tag():
+    reader = field(UIDS_LOW)
+    for uid in NTAG5Link(reader).inventory(16):
+        chip = NTAG5Link(reader)
+        chip.address(uid)
+        assert chip.get_system_info()["uid"] == uid
+
+
+def test_select_moves_between_tags():
+    reader = field(UIDS_LOW)
+    chip = NTAG5Link(reader)
+    chip.select(UIDS_LOW[1])
+    assert chip.mode == ISO_MODE_SELECTED
+    assert [ tag.selected for tag in reader.field ] == [ False, True, False ]
+    assert chip.get_system_info()["uid"] == UIDS_LOW[1]
+    NTAG5Link(reader).select(UIDS_LOW[2])
+    assert [ tag.selected for tag in reader.field ] == [ False, False, True ]
+
+
+def test_failed_select_keeps_addressing():
+    chip = NTAG5Link(field(UIDS_LOW))
+    with pytest.raises(NoResponseError):
+        chip.select(bytes(8))
+    assert chip.mode == ISO_MODE_UNADDRESSED
+    assert chip.uid == None
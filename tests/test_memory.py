@@ -0,0 +1,186 @@
+import pytest
+
+from protocol.errors import CRCError, PseudoAPDUError
+from reader.emulator import EMULATOR_BLOCK_SIZE
+from vicinity.iso15693 import (ISO15693, ISO_CMD_EXT_WRITE_SINGLE_BLOCK, ISO_CMD_WRITE_MULTIPLE_BLOCKS,
+    ISO_CMD_WRITE_SINGLE_BLOCK, ISO_READ_CHUNK_BYTES)
+
+# Extended system information of an NTAG 5 Link, without WRITE MULTIPLE BLOCKS in its command list
+CAPTURED_EXTENDED_SYSTEM_INFO = bytes.fromhex("3f 0100000008 0104e0 0000 ff01 03 01 ef7f6f00")
+
+
+class LimitedReader:
+    # Reader that rejects responses longer than its buffer, like a short reader response
+    def __init__(self, emulator, limit):
+        self.emulator = emulator
+        self.limit = limit
+        self.frames = 0
+
+    def transmit_iso15693(self, data, allow_no_response = False, timeout = None):
+        self.frames += 1
+        res = self.emulator.transmit_iso15693(data, allow_no_response, timeout)
+        if(len(res) > self.limit):
+            raise PseudoAPDUError("Response too long")
+        return res
+
+
+class NoisyReader(LimitedReader):
+    def transmit_iso15693(self, data, allow_no_response = False, timeout = None):
+        self.frames += 1
+        raise CRCError("CRC error")
+
+
+class MultipleBlockReader:
+    # Tag variant that supports WRITE MULTIPLE BLOCKS, executed as single block writes
+    def __init__(self, emulator):
+        self.emulator = emulator
+
+    def transmit_iso15693(self, data, allow_no_response = False, timeout = None):
+        if(data[1] != ISO_CMD_WRITE_MULTIPLE_BLOCKS):
+            return self.emulator.transmit_iso15693(data, allow_no_response, timeout)
+        for index in range(data[3] + 1):
+            block = data[4 + index * EMULATOR_BLOCK_SIZE:4 + (index + 1) * EMULATOR_BLOCK_SIZE]
+            self.emulator.transmit_iso15693(bytes([data[0], ISO_CMD_WRITE_SINGLE_BLOCK, data[2] + index]) + block)
+        return b''
+
+
+class CapturedReader:
+    # Reader answering every request with one recorded response
+    def __init__(self, response):
+        self.response = response
+
+    def transmit_iso15693(self, data, allow_no_response = False, timeout = None):
+        return self.response
+
+
+class LossyReader:
+    # Reader whose first writes of a command never reach the EEPROM
+    def __init__(self, emulator, command, lost = 1):
+        self.emulator = emulator
+        self.command = command
+        self.lost = lost
+        self.commands = []
+
+    def transmit_iso15693(self, data, allow_no_response = False, timeout = None):
+        self.commands.append(data[1])
+        if(data[1] == self.command and self.lost > 0):
+            self.lost -= 1
+            return b''
+        return self.emulator.transmit_iso15693(data, allow_no_response, timeout)
+
+
+def fill(emulator, locked = ()):
+    emulator.memory[:] = bytes(index & 0xFF for index in range(len(emulator.memory)))
+    emulator.locked = set(locked)
+
+
+def test_read_memory_matches_blocks(chip, emulator):
+    fill(emulator, locked = (3, 100))
+    image = chip.read_memory(0, 128)
+    assert bytes(image.data) == bytes(emulator.memory[:128 * EMULATOR_BLOCK_SIZE])
+    assert image.locked_blocks() == [ 3, 100 ]
+    assert bytes(image.block(5)) == bytes(emulator.memory[20:24])
+    # The first chunk fits a short reader response
+    assert chip.read_chunk == ISO_READ_CHUNK_BYTES // (EMULATOR_BLOCK_SIZE + 1)
+
+
+def test_chunk_is_halved_on_rejected_frame(chip, emulator):
+    fill(emulator, locked = (7,))
+    chip.reader = LimitedReader(emulator, 50)
+    image = chip.read_memory(0, 64)
+    assert bytes(image.data) == bytes(emulator.memory[:64 * EMULATOR_BLOCK_SIZE])
+    assert image.locked_blocks() == [ 7 ]
+    # Chunks of 48, 24 and 12 blocks are rejected, 64 blocks then take 11 frames of 6 or less
+    assert chip.read_chunk == 6
+    frames = chip.reader.frames
+    # The working size is kept for later reads
+    chip.read_memory(0, 64)
+    assert chip.reader.frames - frames == 11
+
+
+def test_other_errors_are_not_retried_smaller(chip, emulator):
+    chip.reader = NoisyReader(emulator, 0)
+    with pytest.raises(CRCError):
+        chip.read_memory(0, 64)
+    assert chip.reader.frames == 1
+    assert chip.read_chunk == ISO_READ_CHUNK_BYTES // (EMULATOR_BLOCK_SIZE + 1)
+
+
+def test_single_block_rejected(chip, emulator):
+    chip.reader = LimitedReader(emulator, 4)
+    with pytest.raises(PseudoAPDUError):
+        chip.read_memory(0, 4)
+
+
+def test_write_memory_round_trip(chip, emulator):
+    data = bytes(range(200))
+    result = chip.write_memory(10, data)
+    assert bytes(emulator.memory[40:240]) == data
+    # The tag lists no multiple block write
+    assert result["command"] == ISO_CMD_EXT_WRITE_SINGLE_BLOCK
+    assert result["blocks"] == 50 and result["frames"] == 50
+    assert result["rewrites"] == []
+
+
+def test_write_memory_keeps_partial_block(chip, emulator):
+    fill(emulator)
+    chip.write_memory(2, bytes([0xAA] * 6))
+    assert bytes(emulator.memory[8:16]) == bytes([0xAA] * 6) + bytes([14, 15])
+
+
+def test_write_memory_without_multiple_block_writes(chip, emulator):
+    cmdlist = { "write_single_block": True, "extended_write_single_block": True }
+    result = chip.write_memory(0, bytes(range(32)), cmdlist = cmdlist)
+    assert result["command"] == ISO_CMD_EXT_WRITE_SINGLE_BLOCK
+    assert result["frames"] == 8
+
+
+def test_write_memory_rewrites_lost_blocks(chip, emulator):
+    # The first frame of 16 blocks never reaches the EEPROM, its blocks are written again one by one
+    chip.reader = LossyReader(MultipleBlockReader(emulator), ISO_CMD_WRITE_MULTIPLE_BLOCKS)
+    data = bytes([0x55] * 96)
+    cmdlist = { "write_multiple_blocks": True, "write_single_block": True }
+    result = chip.write_memory(0, data, cmdlist = cmdlist)
+    assert bytes(emulator.memory[:96]) == data
+    assert result["rewrites"] == list(range(16))
+    assert result["frames"] == 2 + 16
+
+
+def test_write_memory_falls_back_to_single_blocks(chip, emulator, capsys):
+    # The tag rejects the multiple block write its command list claims
+    cmdlist = { "write_multiple_blocks": True, "write_single_block": True }
+    result = chip.write_memory(0, bytes([0x55] * 96), cmdlist = cmdlist)
+    assert bytes(emulator.memory[:96]) == bytes([0x55] * 96)
+    assert result["command"] == ISO_CMD_WRITE_SINGLE_BLOCK
+    assert result["frames"] == 1 + 24
+    assert "writing single blocks" in capsys.readouterr().out
+
+
+def test_write_memory_above_block_256(chip, emulator):
+    data = bytes(range(16))
+    result = chip.write_memory(300, data)
+    assert bytes(emulator.memory[1200:1216]) == data
+    assert result["command"] == ISO_CMD_EXT_WRITE_SINGLE_BLOCK
+
+
+def test_captured_command_list():
+    info = ISO15693(CapturedReader(CAPTURED_EXTENDED_SYSTEM_INFO)).get_extended_system_info()
+    assert info["moi"] == 1
+    assert info["numblocks"] == 512 and info["icref"] == 0x01
+    assert not info["cmdlist"]["write_multiple_blocks"]
+    assert not info["cmdlist"]["extended_write_multiple_blocks"]
+    assert info["cmdlist"]["extended_write_single_block"]
+
+
+def test_write_memory_block_does_not_verify(chip, emulator):
+    chip.reader = LossyReader(emulator, ISO_CMD_EXT_WRITE_SINGLE_BLOCK, lost = 2)
+    cmdlist = { "extended_write_single_block": True }
+    with pytest.raises(Exception, match = "Block 0 does not verify"):
+        chip.write_memory(0, bytes([0x55] * 4), cmdlist = cmdlist)
+
+
+def test_write_memory_without_verify(chip, emulator):
+    chip.reader = LossyReader(emulator, ISO_CMD_EXT_WRITE_SINGLE_BLOCK)
+    result = chip.write_memory(0, bytes([0x55] * 8), cmdlist = { "extended_write_single_block": True }, verify = False)
+    assert result["rewrites"] == []
+    assert chip.reader.commands == [ ISO_CMD_EXT_WRITE_SINGLE_BLOCK ] * 2
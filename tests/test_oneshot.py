@@ -0,0 +1,104 @@
+import pytest
+
+from vicinity import oneshot
+from vicinity.oneshot import OneshotScheduler, ONESHOT_RETRIES, ONESHOT_RETRY_LIMIT
+
+CONVERSION = 0.1
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+class Device:
+    # Oneshot sensor whose conversions finish a fixed time after the trigger
+    def __init__(self, clock, delay = CONVERSION):
+        self.clock = clock
+        self.delay = delay
+        self.triggers = []
+        self.reads = 0
+        # Triggers whose conversion never finishes
+        self.lose = set()
+        # Time the next result read takes, e.g. an exchange that is repeated
+        self.stall = 0.0
+
+    def prepare_oneshot(self):
+        return CONVERSION
+
+    def trigger_oneshot(self):
+        self.triggers.append(self.clock.now)
+
+    def read_temperature(self):
+        self.reads += 1
+        self.clock.now += self.stall
+        self.stall = 0.0
+        if(len(self.triggers) - 1 in self.lose or self.clock.now < self.triggers[-1] + self.delay - 1e-9):
+            return None
+        return 25.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(oneshot.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def readings(scheduler, clock, count):
+    # Run the scheduler like the CLI loop, returns the readings and when they arrived
+    res = []
+    for reading, wait in scheduler.run():
+        if(reading != None):
+            res.append((reading, clock.now))
+            if(len(res) == count):
+                return res
+        clock.now += wait
+
+
+def test_conversions_follow_deadlines(clock):
+    device = Device(clock)
+    scheduler = OneshotScheduler(device, 1.0)
+    readings(scheduler, clock, 3)
+    assert device.triggers == [ 0.0, 1.0, 2.0 ]
+    # The result is fetched once, one conversion time after the trigger
+    assert device.reads == 3
+    assert scheduler.missed == 0 and scheduler.lost == 0
+
+
+def test_late_result_is_polled_again(clock):
+    device = Device(clock, CONVERSION + 0.3 * CONVERSION)
+    arrived = readings(OneshotScheduler(device, 1.0), clock, 1)[0][1]
+    # Polled after one conversion time, then every quarter of it
+    assert device.reads == 3
+    assert arrived == pytest.approx(CONVERSION * (1 + 2 / ONESHOT_RETRIES))
+
+
+def test_passed_deadlines_are_skipped(clock):
+    device = Device(clock)
+    device.stall = 2.5
+    scheduler = OneshotScheduler(device, 1.0)
+    readings(scheduler, clock, 2)
+    # The deadlines at 1 s and 2 s passed while the first result was read
+    assert scheduler.missed == 2
+    assert device.triggers == [ 0.0, pytest.approx(3.0) ]
+
+
+def test_lost_conversion_is_started_again(clock):
+    device = Device(clock)
+    device.lose.add(0)
+    scheduler = OneshotScheduler(device, 1.0)
+    readings(scheduler, clock, 1)
+    assert scheduler.lost == 1
+    assert device.reads == ONESHOT_RETRY_LIMIT + 1 + 1
+    # The new conversion is triggered right after the last poll
+    assert device.triggers[1] == pytest.approx(CONVERSION * (1 + ONESHOT_RETRY_LIMIT / ONESHOT_RETRIES))
+
+
+def test_zero_period_runs_back_to_back(clock):
+    device = Device(clock)
+    readings(OneshotScheduler(device, 0.0), clock, 3)
+    assert device.triggers == pytest.approx([ 0.0, CONVERSION, 2 * CONVERSION ])
@@ -0,0 +1,113 @@
+import pytest
+
+from reader.emulator import EmulatedTMP117
+from vicinity.ntag5link import NXP_CONFIG_MAP
+from vicinity.tmp117 import (TMP117, TMP117_REGISTER_MAP, TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_MOD_MASK,
+    TMP117_CONFIG_FLAG_MOD_SHUTDOWN)
+
+# Register contents and what the hand-written TMP117.get_config_info decoded from them
+TMP117_REGISTERS = {
+    0x01: bytes.fromhex("2c20"),
+    0x02: bytes.fromhex("3e80"),
+    0x03: bytes.fromhex("f380"),
+    0x05: bytes.fromhex("1234"),
+    0x06: bytes.fromhex("0000"),
+    0x07: bytes.fromhex("ff80"),
+    0x08: bytes.fromhex("c800"),
+    0x0F: bytes.fromhex("1117"),
+}
+TMP117_INFO = {
+    "status_flags": { "high_alert": False, "low_alert": False, "data_ready": True, "eeprom_busy": False },
+    "mode": "one_shot",
+    "averaging": "8",
+    "conversion_cycle": 125,
+    "alert_config": { "therm_mode": False, "alert_polarity_high": False, "alert_select_data_ready": False },
+    "soft_reset": False,
+    "thigh_limit": 125.0,
+    "tlow_limit": -25.0,
+    "eeprom1": b"\x12\x34",
+    "eeprom2": b"\x00\x00",
+    "eeprom3": b"\xc8\x00",
+    "temperature_offset": -1.0,
+    "device_id": { "id": 279, "rev": 1 },
+}
+
+# Config block and what the hand-written NTAG5Link.get_config_info decoded from it
+NXP_CONFIG_BLOCK = bytes.fromhex("0f55aa00")
+NXP_CONFIG_INFO = {
+    "auto_standby_mode_enabled": True,
+    "lock_session_register": True,
+    "energy_harvesting_mode": "high_field_strength",
+    "sram_copy_enabled": False,
+    "pt_transfer_direction": "reader_to_tag",
+    "sram_enabled": False,
+    "arbiter_mode": "sram_mirror",
+    "use_case": "i2c_master",
+    "eh_arbiter_mode_enabled": False,
+    "gpio0_slew_rate": "normal",
+    "gpio1_slew_rate": "fast",
+    "lock_block_command_supported": False,
+    "extended_commands_supported": True,
+    "gpio0_pad_in": "plain",
+    "gpio1_pad_in": "plain",
+}
+
+
+def record(row):
+    # Nested dicts from one row of a structured array, for comparing with decode
+    res = {}
+    for name in row.dtype.names:
+        value = row[name]
+        if(value.dtype.names != None):
+            res[name] = record(value)
+        elif(value.dtype.kind == "V"):
+            res[name] = value.tobytes()
+        else:
+            res[name] = value.item()
+    return res
+
+
+def test_decode_matches_hand_written():
+    assert TMP117_REGISTER_MAP.decode(TMP117_REGISTERS) == TMP117_INFO
+    assert NXP_CONFIG_MAP.decode_bytes(NXP_CONFIG_BLOCK) == NXP_CONFIG_INFO
+
+
+def test_decode_keeps_field_order():
+    assert list(TMP117_REGISTER_MAP.decode(TMP117_REGISTERS)) == list(TMP117_INFO)
+
+
+def test_decode_array_matches_decode():
+    np = pytest.importorskip("numpy")
+    data = b"".join(TMP117_REGISTERS[register] for register in TMP117_REGISTER_MAP.registers)
+    records = TMP117_REGISTER_MAP.decode_array(data * 3)
+    assert len(records) == 3
+    for row in records:
+        assert record(row) == TMP117_INFO
+    records = NXP_CONFIG_MAP.decode_array(np.frombuffer(NXP_CONFIG_BLOCK * 2, dtype = np.uint8))
+    for row in records:
+        assert record(row) == NXP_CONFIG_INFO
+
+
+def test_encode_changes_only_the_field():
+    registers = TMP117_REGISTER_MAP.encode({ "mode": "shutdown" },
+        { TMP117_I2C_REG_CONFIG: TMP117_REGISTERS[TMP117_I2C_REG_CONFIG] })
+    config = int.from_bytes(registers[TMP117_I2C_REG_CONFIG], "big")
+    before = int.from_bytes(TMP117_REGISTERS[TMP117_I2C_REG_CONFIG], "big")
+    assert config & TMP117_CONFIG_FLAG_MOD_MASK == TMP117_CONFIG_FLAG_MOD_SHUTDOWN
+    assert config & ~TMP117_CONFIG_FLAG_MOD_MASK == before & ~TMP117_CONFIG_FLAG_MOD_MASK
+    with pytest.raises(Exception):
+        TMP117_REGISTER_MAP.encode({ "mode": "sleeping" })
+
+
+def test_encode_scaled_values():
+    registers = TMP117_REGISTER_MAP.encode({ "thigh_limit": 125.0, "tlow_limit": -25.0, "eeprom1": b"\x12\x34" })
+    for register, data in registers.items():
+        assert data == TMP117_REGISTERS[register]
+
+
+def test_config_info_from_emulated_sensor(emulator, chip):
+    # The same registers read over the emulated I2C bus, in one batch
+    device = EmulatedTMP117()
+    device.registers.update({ register: int.from_bytes(data, "big") for register, data in TMP117_REGISTERS.items() })
+    emulator.attach(0x48, device)
+    assert TMP117(chip, 0x48).get_config_info() == TMP117_INFO
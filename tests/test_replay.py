@@ -0,0 +1,58 @@
+import pytest
+
+from reader.emulator import EmulatedTMP117
+from reader.replay import ReplayReader, ReplayFinished
+from reader.trace import TraceRecorder
+from vicinity.ntag5link import NTAG5Link, NXP_CONFIG_ADDR_CONFIG
+from vicinity.tmp117 import TMP117, TMP117_I2C_REG_DEVICE_ID
+
+
+@pytest.fixture
+def recording(tmp_path, emulator, chip):
+    # A short session on the emulator, recorded like with --record
+    emulator.attach(0x48, EmulatedTMP117(temperature = 21.5))
+    emulator.trace = TraceRecorder(tmp_path / "session.trace", capacity = None)
+    chip.get_system_info()
+    chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)
+    TMP117(chip, 0x48).read_register(TMP117_I2C_REG_DEVICE_ID, 2)
+    emulator.trace.flush()
+    return tmp_path / "session.trace"
+
+
+def replay(chip):
+    return (chip.get_system_info(), chip.read_config_block(NXP_CONFIG_ADDR_CONFIG),
+        TMP117(chip, 0x48).read_register(TMP117_I2C_REG_DEVICE_ID, 2))
+
+
+def test_replay_answers_like_the_recording(recording, chip):
+    expected = replay(chip)
+    reader = ReplayReader(recording, realtime = False)
+    assert replay(NTAG5Link(reader)) == expected
+    assert reader.position == len(reader.exchanges)
+
+
+def test_replay_ends_like_an_interrupt(recording):
+    chip = NTAG5Link(ReplayReader(recording, realtime = False))
+    replay(chip)
+    with pytest.raises(KeyboardInterrupt):
+        chip.get_system_info()
+    with pytest.raises(ReplayFinished):
+        chip.get_system_info()
+
+
+def test_replay_detects_divergence(recording):
+    reader = ReplayReader(recording, realtime = False)
+    chip = NTAG5Link(reader)
+    chip.get_system_info()
+    with pytest.raises(Exception, match = "diverged at exchange 1"):
+        chip.read_config_block(NXP_CONFIG_ADDR_CONFIG + 1)
+    # Rewinding starts over at the first recorded exchange
+    reader.rewind()
+    chip.get_system_info()
+    assert reader.position == 1
+
+
+def test_replay_rejects_empty_recording(tmp_path):
+    TraceRecorder(tmp_path / "empty.trace").flush()
+    with pytest.raises(Exception, match = "does not contain any exchanges"):
+        ReplayReader(tmp_path / "empty.trace")
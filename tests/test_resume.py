@@ -0,0 +1,112 @@
+import pytest
+
+from vicinity.resume import ConfigStep, SensorSession, SessionStore
+
+KEY = SessionStore.key("Emulated reader", bytes.fromhex("e004010800000001"))
+
+
+class Device:
+    # Sensor with byte wide registers that counts its register reads
+    def __init__(self, address = 0x5A):
+        self.address = address
+        self.registers = bytearray(8)
+        self.parameters = {}
+        self.reads = 0
+        self.invalidations = 0
+
+    def read_registers(self, registers):
+        # All registers in one burst, like I2CBase.read_registers
+        self.reads += 1
+        return { register: bytes(self.registers[register:register + 1]) for register in registers }
+
+    def write_register(self, register, value):
+        self.registers[register] = value
+
+    def invalidate_shadow(self):
+        self.invalidations += 1
+
+
+def steps(device, value = 0x21):
+    return [
+        ConfigStep("mode", lambda: device.write_register(1, value), [ value ], 1, [ 0x7F ]),
+        ConfigStep("rate", lambda: device.write_register(3, 0x05), [ 0x05 ], 3),
+        # Parameter RAM cannot be read back
+        ConfigStep("param", lambda: device.parameters.update(gain = 2), []),
+    ]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(str(tmp_path / "sessions.json"))
+
+
+def resume(device, store, value = 0x21):
+    session = SensorSession(device, "SENSOR", steps(device, value), store, KEY)
+    return session.resume()
+
+
+def test_first_session_does_all_steps(store):
+    device = Device()
+    assert resume(device, store) == [ "mode", "rate", "param" ]
+    assert device.registers[1] == 0x21 and device.registers[3] == 0x05
+    # Nothing is recorded yet, so nothing is read back
+    assert device.reads == 0
+
+
+def test_warm_session_is_verified_in_one_read(store):
+    device = Device()
+    resume(device, store)
+    assert resume(device, SessionStore(store.path)) == []
+    assert device.reads == 1
+    # Register values known from before the resume are not trusted
+    assert device.invalidations == 2
+
+
+def test_masked_bits_are_ignored(store):
+    device = Device()
+    resume(device, store)
+    # The sensor sets a status bit outside the mask
+    device.registers[1] |= 0x80
+    assert resume(device, store) == []
+
+
+def test_changed_register_is_redone(store):
+    device = Device()
+    resume(device, store)
+    device.registers[3] = 0x00
+    device.parameters = {}
+    # Steps that cannot be read back are not trusted once a readable step is lost
+    assert resume(device, store) == [ "rate", "param" ]
+    assert device.registers[3] == 0x05 and device.parameters == { "gain": 2 }
+
+
+def test_changed_target_is_redone(store):
+    device = Device()
+    resume(device, store)
+    # The other steps still hold, only the changed one is redone
+    assert resume(device, store, 0x23) == [ "mode" ]
+    assert device.registers[1] == 0x23
+
+
+def test_other_sensor_is_configured_from_scratch(store):
+    resume(Device(), store)
+    assert resume(Device(0x5B), store) == [ "mode", "rate", "param" ]
+
+
+def test_failed_step_is_not_recorded(store):
+    device = Device()
+    session = SensorSession(device, "SENSOR", steps(device) + [ ConfigStep("fail", lambda: 1 / 0, []) ], store, KEY)
+    with pytest.raises(ZeroDivisionError):
+        session.resume()
+    assert SessionStore(store.path).get(KEY) == {}
+    assert resume(device, store) == [ "mode", "rate", "param" ]
+
+
+def test_session_without_store():
+    # Across energy harvesting re-arms the record only lives in the session object
+    device = Device()
+    session = SensorSession(device, "SENSOR", steps(device))
+    assert session.resume() == [ "mode", "rate", "param" ]
+    assert session.resume() == []
+    device.registers[1] = 0x00
+    assert session.resume() == [ "mode", "param" ]
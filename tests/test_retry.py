@@ -0,0 +1,80 @@
+import pytest
+
+from protocol.commands import NXP_CMD_READ_CONFIG, NXP_CMD_WRITE_I2C, NXP_CMD_WRITE_CONFIG
+from protocol.errors import CRCError, ISO15693Error
+from reader.retry import RetryPolicy
+from reader.stats import OUTCOME_CRC
+from vicinity.ntag5link import NXP_CONFIG_ADDR_CONFIG
+
+
+class Flaky:
+    # Exchange failing with the given error a number of times before it answers
+    def __init__(self, failures, error = CRCError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if(self.calls <= self.failures):
+            raise self.error("injected")
+        return b'\x00'
+
+def test_recovers_within_budget():
+    policy = RetryPolicy(budget = 3, delay = 0.0, jitter = 0.0)
+    exchange = Flaky(2)
+    assert policy.call(NXP_CMD_READ_CONFIG, exchange) == b'\x00'
+    assert exchange.calls == 3
+    assert policy.retries[NXP_CMD_READ_CONFIG] == 2
+    assert policy.recoveries[NXP_CMD_READ_CONFIG] == 1
+    assert NXP_CMD_READ_CONFIG not in policy.give_ups
+
+def test_gives_up_after_budget():
+    policy = RetryPolicy(budget = 3, delay = 0.0, jitter = 0.0)
+    exchange = Flaky(10)
+    with pytest.raises(CRCError):
+        policy.call(NXP_CMD_READ_CONFIG, exchange)
+    assert exchange.calls == 4
+    assert policy.retries[NXP_CMD_READ_CONFIG] == 3
+    assert policy.give_ups[NXP_CMD_READ_CONFIG] == 1
+
+@pytest.mark.parametrize("command", [ NXP_CMD_WRITE_I2C, NXP_CMD_WRITE_CONFIG ])
+def test_side_effects_are_not_repeated(command):
+    policy = RetryPolicy(delay = 0.0, jitter = 0.0)
+    exchange = Flaky(1)
+    with pytest.raises(CRCError):
+        policy.call(command, exchange)
+    assert exchange.calls == 1
+    assert policy.retries == {}
+
+def test_tag_errors_are_not_repeated():
+    policy = RetryPolicy(delay = 0.0, jitter = 0.0)
+    exchange = Flaky(1, lambda message: ISO15693Error(message, 0x0F))
+    with pytest.raises(ISO15693Error):
+        policy.call(NXP_CMD_READ_CONFIG, exchange)
+    assert exchange.calls == 1
+
+def test_emulator_spends_budget_on_corrupted_responses(emulator, chip):
+    # Every response is corrupted, the read is sent once plus once per retry
+    emulator.fault_rate = 1.0
+    with pytest.raises(CRCError):
+        chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)
+    budget = emulator.retry.budget
+    assert emulator.retry.retries[NXP_CMD_READ_CONFIG] == budget
+    assert emulator.retry.give_ups[NXP_CMD_READ_CONFIG] == 1
+    rows = { (row["opcode"], row["outcome"]): row["count"] for row in emulator.stats.summary() }
+    assert rows[(NXP_CMD_READ_CONFIG, OUTCOME_CRC)] == budget + 1
+
+def test_emulator_recovers_from_single_fault(emulator, chip):
+    expected = chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)
+    exchange = emulator._exchange_iso15693
+    calls = []
+    def corrupt_first(*args):
+        # Only the first response is corrupted on the air
+        emulator.fault_rate = 1.0 if(len(calls) == 0) else 0.0
+        calls.append(args)
+        return exchange(*args)
+    emulator._exchange_iso15693 = corrupt_first
+    assert chip.read_config_block(NXP_CONFIG_ADDR_CONFIG) == expected
+    assert len(calls) == 2
+    assert emulator.retry.recoveries[NXP_CMD_READ_CONFIG] == 1
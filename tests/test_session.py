@@ -0,0 +1,63 @@
+import pytest
+
+from reader.emulator import EmulatedTMP117
+from vicinity.ntag5link import (NTAG5Link, NXP_CMD_READ_CONFIG, NXP_CONFIG_ADDR_CONFIG, NXP_CONFIG_ADDR_EH_CONFIG_REG,
+    NXP_EH_LOAD_OK)
+
+
+def session_reads(emulator):
+    return sum(row["count"] for row in emulator.stats.summary() if(row["opcode"] == NXP_CMD_READ_CONFIG))
+
+
+@pytest.fixture
+def chip(emulator):
+    # Snapshots stay valid for the whole test unless dropped
+    emulator.attach(0x48, EmulatedTMP117())
+    return NTAG5Link(emulator, session_validity = 60.0)
+
+
+def test_checks_share_one_snapshot(emulator, chip):
+    chip.write_i2c(0x48, bytes([0x00]))
+    chip.check_i2c_busy()
+    chip.check_i2c_write_result()
+    chip.check_eh_load_ok()
+    assert session_reads(emulator) == 1
+
+
+def test_snapshot_expires(emulator):
+    chip = NTAG5Link(emulator, session_validity = 0.0)
+    chip.check_i2c_busy()
+    chip.check_eh_load_ok()
+    assert session_reads(emulator) == 2
+
+
+def test_forced_read(emulator, chip):
+    first = chip.read_session()
+    assert chip.read_session() is first
+    assert chip.read_session(force = True) is not first
+    assert session_reads(emulator) == 2
+
+
+@pytest.mark.parametrize("touch", [
+    lambda chip: chip.write_i2c(0x48, bytes([0x00])),
+    lambda chip: chip.read_i2c(0x48, 2),
+    lambda chip: chip.eh_control(trigger = True, enable = True),
+    lambda chip: chip.transmit_batch([ chip.write_i2c_frame(0x48, bytes([0x00])) ]),
+    lambda chip: chip.transmit_batch([ bytes([0x02, 0xC1, 0x04, NXP_CONFIG_ADDR_CONFIG, 0x08, 0x12, 0xFF, 0x00]) ]),
+])
+def test_device_access_drops_snapshot(emulator, chip, touch):
+    chip.read_session()
+    touch(chip)
+    assert chip.session == None
+    chip.read_session()
+    assert session_reads(emulator) == 2
+
+
+def test_snapshot_sees_harvesting_state(emulator, chip):
+    # The trigger write drops the snapshot, so the load is seen as soon as it is stable
+    assert not chip.check_eh_load_ok()
+    chip.eh_control(trigger = True, enable = True)
+    assert chip.check_eh_load_ok()
+    assert chip.read_session().register(NXP_CONFIG_ADDR_EH_CONFIG_REG)[0] & NXP_EH_LOAD_OK
+    with pytest.raises(Exception, match = "not part of the snapshot"):
+        chip.read_session().register(NXP_CONFIG_ADDR_CONFIG)
@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+from reader.emulator import EmulatedTMP117
+from vicinity.iso15693 import ISO_FLAG_DATA_RATE
+from vicinity.ntag5link import (NTAG5Link, NXP_CMD_MANUF_CODE_NXP, NXP_CMD_WRITE_CONFIG, NXP_CONFIG_ADDR_CONFIG,
+    NXP_CONFIG_ADDR_EH_CONFIG_REG)
+from vicinity.tagcache import TagCache, TAG_CACHE_VALIDATOR
+
+UID = bytes.fromhex("e004010800000001")
+
+
+class CountingReader:
+    # Reader passing every frame on to another one, counting the exchanges
+    def __init__(self, reader):
+        self.reader = reader
+        self.exchanges = 0
+
+    def transmit_iso15693(self, data, *args, **kwargs):
+        self.exchanges += 1
+        return self.reader.transmit_iso15693(data, *args, **kwargs)
+
+    def transmit_iso15693_batch(self, frames):
+        self.exchanges += 1
+        return self.reader.transmit_iso15693_batch(frames)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TagCache(str(tmp_path / "cache" / "tags.json"))
+
+
+def identified(emulator, cache):
+    reader = CountingReader(emulator)
+    chip = NTAG5Link(reader)
+    known = chip.identify(cache)
+    return reader, chip, known
+
+
+def info(chip):
+    return (chip.get_system_info(), chip.get_extended_system_info(), chip.get_nxp_info(), chip.get_config_info(),
+        chip.get_eh_ed_config_info())
+
+
+def write_config_frame(address, block):
+    return bytes([ISO_FLAG_DATA_RATE, NXP_CMD_WRITE_CONFIG, NXP_CMD_MANUF_CODE_NXP, address]) + block
+
+
+def test_validate(cache):
+    assert not cache.validate(UID, bytes([0x01, 0x02]))
+    assert cache.validate(UID, bytes([0x01, 0x02]))
+    cache.put(UID, "nxp_info", bytes([0x03]))
+    # A different answer to GET SYSTEM INFO starts a new entry
+    assert not cache.validate(UID, bytes([0x01, 0x03]))
+    assert cache.get(UID, "nxp_info") == None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_entries_persist(cache):
+    cache.validate(UID, bytes([0x01, 0x02]))
+    cache.put(UID, "nxp_info", bytes([0x03, 0x04]))
+    reloaded = TagCache(cache.path)
+    assert reloaded.validate(UID, bytes([0x01, 0x02]))
+    assert reloaded.get(UID, "nxp_info") == bytes([0x03, 0x04])
+    with open(cache.path) as file:
+        assert json.load(file) == { UID.hex(): { TAG_CACHE_VALIDATOR: "0102", "nxp_info": "0304" } }
+
+
+def test_invalidate(cache):
+    cache.validate(UID, bytes([0x01, 0x02]))
+    cache.invalidate(UID)
+    assert not UID.hex() in TagCache(cache.path).entries
+    # Responses read before the entry was dropped are not stored
+    cache.put(UID, "nxp_info", bytes([0x03]))
+    assert cache.entries == {}
+
+
+def test_unreadable_file(tmp_path, capsys):
+    path = tmp_path / "tags.json"
+    path.write_text("{")
+    assert TagCache(str(path)).entries == {}
+    assert "Ignoring unreadable file" in capsys.readouterr().out
+
+
+def test_known_tag_is_served_from_cache(emulator, cache):
+    reader, chip, known = identified(emulator, cache)
+    assert not known
+    expected = info(chip)
+    # GET SYSTEM INFO is already known from identifying the tag
+    assert reader.exchanges == 1 + 4
+    cache.hits = 0
+    reader, chip, known = identified(emulator, cache)
+    assert known
+    assert info(chip) == expected
+    assert reader.exchanges == 1
+    assert cache.hits == 5
+
+
+def test_config_write_invalidates(emulator, cache):
+    reader, chip, known = identified(emulator, cache)
+    info(chip)
+    chip.write_config_block(NXP_CONFIG_ADDR_CONFIG, bytes([0x01, 0x02, 0x03, 0x04]))
+    reader, chip, known = identified(emulator, cache)
+    assert not known
+    assert chip.get_config_info() != None
+    assert reader.exchanges == 2
+
+
+def test_session_register_write_keeps_entry(emulator, cache):
+    reader, chip, known = identified(emulator, cache)
+    info(chip)
+    chip.write_config_block(NXP_CONFIG_ADDR_EH_CONFIG_REG, bytes(4))
+    assert identified(emulator, cache)[2]
+
+
+def test_batched_config_write_invalidates(emulator, cache):
+    # A batch that also starts an I2C transaction still drops the entry
+    emulator.attach(0x48, EmulatedTMP117())
+    reader, chip, known = identified(emulator, cache)
+    info(chip)
+    chip.transmit_batch([ chip.write_i2c_frame(0x48, bytes([0x00])),
+        write_config_frame(NXP_CONFIG_ADDR_CONFIG, bytes([0x01, 0x02, 0x03, 0x04])) ])
+    assert not identified(emulator, cache)[2]
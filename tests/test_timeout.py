@@ -0,0 +1,87 @@
+import pytest
+
+from protocol.commands import ISO_CMD_INVENTORY, NXP_CMD_READ_CONFIG, NXP_CMD_WRITE_CONFIG
+from reader.emulator import EMULATOR_CONFIG_DEFAULTS
+from reader.timeout import (TimeoutPolicy, TIMEOUT_BOUNDS_READ, TIMEOUT_BOUNDS_WRITE, TIMEOUT_BOUNDS_DEFAULT,
+    TIMEOUT_MARGIN, TIMEOUT_WARMUP, FWTI_MAX)
+from vicinity.ntag5link import NXP_CONFIG_ADDR_CONFIG
+
+
+def test_ceiling_during_warmup():
+    policy = TimeoutPolicy()
+    ceiling = TIMEOUT_BOUNDS_READ[1]
+    for index in range(TIMEOUT_WARMUP):
+        assert policy.get(NXP_CMD_READ_CONFIG) == ceiling
+        policy.observe(NXP_CMD_READ_CONFIG, 0.01)
+    assert policy.get(NXP_CMD_READ_CONFIG) == pytest.approx(0.01 * TIMEOUT_MARGIN)
+
+
+def test_learned_timeout_is_clamped():
+    policy = TimeoutPolicy()
+    floor, ceiling = TIMEOUT_BOUNDS_READ
+    for index in range(TIMEOUT_WARMUP):
+        policy.observe(NXP_CMD_READ_CONFIG, 0.0001)
+    assert policy.get(NXP_CMD_READ_CONFIG) == floor
+    policy.observe(NXP_CMD_READ_CONFIG, 10.0)
+    assert policy.get(NXP_CMD_READ_CONFIG) == ceiling
+
+
+def test_peak_decays_slowly():
+    policy = TimeoutPolicy(decay = 0.5)
+    for elapsed in (0.02, 0.01, 0.01):
+        policy.observe(NXP_CMD_READ_CONFIG, elapsed)
+    # 0.02 halved twice is 0.005, below the last response
+    assert policy.get(NXP_CMD_READ_CONFIG) == pytest.approx(0.01 * TIMEOUT_MARGIN)
+
+
+def test_timeout_backs_off():
+    policy = TimeoutPolicy()
+    for index in range(TIMEOUT_WARMUP):
+        policy.observe(NXP_CMD_READ_CONFIG, 0.001)
+    tight = policy.get(NXP_CMD_READ_CONFIG)
+    policy.observe_timeout(NXP_CMD_READ_CONFIG, tight)
+    assert policy.get(NXP_CMD_READ_CONFIG) == pytest.approx(min(TIMEOUT_BOUNDS_READ[1], 2 * tight))
+
+
+def test_timeouts_count_towards_warmup():
+    # A command that only ever times out leaves the warm-up like any other
+    policy = TimeoutPolicy()
+    ceiling = TIMEOUT_BOUNDS_READ[1]
+    for index in range(TIMEOUT_WARMUP):
+        policy.observe_timeout(NXP_CMD_READ_CONFIG, ceiling)
+    assert policy.counts[NXP_CMD_READ_CONFIG] == TIMEOUT_WARMUP
+    assert policy.get(NXP_CMD_READ_CONFIG) == ceiling
+
+
+def test_bounds_per_command():
+    policy = TimeoutPolicy()
+    # Configuration writes keep the one second ceiling
+    assert policy.get(NXP_CMD_WRITE_CONFIG) == TIMEOUT_BOUNDS_WRITE[1] == 1.0
+    assert policy.get(ISO_CMD_INVENTORY) < policy.get(NXP_CMD_READ_CONFIG)
+    assert policy.get(0x7F) == TIMEOUT_BOUNDS_DEFAULT[1]
+    policy = TimeoutPolicy(bounds = { NXP_CMD_READ_CONFIG: (0.5, 0.5) })
+    assert policy.get(NXP_CMD_READ_CONFIG) == 0.5
+
+
+@pytest.mark.parametrize("timeout, fwti", [
+    (0.0001, 0),
+    (0.0003, 0),
+    (0.001, 2),
+    (0.02, 7),
+    (1.0, 12),
+    (100.0, FWTI_MAX),
+])
+def test_fwti(timeout, fwti):
+    assert TimeoutPolicy.fwti(timeout) == fwti
+
+
+def test_emulated_tag_answers_too_late(emulator):
+    # A late answer is lost, the emulated write has no effect
+    emulator.latency[NXP_CMD_WRITE_CONFIG] = 0.02
+    frame = bytes([0x02, NXP_CMD_WRITE_CONFIG, 0x04, NXP_CONFIG_ADDR_CONFIG, 0x01, 0x02, 0x03, 0x04])
+    assert emulator.transmit_iso15693(frame, True, 0.01) == b''
+    assert emulator.config[NXP_CONFIG_ADDR_CONFIG] == EMULATOR_CONFIG_DEFAULTS[NXP_CONFIG_ADDR_CONFIG]
+    with pytest.raises(Exception, match = "no response"):
+        emulator.transmit_iso15693(frame, False, 0.01)
+    emulator.transmit_iso15693(frame, False, 0.05)
+    assert emulator.config[NXP_CONFIG_ADDR_CONFIG] == bytes([0x01, 0x02, 0x03, 0x04])
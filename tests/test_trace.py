@@ -0,0 +1,64 @@
+import pytest
+
+from reader.stats import OUTCOME_SUCCESS, OUTCOME_TIMEOUT, OUTCOME_CRC
+from reader.trace import TraceRecorder, TRACE_REQUEST, TRACE_RESPONSE
+from vicinity.ntag5link import NXP_CONFIG_ADDR_CONFIG
+
+
+def test_file_round_trip(tmp_path):
+    recorder = TraceRecorder(tmp_path / "session.trace")
+    recorder.request(bytes([0x02, 0xC0, 0x04, 0x37, 0x00]))
+    recorder.response(bytes([0x00, 0x08, 0x12, 0xFF, 0x00]))
+    recorder.request(bytes([0x02, 0x2B]))
+    recorder.response(b'', OUTCOME_TIMEOUT)
+    recorder.response(bytes(300), OUTCOME_CRC)
+    assert recorder.flush() == 5
+    assert TraceRecorder.load(tmp_path / "session.trace") == list(recorder.frames)
+
+
+def test_emulated_exchanges_are_recorded(tmp_path, emulator, chip):
+    emulator.trace = TraceRecorder(tmp_path / "session.trace")
+    chip.read_config_block(NXP_CONFIG_ADDR_CONFIG)
+    emulator.trace.flush()
+    frames = TraceRecorder.load(tmp_path / "session.trace")
+    assert [ (direction, outcome) for timestamp, direction, outcome, data in frames ] == [
+        (TRACE_REQUEST, OUTCOME_SUCCESS), (TRACE_RESPONSE, OUTCOME_SUCCESS) ]
+    assert frames[0][3] == bytes([0x02, 0xC0, 0x04, NXP_CONFIG_ADDR_CONFIG, 0x00])
+    assert frames[1][3][1:5] == bytes(emulator.config[NXP_CONFIG_ADDR_CONFIG])
+    assert frames[0][0] <= frames[1][0]
+
+
+def test_ring_buffer_drops_oldest():
+    recorder = TraceRecorder(capacity = 3)
+    for index in range(5):
+        recorder.request(bytes([0x02, index]))
+    assert [ data[1] for timestamp, direction, outcome, data in recorder.frames ] == [ 2, 3, 4 ]
+
+
+@pytest.mark.parametrize("content, message", [
+    (b"NTAG5", "truncated"),
+    (b"NOTATRACE", "Not a trace file"),
+    (b"NTAG5TRC\x02", "Unsupported trace file version"),
+])
+def test_load_rejects_bad_files(tmp_path, content, message):
+    path = tmp_path / "bad.trace"
+    path.write_bytes(content)
+    with pytest.raises(Exception, match = message):
+        TraceRecorder.load(path)
+
+
+def test_load_rejects_truncated_record(tmp_path):
+    recorder = TraceRecorder(tmp_path / "session.trace")
+    recorder.request(bytes([0x02, 0x2B]))
+    recorder.flush()
+    path = tmp_path / "session.trace"
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(Exception, match = "truncated"):
+        TraceRecorder.load(path)
+
+
+def test_describe():
+    assert TraceRecorder.describe(TRACE_REQUEST, OUTCOME_SUCCESS, bytes([0x02, 0xC0, 0x04, 0x37, 0x00])) == \
+        "> READ_CONFIG (0xc0), flags 0x02, params 3700"
+    assert TraceRecorder.describe(TRACE_RESPONSE, OUTCOME_SUCCESS, bytes([0x01, 0x10])) == "< error code 0x10"
+    assert TraceRecorder.describe(TRACE_RESPONSE, OUTCOME_TIMEOUT, b'') == "< timeout "
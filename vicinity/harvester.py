@@ -0,0 +1,92 @@
+import time
+
+from .ntag5link import *
+
+# Load check schedule while waiting for stabilization: first interval, growth factor and cap in seconds
+EH_POLL_INITIAL =                           0.002
+EH_POLL_BACKOFF =                           2.0
+EH_POLL_MAX =                               0.1
+# Time to wait for a stable load before giving up, in seconds
+EH_TIMEOUT =                                10.0
+# Number of watch calls per load check during an acquisition, about once per second at 50 Hz
+# Counting calls instead of time keeps the exchange sequence reproducible for replay
+EH_WATCH_EVERY =                            50
+
+
+class EnergyHarvester:
+    def __init__(self, chip, timeout = EH_TIMEOUT, watch_every = EH_WATCH_EVERY,
+            current = NXP_EH_CONFIG_EH_VOUT_I_SEL_0_4, voltage = NXP_EH_CONFIG_EH_VOUT_V_SEL_1_8):
+        self.chip = chip
+        # Output current and voltage selection written along with the trigger
+        self.current = current
+        self.voltage = voltage
+        self.timeout = timeout
+        self.watch_every = watch_every
+        # Time from trigger to stable load of the last start, zero if harvesting was already active
+        self.time_to_stable = None
+        # Number of times harvesting was started again after the load dropped
+        self.rearms = 0
+        self.watches = 0
+
+    def _flags(self, force = False):
+        return self.chip.read_session(force).eh_config()
+
+    def is_active(self, force = False):
+        flags = self._flags(force)
+        return (flags & NXP_EH_ENABLE != 0x00) and (flags & NXP_EH_LOAD_OK != 0x00)
+
+    def start(self):
+        # Trigger energy harvesting and enable it once the load is stable
+        # Nothing is written if a previous session left harvesting active
+        flags = self._flags()
+        selection = NXP_EH_CONFIG_EH_VOUT_I_SEL_12_5 | NXP_EH_CONFIG_EH_VOUT_V_SEL_RFU
+        if(flags & selection != self.current | self.voltage):
+            # Harvesting runs at another operating point, start it again at the requested one
+            flags = 0x00
+        if(flags & NXP_EH_LOAD_OK != 0x00):
+            self.time_to_stable = 0.0
+            if(flags & NXP_EH_ENABLE != 0x00):
+                print("info: Energy harvesting is already active")
+                return
+            print("info: Energy harvesting load is already stable, enabling")
+        else:
+            print("info: Triggering energy harvesting")
+            triggered = time.monotonic()
+            self.chip.eh_control(trigger = True, enable = False, current = self.current, voltage = self.voltage)
+            self._wait_load_ok(triggered)
+            self.time_to_stable = time.monotonic() - triggered
+            print(f"info: Energy harvesting load is stable after {self.time_to_stable * 1000.0:.1f} ms, enabling")
+        self.chip.eh_control(trigger = True, enable = True, current = self.current, voltage = self.voltage)
+        print("info: Energy harvesting active")
+
+    def _wait_load_ok(self, triggered):
+        # Check quickly at first, the load is often stable within a few milliseconds,
+        # then back off to avoid flooding the field with exchanges during a slow start
+        interval = EH_POLL_INITIAL
+        waiting = False
+        while(not self.chip.check_eh_load_ok(force = True)):
+            if(time.monotonic() - triggered >= self.timeout):
+                raise Exception("Energy harvesting load did not stabilize in time")
+            if(not waiting and interval >= EH_POLL_MAX):
+                print("info: Waiting for energy harvesting load stabilization")
+                waiting = True
+            time.sleep(interval)
+            interval = min(interval * EH_POLL_BACKOFF, EH_POLL_MAX)
+
+    def stop(self):
+        # Switch harvesting off, the attached sensor loses its supply
+        self.chip.eh_control(trigger = False, enable = False, current = self.current, voltage = self.voltage)
+
+    def watch(self, force = False):
+        # Check the load on every watch_every call, or right away if forced after a failed exchange
+        # Returns False if harvesting had dropped and was started again, attached sensors lost power
+        # and need to be configured again
+        self.watches += 1
+        if(not force and self.watches % self.watch_every != 0):
+            return True
+        if(self.is_active(force = True)):
+            return True
+        self.rearms += 1
+        print(f"warning: Energy harvesting load dropped, re-arming ({self.rearms} in total)")
+        self.start()
+        return False
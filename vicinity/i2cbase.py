@@ -1,39 +1,161 @@
 import time, math
 
+from .ntag5link import NXP_CONFIG_ADDR_I2C_M_STATUS_REG, ISO_READ_CHUNK_BYTES
+
 # General calls
 I2C_CALL_RESET_CMD = 0x06
 
+# Longest burst read, its SRAM content must fit into the response of one SRAM read
+I2C_BURST_MAX_BYTES =               ISO_READ_CHUNK_BYTES
+# Unrequested registers read along to join two bursts, cheaper than another I2C transaction
+I2C_BURST_GAP =                     8
+
 
 class I2CBase:
+    # Bytes per register, and whether reads continue with the next register or repeat the addressed one
+    register_width = 1
+    auto_increment = True
+    # Registers kept in the shadow, with the mask of the bits the device changes on its own
+    shadow_registers = {}
+
     def __init__(self, ntag5link, address):
         self.chip = ntag5link
         self.address = address
+        # Last known content of the shadowed registers, volatile bits cleared, keyed by register address
+        self.shadow = {}
 
-    def read_register(self, register, length):
-        while(self.chip.check_i2c_busy()):
+    def _shadow_update(self, register, data):
+        # Take over register content read from or written to the device
+        width = self.register_width
+        for offset in range(0, len(data) - (len(data) % width), width):
+            if(register in self.shadow_registers):
+                value = int.from_bytes(data[offset:offset + width], byteorder="big") & ~self.shadow_registers[register]
+                self.shadow[register] = value.to_bytes(width, byteorder="big")
+            if(self.auto_increment):
+                register += 1
+
+    def invalidate_shadow(self):
+        # The device lost power or was reset, its registers have to be read again
+        self.shadow = {}
+
+    def read_shadowed(self, register):
+        # Register content without its volatile bits, read from the device only if not known yet
+        if(register not in self.shadow):
+            self.read_register(register, self.register_width)
+        return self.shadow[register]
+
+    def _wait_i2c_status(self):
+        # Fetch the master status once the current transaction has finished
+        while(True):
+            status = self.chip.read_i2c_status()
+            if(not self.chip.check_i2c_busy(status)):
+                return status
             print("info: I2C bus is still busy, waiting ...")
             time.sleep(0.1)
-        self.chip.write_i2c(self.address, bytes([register]))
-        if(not self.chip.check_i2c_write_result()):
-            raise Exception("Register address write was not acknowledged")
-        self.chip.read_i2c(self.address, length)
+
+    def _wait_i2c_idle(self):
+        # Skip the busy check if the last status fetch already showed an idle bus
+        if(not self.chip.i2c_idle):
+            self._wait_i2c_status()
+
+    def _transact(self, frames, num_blocks = 0):
+        # I2C frames, the master status fetch and an optional SRAM read go out as one batch
+        batch = frames + [ self.chip.read_config_frame(NXP_CONFIG_ADDR_I2C_M_STATUS_REG) ]
+        if(num_blocks > 0):
+            batch.append(self.chip.read_sram_frame(num_blocks = num_blocks))
+        results = self.chip.transmit_batch(batch)
+        for result in results[:len(frames)]:
+            if(isinstance(result, Exception)):
+                raise result
+        status = results[len(frames)]
+        data = results[len(frames) + 1] if(num_blocks > 0) else None
+        if(status == None or isinstance(status, Exception)):
+            # The status fetch failed, the SRAM read was skipped
+            return (self._wait_i2c_status(), None)
+        status = self.chip.parse_i2c_status(status)
+        if(self.chip.check_i2c_busy(status)):
+            # The transaction was still running, the SRAM content is not final yet
+            return (self._wait_i2c_status(), None)
+        if(isinstance(data, Exception)):
+            data = None
+        return (status, data)
+
+    def _read_frames(self, register, length):
+        # Write the register address without STOP, the read follows with a repeated START
+        return [
+            self.chip.write_i2c_frame(self.address, bytes([register]), stop_condition = False),
+            self.chip.read_i2c_frame(self.address, length)]
+
+    def read_register(self, register, length):
+        self._wait_i2c_idle()
         # One page is four bytes
-        data = self.chip.read_sram(num_blocks = math.ceil(length / 4.0))
+        num_blocks = math.ceil(length / 4.0)
+        status, data = self._transact(self._read_frames(register, length), num_blocks)
+        # A single status fetch covers the address write and the read
+        if(not self.chip.check_i2c_write_result(status)):
+            raise Exception("Register address write was not acknowledged")
+        if(data == None):
+            data = self.chip.read_sram(num_blocks = num_blocks)
+        self._shadow_update(register, data[0:length])
         return data[0:length]
 
+    def plan_bursts(self, registers, gap = I2C_BURST_GAP):
+        # Coalesce the registers into (first register, register count) bursts
+        # Without auto-increment every register is read on its own, in the requested order
+        if(not self.auto_increment):
+            return [ (register, 1) for register in dict.fromkeys(registers) ]
+        bursts = []
+        for register in sorted(set(registers)):
+            if(len(bursts) > 0):
+                start, count = bursts[-1]
+                if(register - (start + count) <= gap and (register - start + 1) * self.register_width <= I2C_BURST_MAX_BYTES):
+                    bursts[-1] = (start, register - start + 1)
+                    continue
+            bursts.append((register, 1))
+        return bursts
+
+    def read_registers(self, registers, gap = I2C_BURST_GAP):
+        # Read several registers with as few I2C transactions as possible, all sent in one batch
+        # Returns the content of every requested register, keyed by register address
+        width = self.register_width
+        bursts = self.plan_bursts(registers, gap)
+        self._wait_i2c_idle()
+        frames = []
+        for start, count in bursts:
+            frames += self._read_frames(start, count * width) + [
+                self.chip.read_config_frame(NXP_CONFIG_ADDR_I2C_M_STATUS_REG),
+                self.chip.read_sram_frame(num_blocks = math.ceil(count * width / 4.0)) ]
+        results = self.chip.transmit_batch(frames)
+        res = {}
+        for index, (start, count) in enumerate(bursts):
+            length = count * width
+            write, read, status, data = results[index * 4:index * 4 + 4]
+            if(any(result == None or isinstance(result, Exception) for result in (write, read, status, data))
+                    or self.chip.check_i2c_busy(self.chip.parse_i2c_status(status))):
+                # The batch stopped early or the transaction was still running, read this burst on its own
+                data = self.read_register(start, length)
+            elif(not self.chip.check_i2c_write_result(self.chip.parse_i2c_status(status))):
+                raise Exception("Register address write was not acknowledged")
+            else:
+                self._shadow_update(start, data[0:length])
+            for register in range(start, start + count):
+                res[register] = bytes(data[(register - start) * width:(register - start + 1) * width])
+        return { register: res[register] for register in registers }
+
     def write_register(self, register, data):
-        while(self.chip.check_i2c_busy()):
-            print("info: I2C bus is still busy, waiting ...")
-            time.sleep(0.1)
-        self.chip.write_i2c(self.address, bytes([register] + data))
-        if(not self.chip.check_i2c_write_result()):
+        # Writes go through the shadow, a failed write leaves the register unknown
+        for offset in range(0, len(data), self.register_width):
+            self.shadow.pop(register + offset // self.register_width if(self.auto_increment) else register, None)
+        self._wait_i2c_idle()
+        status, _ = self._transact([ self.chip.write_i2c_frame(self.address, bytes([register] + data)) ])
+        if(not self.chip.check_i2c_write_result(status)):
             raise Exception("Register address and data write was not acknowledged")
+        self._shadow_update(register, bytes(data))
 
     def general_reset(self):
         # Perform I2C General-Call Reset
-        while(self.chip.check_i2c_busy()):
-            print("info: I2C bus is still busy, waiting ...")
-            time.sleep(0.1)
-        self.chip.write_i2c(0x00, bytes([I2C_CALL_RESET_CMD]))
-        if(not self.chip.check_i2c_write_result()):
+        self.invalidate_shadow()
+        self._wait_i2c_idle()
+        status, _ = self._transact([ self.chip.write_i2c_frame(0x00, bytes([I2C_CALL_RESET_CMD])) ])
+        if(not self.chip.check_i2c_write_result(status)):
             raise Exception("General call was not acknowledged")
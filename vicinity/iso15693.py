@@ -1,21 +1,7 @@
-# Command flags
-ISO_FLAG_SUB_CARRIER =                      (1 << 0)
-ISO_FLAG_DATA_RATE =                        (1 << 1)
-ISO_FLAG_INVENTORY =                        (1 << 2)
-ISO_FLAG_PROTOCOL_EXTENSION =               (1 << 3)
+import time
 
-# Request flags when inventory flag is NOT set
-ISO_FLAG_SELECT =                           (1 << 4)
-ISO_FLAG_ADDRESS =                          (1 << 5)
-ISO_FLAG_OPTION =                           (1 << 6)
-ISO_FLAG_RFU =                              (1 << 7)
-
-# Request flags when inventory flag is set. Bits 7 to 8 are the same as before.
-ISO_FLAG_AFI =                              (1 << 4)
-ISO_FLAG_NB_SLOTS =                         (1 << 5)
-
-# Response flags
-ISO_FLAG_ERROR =                            (1 << 0)
+from protocol.commands import *
+from protocol.errors import ISO15693Error, PseudoAPDUError, TransmissionError
 
 # Get system information flags
 ISO_SYSTEM_INFO_FLAG_DSFID =                (1 << 0)
@@ -91,21 +77,165 @@ ISO_CSI_29167_22_SPECK =                    0x0C
 # Block security status flags
 ISO_FLAG_SECURITY_STATUS_LOCKED =           (1 << 0)
 
-# Command codes
-ISO_CMD_SYSTEM_INFO =                       0x2B
-ISO_CMD_EXTENDED_SYSTEM_INFO =              0x3B
-ISO_CMD_READ_SINGLE_BLOCK =                 0x20
-ISO_CMD_READ_MULTIPLE_BLOCKS =              0x23
-ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS =     0x3D
+# Addressing modes, see ISO15693.address() and ISO15693.select()
+ISO_MODE_UNADDRESSED =                      0
+ISO_MODE_ADDRESSED =                        1
+ISO_MODE_SELECTED =                         2
+
+# Inventory slot counts, 16 slots resolve more tags per round but cost 16 exchanges each
+ISO_INVENTORY_SLOTS =                       (1, 16)
+ISO_INVENTORY_SLOT_BITS = {
+    1:                                      1,
+    16:                                     4,
+}
+# UID length in bits, the longest possible inventory mask
+ISO_UID_BITS =                              64
+
+# Write commands from widest to narrowest, with their name in the extended system information command list
+ISO_WRITE_COMMANDS = (
+    (ISO_CMD_EXT_WRITE_MULTIPLE_BLOCKS,     "extended_write_multiple_blocks"),
+    (ISO_CMD_WRITE_MULTIPLE_BLOCKS,         "write_multiple_blocks"),
+    (ISO_CMD_EXT_WRITE_SINGLE_BLOCK,        "extended_write_single_block"),
+    (ISO_CMD_WRITE_SINGLE_BLOCK,            "write_single_block"),
+)
+
+# Response bytes per read frame the memory reader starts with, fits a short reader response APDU
+# The number of blocks per frame is halved while the reader or tag rejects it
+ISO_READ_CHUNK_BYTES =                      240
+# Blocks per multiple block write frame
+ISO_WRITE_CHUNK_BLOCKS =                    16
+# Time to wait for the answer to a write frame, in seconds, grows with the EEPROM write time per block
+ISO_WRITE_TIMEOUT_BASE =                    0.02
+ISO_WRITE_TIMEOUT_BLOCK =                   0.01
+
+
+class MemoryImage:
+    def __init__(self, start_block, num_blocks, block_size = 4):
+        # Preallocated copy of a memory range, with one lock bit per block
+        self.start_block = start_block
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.data = bytearray(num_blocks * block_size)
+        self.locks = bytearray((num_blocks + 7) // 8)
+
+    def block(self, block_number):
+        offset = (block_number - self.start_block) * self.block_size
+        return memoryview(self.data)[offset:offset + self.block_size]
+
+    def is_locked(self, block_number):
+        index = block_number - self.start_block
+        return bool(self.locks[index >> 3] & (1 << (index & 0x07)))
+
+    def locked_blocks(self):
+        return [ self.start_block + index for index in range(self.num_blocks) 
+            if self.locks[index >> 3] & (1 << (index & 0x07)) ]
 
 
 class ISO15693:
     def __init__(self, reader):
         self.reader = reader
+        # Blocks per memory read frame that last worked, None until the first read
+        self.read_chunk = None
+        # Capability cache and the UID it was validated for, see identify()
+        self.cache = None
+        self.uid = None
+        # Commands reach every tag in the field unless addressed to or selected by UID
+        self.mode = ISO_MODE_UNADDRESSED
+
+    def transmit(self, frame, allow_no_response = False, timeout = None):
+        return self.reader.transmit_iso15693(self.address_frame(frame), allow_no_response, timeout)
+
+    def address_frame(self, frame):
+        # Turn an unaddressed request frame into one for the current addressing mode
+        if(self.mode == ISO_MODE_SELECTED):
+            return bytes([frame[0] | ISO_FLAG_SELECT]) + frame[1:]
+        if(self.mode == ISO_MODE_ADDRESSED):
+            split = 3 if(frame[1] >= ISO_CMD_CUSTOM_FIRST) else 2
+            # UID is sent in reverse byte order, like it is received
+            return bytes([frame[0] | ISO_FLAG_ADDRESS]) + frame[1:split] + self.uid[::-1] + frame[split:]
+        return frame
+
+    def address(self, uid):
+        # Send all following commands addressed, only the tag with this UID answers
+        self.uid = bytes(uid)
+        self.mode = ISO_MODE_ADDRESSED
+
+    def select(self, uid):
+        # Put the tag into the selected state, following commands omit the UID
+        # Selecting a tag returns the previously selected one to the ready state
+        # SELECT itself is addressed, the previous addressing is restored if it fails
+        previous = (self.uid, self.mode)
+        self.uid = bytes(uid)
+        self.mode = ISO_MODE_ADDRESSED
+        try:
+            self.transmit(bytes([ISO_FLAG_DATA_RATE, ISO_CMD_SELECT]))
+        except Exception:
+            self.uid, self.mode = previous
+            raise
+        self.mode = ISO_MODE_SELECTED
+
+    def reset_to_ready(self):
+        # Return the tag to the ready state and send unaddressed commands again
+        self.transmit(bytes([ISO_FLAG_DATA_RATE, ISO_CMD_RESET_TO_READY]))
+        self.mode = ISO_MODE_UNADDRESSED
+
+    def inventory_frame(self, mask, mask_length, afi = None):
+        # One slot request, the mask holds the least significant UID bits the tags must match
+        flags = ISO_FLAG_DATA_RATE | ISO_FLAG_INVENTORY | ISO_FLAG_NB_SLOTS
+        frame = bytes([flags | (ISO_FLAG_AFI if(afi != None) else 0x00), ISO_CMD_INVENTORY])
+        if(afi != None):
+            frame += bytes([afi])
+        return frame + bytes([mask_length]) + mask.to_bytes((mask_length + 7) // 8, "little")
+
+    def inventory(self, slots = 16, afi = None):
+        # Anticollision inventory of all tags in the field, returns their UIDs
+        # A 16 slot round sends one request per slot, the transparent reader exchange cannot send
+        # the end of frame that moves the tags on to the next slot, so every slot gets its own mask
+        if(slots not in ISO_INVENTORY_SLOTS):
+            raise Exception(f"Inventory takes {' or '.join(str(count) for count in ISO_INVENTORY_SLOTS)} slots")
+        bits = ISO_INVENTORY_SLOT_BITS[slots]
+        uids = []
+        pending = [ (0, 0) ]
+        while(len(pending) > 0):
+            mask, mask_length = pending.pop()
+            for slot in range(1 << bits):
+                # Tags in this slot share the next bits of their UID
+                slot_mask = mask | (slot << mask_length)
+                try:
+                    data = self.reader.transmit_iso15693(self.inventory_frame(slot_mask, mask_length + bits, afi), True)
+                except TransmissionError:
+                    # Several tags answered at once, resolve them with a longer mask
+                    if(mask_length + bits >= ISO_UID_BITS):
+                        raise
+                    pending.append((slot_mask, mask_length + bits))
+                    continue
+                if(len(data) >= 9):
+                    # DSFID is followed by the UID in reverse byte order
+                    uids.append(data[1:9][::-1])
+        return uids
+
+    def identify(self, cache):
+        # Read GET SYSTEM INFO once and look the tag up by its UID, identification responses
+        # of a known tag are served from the cache afterwards. Returns True for a known tag
+        data = self.transmit(bytes([ISO_FLAG_DATA_RATE, ISO_CMD_SYSTEM_INFO]))
+        self.cache = cache
+        # UID is field after info flags, in reverse byte order
+        self.uid = data[1:9][::-1]
+        return self.cache.validate(self.uid, data)
+
+    def _query(self, name, frame):
+        # Transmit an identification request, unless the validated cache entry holds its response
+        if(self.cache != None):
+            data = self.cache.get(self.uid, name)
+            if(data != None):
+                return data
+        data = self.transmit(frame)
+        if(self.cache != None):
+            self.cache.put(self.uid, name, data)
+        return data
 
     def get_system_info(self):
-        data = self.reader.transmit_iso15693(
-            bytes([ISO_FLAG_DATA_RATE, ISO_CMD_SYSTEM_INFO]))
+        data = self._query("system_info", bytes([ISO_FLAG_DATA_RATE, ISO_CMD_SYSTEM_INFO]))
 
         info_flags = data[0]
         # UID is field after info flags, in reverse byte order
@@ -137,9 +267,8 @@ class ISO15693:
     def get_extended_system_info(self):
         # Request all possible info by setting all the flags, except the
         # "Get request System field Info length parameter" which is still 0 = one byte.
-        data = self.reader.transmit_iso15693(
-            bytes([ISO_FLAG_DATA_RATE, ISO_CMD_EXTENDED_SYSTEM_INFO, 0x7F])
-        )
+        data = self._query("extended_system_info",
+            bytes([ISO_FLAG_DATA_RATE, ISO_CMD_EXTENDED_SYSTEM_INFO, 0x7F]))
 
         info_flags = data[0]
         # Reject non-standard responses
@@ -169,10 +298,9 @@ class ISO15693:
         if(info_flags & ISO_SYSTEM_INFO_FLAG_IC_REFERENCE):
             info["icref"] = data[data_index]
             data_index += 1
-        if(info_flags & ISO_EXTENDED_SYSTEM_INFO_MOI):
-            # MOI = 0 means one-byte addressing, MOI = 1 means two-byte addressing
-            info["moi"] = data[data_index]
-            data_index += 1
+        # MOI is a flag only, no byte is transmitted for it
+        # MOI = 0 means one-byte addressing, MOI = 1 means two-byte addressing
+        info["moi"] = 1 if(info_flags & ISO_EXTENDED_SYSTEM_INFO_MOI) else 0
         if(info_flags & ISO_EXTENDED_SYSTEM_INFO_VICC_CMD_LIST):
             info["cmdlist"] = {
                 "read_single_block": bool(data[data_index] & ISO_EXTENDED_SYSTEM_INFO_CMD_READ_SINGLE_BLOCK),
@@ -257,19 +385,15 @@ class ISO15693:
         return info
 
     def read_single_block(self, block_number):
-        data = self.reader.transmit_iso15693(
-            bytes([ISO_FLAG_DATA_RATE, ISO_CMD_READ_SINGLE_BLOCK, block_number]))
+        # The option flag requests the block security status in front of the data
+        data = self.transmit(
+            bytes([ISO_FLAG_DATA_RATE | ISO_FLAG_OPTION, ISO_CMD_READ_SINGLE_BLOCK, block_number]))
         locked = data[0] & ISO_FLAG_SECURITY_STATUS_LOCKED
         payload = data[1:]
-        return data, locked
+        return payload, locked
 
     def read_multiple_blocks(self, start_block, num_blocks):
-        # The base command always reads one block more than specified
-        if(num_blocks < 1):
-            raise Exception("Must read at least one block")
-        data = self.reader.transmit_iso15693(bytes([ISO_FLAG_DATA_RATE | ISO_FLAG_OPTION, 
-            ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS]) + start_block.to_bytes(2, "big") +
-            (num_blocks - 1).to_bytes(2, "big"))
+        data = self.transmit(self.read_blocks_frame(start_block, num_blocks))
         block_length = len(data) // num_blocks
         read_offset = 0
         blocks = []
@@ -278,3 +402,144 @@ class ISO15693:
             blocks.append((data[read_offset + 1:read_offset + block_length], locked))
             read_offset += block_length
         return blocks
+
+    def read_blocks_frame(self, start_block, num_blocks, security = True):
+        # The base command always reads one block more than specified
+        # Block number and count are sent least significant byte first
+        if(num_blocks < 1):
+            raise Exception("Must read at least one block")
+        return bytes([ISO_FLAG_DATA_RATE | (ISO_FLAG_OPTION if security else 0x00), 
+            ISO_CMD_FAST_EXT_READ_MULTIPLE_BLOCKS]) + start_block.to_bytes(2, "little") + \
+            (num_blocks - 1).to_bytes(2, "little")
+
+    def stream_memory(self, image, security = True):
+        # Fill the image in as few frames as possible, yielding a view of each chunk as it arrives
+        # Nothing is allocated per block, the views point into the image
+        size = image.block_size
+        stride = size + (1 if security else 0)
+        if(self.read_chunk == None):
+            self.read_chunk = max(1, ISO_READ_CHUNK_BYTES // stride)
+        view = memoryview(image.data)
+        index = 0
+        while(index < image.num_blocks):
+            count = min(self.read_chunk, image.num_blocks - index)
+            try:
+                data = self.transmit(self.read_blocks_frame(image.start_block + index, count, security))
+            except PseudoAPDUError:
+                if(count == 1):
+                    raise
+                # The reader rejected the frame or its response length, try again with half the blocks
+                # Any other error is not caused by the chunk size and goes straight to the caller
+                self.read_chunk = max(1, count // 2)
+                continue
+            if(len(data) != count * stride):
+                raise Exception(f"Read {len(data)} bytes instead of {count * stride}")
+            target = view[index * size:(index + count) * size]
+            if(security):
+                # De-interleave the security status bytes from the block data, one slice per byte lane
+                for lane in range(size):
+                    target[lane::size] = data[lane + 1::stride]
+                status = data[0::stride]
+                if(status.count(0x00) != count):
+                    for block in range(count):
+                        if(status[block] & ISO_FLAG_SECURITY_STATUS_LOCKED):
+                            image.locks[(index + block) >> 3] |= 1 << ((index + block) & 0x07)
+            else:
+                target[:] = data
+            index += count
+            yield target
+
+    def read_memory(self, start_block, num_blocks, block_size = 4, security = True):
+        image = MemoryImage(start_block, num_blocks, block_size)
+        for chunk in self.stream_memory(image, security):
+            pass
+        return image
+
+    def write_blocks_frame(self, command, start_block, data, block_size = 4):
+        # Extended commands take two byte block numbers and counts, least significant byte first
+        extended = command in (ISO_CMD_EXT_WRITE_SINGLE_BLOCK, ISO_CMD_EXT_WRITE_MULTIPLE_BLOCKS)
+        width = 2 if extended else 1
+        frame = bytes([ISO_FLAG_DATA_RATE, command]) + start_block.to_bytes(width, "little")
+        if(command in (ISO_CMD_WRITE_MULTIPLE_BLOCKS, ISO_CMD_EXT_WRITE_MULTIPLE_BLOCKS)):
+            # The base command always writes one block more than specified
+            frame += (len(data) // block_size - 1).to_bytes(width, "little")
+        elif(len(data) != block_size):
+            raise Exception("Single block writes take exactly one block")
+        return frame + bytes(data)
+
+    def select_write_command(self, cmdlist, end_block, multiple = True):
+        # Widest write command the tag supports that can address the whole range
+        for command, name in ISO_WRITE_COMMANDS:
+            if(not cmdlist.get(name, False)):
+                continue
+            if(not multiple and command in (ISO_CMD_WRITE_MULTIPLE_BLOCKS, ISO_CMD_EXT_WRITE_MULTIPLE_BLOCKS)):
+                continue
+            if(command in (ISO_CMD_WRITE_SINGLE_BLOCK, ISO_CMD_WRITE_MULTIPLE_BLOCKS) and end_block > 0x100):
+                continue
+            return command
+        raise Exception("Tag supports no write command for this memory range")
+
+    def _write_blocks(self, command, start_block, data, block_size):
+        # Persistent writes are often answered after the reader gave up, the result is verified by reading back
+        num_blocks = len(data) // block_size
+        self.transmit(self.write_blocks_frame(command, start_block, data, block_size), True,
+            ISO_WRITE_TIMEOUT_BASE + ISO_WRITE_TIMEOUT_BLOCK * num_blocks)
+
+    def write_memory(self, start_block, data, block_size = 4, cmdlist = None, verify = True, 
+            chunk_blocks = ISO_WRITE_CHUNK_BLOCKS):
+        # Stream a buffer into user memory with the widest supported write command, then verify it
+        # in multiple block reads, blocks that did not verify are written once more on their own
+        start = time.time()
+        if(cmdlist == None):
+            cmdlist = self.get_extended_system_info()["cmdlist"]
+        num_blocks = (len(data) + block_size - 1) // block_size
+        buffer = bytearray(num_blocks * block_size)
+        buffer[:len(data)] = data
+        if(len(data) % block_size != 0):
+            # Keep the remainder of a partially written last block
+            tail = self.read_memory(start_block + num_blocks - 1, 1, block_size, False).data
+            buffer[len(data):] = tail[len(data) % block_size:]
+        command = self.select_write_command(cmdlist, start_block + num_blocks)
+        chunk = chunk_blocks if(command in (ISO_CMD_WRITE_MULTIPLE_BLOCKS, ISO_CMD_EXT_WRITE_MULTIPLE_BLOCKS)) else 1
+        view = memoryview(buffer)
+        frames = 0
+        index = 0
+        while(index < num_blocks):
+            count = min(chunk, num_blocks - index)
+            frames += 1
+            try:
+                self._write_blocks(command, start_block + index, view[index * block_size:(index + count) * block_size], block_size)
+            except ISO15693Error as e:
+                # Some tags list multiple block writes they reject, continue block by block
+                if(chunk == 1 or not e.code in (ISO_ERROR_UNSUPPORTED_CMD, ISO_ERROR_UNRECOGNIZED_CMD)):
+                    raise
+                print(f"warning: Tag rejected write command {command:02x}, writing single blocks")
+                command = self.select_write_command(cmdlist, start_block + num_blocks, False)
+                chunk = 1
+                continue
+            index += count
+        rewrites = []
+        if(verify):
+            image = self.read_memory(start_block, num_blocks, block_size, False)
+            if(image.data != buffer):
+                single = self.select_write_command(cmdlist, start_block + num_blocks, False)
+                rewrites = [ start_block + index for index in range(num_blocks) 
+                    if image.block(start_block + index) != view[index * block_size:(index + 1) * block_size] ]
+                for block in rewrites:
+                    offset = (block - start_block) * block_size
+                    self._write_blocks(single, block, view[offset:offset + block_size], block_size)
+                    frames += 1
+                for block in rewrites:
+                    offset = (block - start_block) * block_size
+                    if(self.read_memory(block, 1, block_size, False).data != buffer[offset:offset + block_size]):
+                        raise Exception(f"Block {block} does not verify after writing it again")
+        elapsed = time.time() - start
+        return {
+            "command": command,
+            "bytes": len(data),
+            "blocks": num_blocks,
+            "frames": frames,
+            "rewrites": rewrites,
+            "elapsed": elapsed,
+            "throughput": len(data) / elapsed if elapsed > 0 else 0.0,
+        }
@@ -1,15 +1,8 @@
-from .iso15693 import *
-
-# Command codes
-NXP_CMD_SYSTEM_INFO =                           0xAB
-NXP_CMD_READ_CONFIG =                           0xC0
-NXP_CMD_WRITE_CONFIG =                          0xC1
-NXP_CMD_READ_SRAM =                             0xD2
-NXP_CMD_READ_I2C =                              0xD5
-NXP_CMD_WRITE_I2C =                             0xD4
+import time
 
-# Command parameters
-NXP_CMD_MANUF_CODE_NXP =                        0x04
+from protocol.commands import *
+from .iso15693 import *
+from .regmap import RegisterMap, Flag, Enum, Number
 
 # Config addresses
 NXP_CONFIG_ADDR_CONFIG =                        0x37
@@ -17,6 +10,12 @@ NXP_CONFIG_ADDR_EH_CONFIG_REG =                 0xA7
 NXP_CONFIG_ADDR_I2C_M_STATUS_REG =              0xAD
 NXP_CONFIG_ADDR_EH_CONFIG =                     0x3D
 
+# Session registers fetched together in one snapshot
+NXP_SESSION_ADDR_FIRST =                        NXP_CONFIG_ADDR_EH_CONFIG_REG
+NXP_SESSION_ADDR_LAST =                         NXP_CONFIG_ADDR_I2C_M_STATUS_REG
+# Time a session register snapshot is served without fetching it again, in seconds
+NXP_SESSION_SNAPSHOT_VALIDITY =                 0.02
+
 # Config flags
 NXP_CONFIG_0_AUTO_STANDBY_MODE_EN =             (1 << 0)
 NXP_CONFIG_0_LOCK_SESSION_REG =                 (1 << 1)
@@ -140,212 +139,205 @@ NXP_ED_CONFIG_SOFTWARE_INTERRUPT =              0x0D
 NXP_ED_CONFIG_RFU1 =                            0x0E
 NXP_ED_CONFIG_RFU2 =                            0x0F
 
+# Register map of the NXP system information response, registers are byte offsets
+NXP_INFO_MAP = RegisterMap([
+    Number("pp_pointer",                            0, 0xFF),
+    Flag("pp_condition.read_protect_page_0l",       1, NXP_CMD_SYSTEM_INFO_FLAG_PPC_RL),
+    Flag("pp_condition.write_protect_page_0l",      1, NXP_CMD_SYSTEM_INFO_FLAG_PPC_WL),
+    Flag("pp_condition.read_protect_page_0h",       1, NXP_CMD_SYSTEM_INFO_FLAG_PPC_RH),
+    Flag("pp_condition.write_protect_page_0h",      1, NXP_CMD_SYSTEM_INFO_FLAG_PPC_WH),
+    Flag("lock_bits.eas_locked",                    2, NXP_CMD_SYSTEM_INFO_FLAG_LOCK_EAS),
+    Flag("lock_bits.dsfid_locked",                  2, NXP_CMD_SYSTEM_INFO_FLAG_LOCK_DSFID),
+    Flag("lock_bits.nfc_pp_area_0h_locked",         2, NXP_CMD_SYSTEM_INFO_FLAG_LOCK_NFC_PP_AREA_0H),
+    # Feature flags byte 0
+    Flag("features.user_memory_protection",         3, NXP_CMD_SYSTEM_INFO_FLAG_UM_PROT),
+    Flag("features.counter",                        3, NXP_CMD_SYSTEM_INFO_FLAG_COUNTER),
+    Flag("features.eas_id",                         3, NXP_CMD_SYSTEM_INFO_FLAG_EAS_ID),
+    Flag("features.eas_protection",                 3, NXP_CMD_SYSTEM_INFO_FLAG_EAS_PROT),
+    Flag("features.afi_protection",                 3, NXP_CMD_SYSTEM_INFO_FLAG_AFI_PROT),
+    Flag("features.inventory_read_ext",             3, NXP_CMD_SYSTEM_INFO_FLAG_INV_READ_EXT),
+    Flag("features.eas_ir",                         3, NXP_CMD_SYSTEM_INFO_FLAG_EAS_IR),
+    Flag("features.cid",                            3, NXP_CMD_SYSTEM_INFO_FLAG_CID),
+    # Feature flags byte 1
+    Flag("features.persistent_quiet",               4, NXP_CMD_SYSTEM_INFO_FLAG_PERSISTENT_QUIET),
+    Flag("features.nfc_privacy",                    4, NXP_CMD_SYSTEM_INFO_FLAG_NFC_PRIVACY),
+    Flag("features.destroy",                        4, NXP_CMD_SYSTEM_INFO_FLAG_DESTROY),
+    Flag("features.write_cid",                      4, NXP_CMD_SYSTEM_INFO_FLAG_WRITE_CID),
+    Flag("features.high_bitrates",                  4, NXP_CMD_SYSTEM_INFO_FLAG_HIGH_BITRATES),
+    # Feature flags byte 2
+    Flag("features.originality_signature",          5, NXP_CMD_SYSTEM_INFO_FLAG_ORIG_SIG),
+    # Feature flags byte 3
+    Flag("features.extended_flags_present",         6, NXP_CMD_SYSTEM_INFO_FLAG_EXT_FLAG),
+    Enum("features.interface",                      6, NXP_CMD_SYSTEM_INFO_FLAG_INTERFACE_MASK, {
+        0x00 << NXP_CMD_SYSTEM_INFO_FLAG_INTERFACE_SHIFT:   "only_nfc",
+        0x01 << NXP_CMD_SYSTEM_INFO_FLAG_INTERFACE_SHIFT:   "gpio",
+        0x02 << NXP_CMD_SYSTEM_INFO_FLAG_INTERFACE_SHIFT:   "rfu",
+        0x03 << NXP_CMD_SYSTEM_INFO_FLAG_INTERFACE_SHIFT:   "gpio_i2c" }),
+    Number("features.num_keys",                     6, NXP_CMD_SYSTEM_INFO_FLAG_NUM_KEYS_MASK),
+], block_size = 7)
+
+# Register map of the CONFIG block, registers are byte offsets
+NXP_CONFIG_MAP = RegisterMap([
+    Flag("auto_standby_mode_enabled",               0, NXP_CONFIG_0_AUTO_STANDBY_MODE_EN),
+    Flag("lock_session_register",                   0, NXP_CONFIG_0_LOCK_SESSION_REG),
+    # The high field strength mode sets all EH mode bits
+    Enum("energy_harvesting_mode",                  0, NXP_CONFIG_0_EH_MODE_HIGH_FIELD_STRENGTH, {
+        NXP_CONFIG_0_EH_MODE_LOW_FIELD_STRENGTH:    "low_field_strength",
+        NXP_CONFIG_0_EH_MODE_HIGH_FIELD_STRENGTH:   "high_field_strength",
+        NXP_CONFIG_0_EH_MODE_RFU0:                  "rfu0",
+        NXP_CONFIG_0_EH_MODE_RFU1:                  "rfu1" }),
+    Flag("sram_copy_enabled",                       0, NXP_CONFIG_0_SRAM_COPY_EN),
+    Enum("pt_transfer_direction",                   1, NXP_CONFIG_1_PT_TRANSFER_DIR, {
+        0:                                          "tag_to_reader",
+        NXP_CONFIG_1_PT_TRANSFER_DIR:               "reader_to_tag" }),
+    Flag("sram_enabled",                            1, NXP_CONFIG_1_SRAM_ENABLE),
+    Enum("arbiter_mode",                            1, NXP_CONFIG_1_ARBITER_MODE_SRAM_PHDC, {
+        NXP_CONFIG_1_ARBITER_MODE_NORMAL:           "normal",
+        NXP_CONFIG_1_ARBITER_MODE_SRAM_MIRROR:      "sram_mirror",
+        NXP_CONFIG_1_ARBITER_MODE_SRAM_PASSTHROUGH: "sram_passthrough",
+        NXP_CONFIG_1_ARBITER_MODE_SRAM_PHDC:        "sram_phdc" }),
+    Enum("use_case",                                1, NXP_CONFIG_1_USE_CASE_CONF_TRISTATE, {
+        NXP_CONFIG_1_USE_CASE_CONF_I2C_SLAVE:       "i2c_slave",
+        NXP_CONFIG_1_USE_CASE_CONF_I2C_MASTER:      "i2c_master",
+        NXP_CONFIG_1_USE_CASE_CONF_GPIO_PWM:        "gpio_pwm",
+        NXP_CONFIG_1_USE_CASE_CONF_TRISTATE:        "tristate" }),
+    Flag("eh_arbiter_mode_enabled",                 1, NXP_CONFIG_1_EH_ARBITER_MODE_EN),
+    Enum("gpio0_slew_rate",                         2, NXP_CONFIG_2_GPIO0_SLEW_RATE, {
+        0:                                          "normal",
+        NXP_CONFIG_2_GPIO0_SLEW_RATE:               "fast" }),
+    Enum("gpio1_slew_rate",                         2, NXP_CONFIG_2_GPIO1_SLEW_RATE, {
+        0:                                          "normal",
+        NXP_CONFIG_2_GPIO1_SLEW_RATE:               "fast" }),
+    Flag("lock_block_command_supported",            2, NXP_CONFIG_2_LOCK_BLOCK_COMMAND_SUPPORTED),
+    Flag("extended_commands_supported",             2, NXP_CONFIG_2_EXTENDED_COMMANDS_SUPPORTED),
+    Enum("gpio0_pad_in",                            2, NXP_CONFIG_2_GPIO0_PAD_IN_PLAIN_PULLDOWN, {
+        NXP_CONFIG_2_GPIO0_PAD_IN_DISABLED:         "disabled",
+        NXP_CONFIG_2_GPIO0_PAD_IN_PLAIN_PULLUP:     "plain_pullup",
+        NXP_CONFIG_2_GPIO0_PAD_IN_PLAIN:            "plain",
+        NXP_CONFIG_2_GPIO0_PAD_IN_PLAIN_PULLDOWN:   "plain_pulldown" }),
+    Enum("gpio1_pad_in",                            2, NXP_CONFIG_2_GPIO1_PAD_IN_PLAIN_PULLDOWN, {
+        NXP_CONFIG_2_GPIO1_PAD_IN_DISABLED:         "disabled",
+        NXP_CONFIG_2_GPIO1_PAD_IN_PLAIN_PULLUP:     "plain_pullup",
+        NXP_CONFIG_2_GPIO1_PAD_IN_PLAIN:            "plain",
+        NXP_CONFIG_2_GPIO1_PAD_IN_PLAIN_PULLDOWN:   "plain_pulldown" }),
+], block_size = 4)
+
+# Register map of the EH_CONFIG and ED_CONFIG block, registers are byte offsets
+NXP_EH_ED_CONFIG_MAP = RegisterMap([
+    # The highest current and the RFU voltage set all bits of their fields
+    Enum("eh_vout_i_sel",                           0, NXP_EH_CONFIG_EH_VOUT_I_SEL_12_5, {
+        NXP_EH_CONFIG_EH_VOUT_I_SEL_0_4:            "0.4",
+        NXP_EH_CONFIG_EH_VOUT_I_SEL_0_6:            "0.6",
+        NXP_EH_CONFIG_EH_VOUT_I_SEL_1_4:            "1.4",
+        NXP_EH_CONFIG_EH_VOUT_I_SEL_2_7:            "2.7",
+        NXP_EH_CONFIG_EH_VOUT_I_SEL_4_0:            "4.0",
+        NXP_EH_CONFIG_EH_VOUT_I_SEL_6_5:            "6.5",
+        NXP_EH_CONFIG_EH_VOUT_I_SEL_9_0:            "9.0",
+        NXP_EH_CONFIG_EH_VOUT_I_SEL_12_5:           "12.5" }),
+    Flag("disable_power_check",                     0, NXP_EH_CONFIG_DISABLE_POWER_CHECK),
+    Enum("eh_vout_v_sel",                           0, NXP_EH_CONFIG_EH_VOUT_V_SEL_RFU, {
+        NXP_EH_CONFIG_EH_VOUT_V_SEL_1_8:            "1.8",
+        NXP_EH_CONFIG_EH_VOUT_V_SEL_2_4:            "2.4",
+        NXP_EH_CONFIG_EH_VOUT_V_SEL_3_0:            "3.0",
+        NXP_EH_CONFIG_EH_VOUT_V_SEL_RFU:            "RFU" }),
+    Flag("eh_enable",                               0, NXP_EH_CONFIG_EH_ENABLE),
+    Enum("ed_config",                               2, NXP_ED_CONFIG_RFU2, {
+        NXP_ED_CONFIG_DISABLE:                      "disable",
+        NXP_ED_CONFIG_NFC_FIELD_DETECT:             "nfc_field_detect",
+        NXP_ED_CONFIG_PWM:                          "pwm",
+        NXP_ED_CONFIG_I2C_TO_NFC_PASS_THROUGH:      "i2c_to_nfc_pass_through",
+        NXP_ED_CONFIG_NFC_TO_I2C_PASS_THROUGH:      "nfc_to_i2c_pass_through",
+        NXP_ED_CONFIG_ARBITER_LOCK:                 "arbiter_lock",
+        NXP_ED_CONFIG_NDEF_MSG_TLV_LENGTH:          "ndef_msg_tlv_length",
+        NXP_ED_CONFIG_STANDBY_MODE:                 "standby_mode",
+        NXP_ED_CONFIG_WRITE_CMD_INDICATION:         "write_cmd_indication",
+        NXP_ED_CONFIG_READ_CMD_INDICATION:          "read_cmd_indication",
+        NXP_ED_CONFIG_START_OF_COMMAND_INDICATION:  "start_of_command_indication",
+        NXP_ED_CONFIG_READ_FROM_SYNCH_BLOCK:        "read_from_synch_block",
+        NXP_ED_CONFIG_WRITE_TO_SYNCH_BLOCK:         "write_to_synch_block",
+        NXP_ED_CONFIG_SOFTWARE_INTERRUPT:           "software_interrupt",
+        NXP_ED_CONFIG_RFU1:                         "rfu1",
+        NXP_ED_CONFIG_RFU2:                         "rfu2" }),
+], block_size = 4)
+
+
+class I2CError(Exception):
+    # The I2C master transaction of the NTAG 5 Link failed
+    pass
+
+
+class I2CNakError(I2CError):
+    pass
+
+
+class I2CWatchdogError(I2CError):
+    pass
+
+
+class SessionSnapshot:
+    def __init__(self, data, timestamp):
+        # Session register blocks from NXP_SESSION_ADDR_FIRST on, as read at timestamp
+        self.data = bytes(data)
+        self.timestamp = timestamp
+
+    def register(self, address):
+        if(address < NXP_SESSION_ADDR_FIRST or address > NXP_SESSION_ADDR_LAST):
+            raise Exception(f"Session register 0x{address:02x} is not part of the snapshot")
+        offset = (address - NXP_SESSION_ADDR_FIRST) * 4
+        return self.data[offset:offset + 4]
+
+    def i2c_status(self):
+        return self.register(NXP_CONFIG_ADDR_I2C_M_STATUS_REG)[0]
+
+    def eh_config(self):
+        return self.register(NXP_CONFIG_ADDR_EH_CONFIG_REG)[0]
+
 
 class NTAG5Link(ISO15693):
-    def __init__(self, reader):
+    def __init__(self, reader, session_validity = NXP_SESSION_SNAPSHOT_VALIDITY):
         super().__init__(reader)
+        # Set when the last status fetch showed an idle I2C master
+        self.i2c_idle = False
+        # Last session register snapshot, dropped by any I2C or config write
+        self.session = None
+        self.session_validity = session_validity
 
     def get_nxp_info(self):
-        data = self.reader.transmit_iso15693(
+        data = self._query("nxp_info",
             bytes([ISO_FLAG_DATA_RATE, NXP_CMD_SYSTEM_INFO, NXP_CMD_MANUF_CODE_NXP]))
 
-        res = {}
-
-        res["pp_pointer"] = data[0]
-
-        pp_cond = data[1]
-        res["pp_condition"] = {
-            "read_protect_page_0l": bool(pp_cond & NXP_CMD_SYSTEM_INFO_FLAG_PPC_RL),
-            "write_protect_page_0l": bool(pp_cond & NXP_CMD_SYSTEM_INFO_FLAG_PPC_WL),
-            "read_protect_page_0h": bool(pp_cond & NXP_CMD_SYSTEM_INFO_FLAG_PPC_RH),
-            "write_protect_page_0h": bool(pp_cond & NXP_CMD_SYSTEM_INFO_FLAG_PPC_WH),
-        }
-
-        lock_bits = data[2]
-        res["lock_bits"] = {
-            "eas_locked": bool(lock_bits & NXP_CMD_SYSTEM_INFO_FLAG_LOCK_EAS),
-            "dsfid_locked": bool(lock_bits & NXP_CMD_SYSTEM_INFO_FLAG_LOCK_DSFID),
-            "nfc_pp_area_0h_locked": bool(lock_bits & NXP_CMD_SYSTEM_INFO_FLAG_LOCK_NFC_PP_AREA_0H),
-        }
-
-        interface_lookup = {
-            0x00: "only_nfc",
-            0x01: "gpio",
-            0x02: "rfu",
-            0x03: "gpio_i2c"
-        }
-
-        b0, b1, b2, b3 = data[3:7]
-        res["features"] = {
-            # Byte 0
-            "user_memory_protection": bool(b0 & NXP_CMD_SYSTEM_INFO_FLAG_UM_PROT),
-            "counter": bool(b0 & NXP_CMD_SYSTEM_INFO_FLAG_COUNTER),
-            "eas_id": bool(b0 & NXP_CMD_SYSTEM_INFO_FLAG_EAS_ID),
-            "eas_protection": bool(b0 & NXP_CMD_SYSTEM_INFO_FLAG_EAS_PROT),
-            "afi_protection": bool(b0 & NXP_CMD_SYSTEM_INFO_FLAG_AFI_PROT),
-            "inventory_read_ext": bool(b0 & NXP_CMD_SYSTEM_INFO_FLAG_INV_READ_EXT),
-            "eas_ir": bool(b0 & NXP_CMD_SYSTEM_INFO_FLAG_EAS_IR),
-            "cid": bool(b0 & NXP_CMD_SYSTEM_INFO_FLAG_CID),
-
-            # Byte 1
-            "persistent_quiet": bool(b1 & NXP_CMD_SYSTEM_INFO_FLAG_PERSISTENT_QUIET),
-            "nfc_privacy": bool(b1 & NXP_CMD_SYSTEM_INFO_FLAG_NFC_PRIVACY),
-            "destroy": bool(b1 & NXP_CMD_SYSTEM_INFO_FLAG_DESTROY),
-            "write_cid": bool(b1 & NXP_CMD_SYSTEM_INFO_FLAG_WRITE_CID),
-            "high_bitrates": bool(b1 & NXP_CMD_SYSTEM_INFO_FLAG_HIGH_BITRATES),
-
-            # Byte 2
-            "originality_signature": bool(b2 & NXP_CMD_SYSTEM_INFO_FLAG_ORIG_SIG),
-
-            # Byte 3
-            "extended_flags_present": bool(b3 & NXP_CMD_SYSTEM_INFO_FLAG_EXT_FLAG),
-            "interface": interface_lookup.get(
-                ((b3 & NXP_CMD_SYSTEM_INFO_FLAG_INTERFACE_MASK) >> NXP_CMD_SYSTEM_INFO_FLAG_INTERFACE_SHIFT), 
-                "unknown"),
-            "num_keys": b3 & NXP_CMD_SYSTEM_INFO_FLAG_NUM_KEYS_MASK
-        }
-
+        res = NXP_INFO_MAP.decode_bytes(data)
         if res["features"]["extended_flags_present"]:
             res["extended_feature_flags_raw"] = data[7:11]
 
         return res
 
     def read_config_block(self, address, num_blocks = 1):
+        return self.transmit(self.read_config_frame(address, num_blocks))
+
+    def read_config_frame(self, address, num_blocks = 1):
         # The base command always reads one block more than specified
         if(num_blocks < 1):
             raise Exception("Must read at least one block")
-        data = self.reader.transmit_iso15693(
-            bytes([ISO_FLAG_DATA_RATE, NXP_CMD_READ_CONFIG, NXP_CMD_MANUF_CODE_NXP, 
-                address, num_blocks - 1]))
-        return data
+        return bytes([ISO_FLAG_DATA_RATE, NXP_CMD_READ_CONFIG, NXP_CMD_MANUF_CODE_NXP, 
+            address, num_blocks - 1])
 
-    def get_config_info(self):
-        config = self.read_config_block(NXP_CONFIG_ADDR_CONFIG)
-
-        b0, b1, b2 = config[:3]
-        res = {} 
-       
-        # Byte 0
-        res["auto_standby_mode_enabled"] = bool(b0 & NXP_CONFIG_0_AUTO_STANDBY_MODE_EN)
-        res["lock_session_register"] = bool(b0 & NXP_CONFIG_0_LOCK_SESSION_REG)
-
-        eh_mode = b0 & NXP_CONFIG_0_EH_MODE_HIGH_FIELD_STRENGTH # mask includes all eh mode bits
-        if eh_mode == NXP_CONFIG_0_EH_MODE_LOW_FIELD_STRENGTH:
-            res["energy_harvesting_mode"] = "low_field_strength"
-        elif eh_mode == NXP_CONFIG_0_EH_MODE_HIGH_FIELD_STRENGTH:
-            res["energy_harvesting_mode"] = "high_field_strength"
-        elif eh_mode == NXP_CONFIG_0_EH_MODE_RFU0:
-            res["energy_harvesting_mode"] = "rfu0"
-        elif eh_mode == NXP_CONFIG_0_EH_MODE_RFU1:
-            res["energy_harvesting_mode"] = "rfu1"
-        
-        res["sram_copy_enabled"] = bool(b0 & NXP_CONFIG_0_SRAM_COPY_EN)
-
-        # Byte 1
-        res["pt_transfer_direction"] = "reader_to_tag" if (b1 & NXP_CONFIG_1_PT_TRANSFER_DIR) else "tag_to_reader"
-        res["sram_enabled"] = bool(b1 & NXP_CONFIG_1_SRAM_ENABLE)
-
-        arbiter_mode = b1 & NXP_CONFIG_1_ARBITER_MODE_SRAM_PHDC # mask includes all arbiter bits
-        arbiter_map = {
-            NXP_CONFIG_1_ARBITER_MODE_NORMAL: "normal",
-            NXP_CONFIG_1_ARBITER_MODE_SRAM_MIRROR: "sram_mirror",
-            NXP_CONFIG_1_ARBITER_MODE_SRAM_PASSTHROUGH: "sram_passthrough",
-            NXP_CONFIG_1_ARBITER_MODE_SRAM_PHDC: "sram_phdc",
-        }
-        res["arbiter_mode"] = arbiter_map.get(arbiter_mode, "unknown")
-
-        use_case = b1 & NXP_CONFIG_1_USE_CASE_CONF_TRISTATE # mask includes all use case bits
-        use_case_map = {
-            NXP_CONFIG_1_USE_CASE_CONF_I2C_SLAVE: "i2c_slave",
-            NXP_CONFIG_1_USE_CASE_CONF_I2C_MASTER: "i2c_master",
-            NXP_CONFIG_1_USE_CASE_CONF_GPIO_PWM: "gpio_pwm",
-            NXP_CONFIG_1_USE_CASE_CONF_TRISTATE: "tristate",
-        }
-        res["use_case"] = use_case_map.get(use_case, "unknown")
-        res["eh_arbiter_mode_enabled"] = bool(b1 & NXP_CONFIG_1_EH_ARBITER_MODE_EN)
-
-        # Byte 2
-        res["gpio0_slew_rate"] = "fast" if (b2 & NXP_CONFIG_2_GPIO0_SLEW_RATE) else "normal"
-        res["gpio1_slew_rate"] = "fast" if (b2 & NXP_CONFIG_2_GPIO1_SLEW_RATE) else "normal"
-        res["lock_block_command_supported"] = bool(b2 & NXP_CONFIG_2_LOCK_BLOCK_COMMAND_SUPPORTED)
-        res["extended_commands_supported"] = bool(b2 & NXP_CONFIG_2_EXTENDED_COMMANDS_SUPPORTED)
-
-        gpio0_pad = b2 & NXP_CONFIG_2_GPIO0_PAD_IN_PLAIN_PULLDOWN # full mask for GPIO0 pad
-        gpio0_pad_map = {
-            NXP_CONFIG_2_GPIO0_PAD_IN_DISABLED: "disabled",
-            NXP_CONFIG_2_GPIO0_PAD_IN_PLAIN_PULLUP: "plain_pullup",
-            NXP_CONFIG_2_GPIO0_PAD_IN_PLAIN: "plain",
-            NXP_CONFIG_2_GPIO0_PAD_IN_PLAIN_PULLDOWN: "plain_pulldown",
-        }
-        res["gpio0_pad_in"] = gpio0_pad_map.get(gpio0_pad, "unknown")
-
-        gpio1_pad = b2 & NXP_CONFIG_2_GPIO1_PAD_IN_PLAIN_PULLDOWN # full mask for GPIO1 pad
-        gpio1_pad_map = {
-            NXP_CONFIG_2_GPIO1_PAD_IN_DISABLED: "disabled",
-            NXP_CONFIG_2_GPIO1_PAD_IN_PLAIN_PULLUP: "plain_pullup",
-            NXP_CONFIG_2_GPIO1_PAD_IN_PLAIN: "plain",
-            NXP_CONFIG_2_GPIO1_PAD_IN_PLAIN_PULLDOWN: "plain_pulldown",
-        }
-        res["gpio1_pad_in"] = gpio1_pad_map.get(gpio1_pad, "unknown")
+    def read_cached_config_block(self, address):
+        # Persistent config block as last read, only writes through this class change it
+        return self._query(f"config_{address:02x}", self.read_config_frame(address))
 
-        return res
+    def get_config_info(self):
+        return NXP_CONFIG_MAP.decode_bytes(self.read_cached_config_block(NXP_CONFIG_ADDR_CONFIG))
 
     def get_eh_ed_config_info(self):
-        config = self.read_config_block(NXP_CONFIG_ADDR_EH_CONFIG)
-
-        res = {}
-
-        i_sel_lookup = {
-            NXP_EH_CONFIG_EH_VOUT_I_SEL_0_4: "0.4",
-            NXP_EH_CONFIG_EH_VOUT_I_SEL_0_6: "0.6",
-            NXP_EH_CONFIG_EH_VOUT_I_SEL_1_4: "1.4",
-            NXP_EH_CONFIG_EH_VOUT_I_SEL_2_7: "2.7",
-            NXP_EH_CONFIG_EH_VOUT_I_SEL_4_0: "4.0",
-            NXP_EH_CONFIG_EH_VOUT_I_SEL_6_5: "6.5",
-            NXP_EH_CONFIG_EH_VOUT_I_SEL_9_0: "9.0",
-            NXP_EH_CONFIG_EH_VOUT_I_SEL_12_5: "12.5"
-        }
-
-        res["eh_vout_i_sel"] = i_sel_lookup.get(config[0] & NXP_EH_CONFIG_EH_VOUT_I_SEL_12_5, "unknown") # Full mask for EH_VOUT_I_SEL
-        res["disable_power_check"] = bool(config[0] & NXP_EH_CONFIG_DISABLE_POWER_CHECK)
-        
-        v_sel_lookup = {
-            NXP_EH_CONFIG_EH_VOUT_V_SEL_1_8: "1.8",
-            NXP_EH_CONFIG_EH_VOUT_V_SEL_2_4: "2.4",
-            NXP_EH_CONFIG_EH_VOUT_V_SEL_3_0: "3.0",
-            NXP_EH_CONFIG_EH_VOUT_V_SEL_RFU: "RFU"
-        }
-        
-        res["eh_vout_v_sel"] = v_sel_lookup.get(config[0] & NXP_EH_CONFIG_EH_VOUT_V_SEL_RFU, "unknown") # Full mask for EH_VOUT_V_SEL
-        res["eh_enable"] = bool(config[0] & NXP_EH_CONFIG_EH_ENABLE)
-
-        ed_config_lookup = {
-            NXP_ED_CONFIG_DISABLE: "disable",
-            NXP_ED_CONFIG_NFC_FIELD_DETECT: "nfc_field_detect",
-            NXP_ED_CONFIG_PWM: "pwm",
-            NXP_ED_CONFIG_I2C_TO_NFC_PASS_THROUGH: "i2c_to_nfc_pass_through",
-            NXP_ED_CONFIG_NFC_TO_I2C_PASS_THROUGH: "nfc_to_i2c_pass_through",
-            NXP_ED_CONFIG_ARBITER_LOCK: "arbiter_lock",
-            NXP_ED_CONFIG_NDEF_MSG_TLV_LENGTH: "ndef_msg_tlv_length",
-            NXP_ED_CONFIG_STANDBY_MODE: "standby_mode",
-            NXP_ED_CONFIG_WRITE_CMD_INDICATION: "write_cmd_indication",
-            NXP_ED_CONFIG_READ_CMD_INDICATION: "read_cmd_indication",
-            NXP_ED_CONFIG_START_OF_COMMAND_INDICATION: "start_of_command_indication",
-            NXP_ED_CONFIG_READ_FROM_SYNCH_BLOCK: "read_from_synch_block",
-            NXP_ED_CONFIG_WRITE_TO_SYNCH_BLOCK: "write_to_synch_block",
-            NXP_ED_CONFIG_SOFTWARE_INTERRUPT: "software_interrupt",
-            NXP_ED_CONFIG_RFU1: "rfu1",
-            NXP_ED_CONFIG_RFU2: "rfu2"
-        }
-
-        res["ed_config"] = ed_config_lookup.get(config[2] & NXP_ED_CONFIG_RFU2, "unknown") # Full mask for ED_CONFIG
-
-        return res
+        return NXP_EH_ED_CONFIG_MAP.decode_bytes(self.read_cached_config_block(NXP_CONFIG_ADDR_EH_CONFIG))
 
     def write_config_block(self, address, block_data):
         if(len(block_data) != 4):
             raise Exception("Block data must be four bytes")
-        self.reader.transmit_iso15693(
+        self.invalidate_session()
+        self._config_written(address)
+        self.transmit(
             bytes([ISO_FLAG_DATA_RATE, NXP_CMD_WRITE_CONFIG, NXP_CMD_MANUF_CODE_NXP, 
                 address]) + block_data, True)
 
@@ -354,13 +346,18 @@ class NTAG5Link(ISO15693):
         # Read the existing config page
         config = list(self.read_config_block(NXP_CONFIG_ADDR_CONFIG))
         # Construct new CONFIG_0 and update page
-        config[0] = (
+        config[0] = self.build_config0(auto_standby_mode_en, lock_session_reg, eh_mode, sram_copy_en)
+        self.write_config_block(NXP_CONFIG_ADDR_CONFIG, bytes(config))
+
+    @staticmethod
+    def build_config0(auto_standby_mode_en = False, lock_session_reg = False,
+            eh_mode = NXP_CONFIG_0_EH_MODE_LOW_FIELD_STRENGTH, sram_copy_en = False):
+        return (
             (NXP_CONFIG_0_AUTO_STANDBY_MODE_EN if auto_standby_mode_en else 0x00) |
             (NXP_CONFIG_0_LOCK_SESSION_REG if lock_session_reg else 0x00) |
             eh_mode |
             (NXP_CONFIG_0_SRAM_COPY_EN if sram_copy_en else 0x00)
         )
-        self.write_config_block(NXP_CONFIG_ADDR_CONFIG, bytes(config))
 
     def write_config1(self, transfer_dir_inverse = False, sram_enable = False, 
             arbiter_mode = NXP_CONFIG_1_ARBITER_MODE_NORMAL, use_case = NXP_CONFIG_1_USE_CASE_CONF_I2C_SLAVE, 
@@ -368,14 +365,20 @@ class NTAG5Link(ISO15693):
         # Read the existing config page
         config = list(self.read_config_block(NXP_CONFIG_ADDR_CONFIG))
         # Construct new CONFIG_1 and update page
-        config[1] = (
+        config[1] = self.build_config1(transfer_dir_inverse, sram_enable, arbiter_mode, use_case, arbiter_mode_en)
+        self.write_config_block(NXP_CONFIG_ADDR_CONFIG, bytes(config))
+
+    @staticmethod
+    def build_config1(transfer_dir_inverse = False, sram_enable = False, 
+            arbiter_mode = NXP_CONFIG_1_ARBITER_MODE_NORMAL, use_case = NXP_CONFIG_1_USE_CASE_CONF_I2C_SLAVE, 
+            arbiter_mode_en = False):
+        return (
             (NXP_CONFIG_1_PT_TRANSFER_DIR if transfer_dir_inverse else 0x00) |
             (NXP_CONFIG_1_SRAM_ENABLE if sram_enable else 0x00) |
             arbiter_mode |
             use_case |
             (NXP_CONFIG_1_EH_ARBITER_MODE_EN if arbiter_mode_en else 0x00)
         )
-        self.write_config_block(NXP_CONFIG_ADDR_CONFIG, bytes(config))
 
     def write_config2(self, gpio0_slew_rate_fast=True, gpio1_slew_rate_fast=True,
             lock_block_supported=True, extended_commands_supported=True,
@@ -383,7 +386,15 @@ class NTAG5Link(ISO15693):
         # Read the existing config block
         config = list(self.read_config_block(NXP_CONFIG_ADDR_CONFIG))
         # Construct new CONFIG_2 byte
-        config[2] = (
+        config[2] = self.build_config2(gpio0_slew_rate_fast, gpio1_slew_rate_fast,
+            lock_block_supported, extended_commands_supported, gpio0_in, gpio1_in)
+        self.write_config_block(NXP_CONFIG_ADDR_CONFIG, bytes(config))
+
+    @staticmethod
+    def build_config2(gpio0_slew_rate_fast=True, gpio1_slew_rate_fast=True,
+            lock_block_supported=True, extended_commands_supported=True,
+            gpio0_in=NXP_CONFIG_2_GPIO0_PAD_IN_PLAIN_PULLDOWN, gpio1_in=NXP_CONFIG_2_GPIO1_PAD_IN_PLAIN_PULLDOWN):
+        return (
             (NXP_CONFIG_2_GPIO0_SLEW_RATE if gpio0_slew_rate_fast else 0x00) |
             (NXP_CONFIG_2_GPIO1_SLEW_RATE if gpio1_slew_rate_fast else 0x00) |
             (NXP_CONFIG_2_LOCK_BLOCK_COMMAND_SUPPORTED if lock_block_supported else 0x00) |
@@ -391,69 +402,175 @@ class NTAG5Link(ISO15693):
             gpio0_in |
             gpio1_in
         )
-        self.write_config_block(NXP_CONFIG_ADDR_CONFIG, bytes(config))
 
     def write_eh_ed_config(self, enable = False, disable_power_check = False, 
             current = NXP_EH_CONFIG_EH_VOUT_I_SEL_0_4, voltage = NXP_EH_CONFIG_EH_VOUT_V_SEL_1_8,
             ed_config = NXP_ED_CONFIG_DISABLE):
+        self.write_config_block(NXP_CONFIG_ADDR_EH_CONFIG,
+            self.build_eh_ed_config(enable, disable_power_check, current, voltage, ed_config))
+
+    @staticmethod
+    def build_eh_ed_config(enable = False, disable_power_check = False, 
+            current = NXP_EH_CONFIG_EH_VOUT_I_SEL_0_4, voltage = NXP_EH_CONFIG_EH_VOUT_V_SEL_1_8,
+            ed_config = NXP_ED_CONFIG_DISABLE):
         # Construct EH_CONFIG
         eh_config = (NXP_EH_ENABLE if enable else 0x00) | \
             (NXP_EH_CONFIG_DISABLE_POWER_CHECK if disable_power_check else 0x00) | \
             voltage | current
-        self.write_config_block(NXP_CONFIG_ADDR_EH_CONFIG, bytes([eh_config, 0x00, ed_config, 0x00]))
+        return bytes([eh_config, 0x00, ed_config, 0x00])
+
+    def _read_config_blocks(self, addresses):
+        # Read several config blocks in one batch, failed reads are repeated on their own
+        results = self.transmit_batch([ self.read_config_frame(address) for address in addresses ])
+        return { address: bytes(result) if(isinstance(result, (bytes, bytearray))) else self.read_config_block(address)
+            for address, result in zip(addresses, results) }
+
+    def plan_config_profile(self, profile):
+        # A profile maps config block addresses to four target bytes, None keeps the current byte
+        # Returns (address, current, target) for every block that needs to be written
+        addresses = sorted(profile)
+        current = self._read_config_blocks(addresses)
+        plan = []
+        for address in addresses:
+            if(len(profile[address]) != 4):
+                raise Exception("Block profile must be four bytes")
+            target = bytes(current[address][i] if(value == None) else value
+                for i, value in enumerate(profile[address]))
+            if(target != current[address][:4]):
+                plan.append((address, current[address][:4], target))
+        return plan
+
+    def apply_config_profile(self, profile):
+        # Write every block of the profile that differs from the tag, each exactly once, then verify
+        plan = self.plan_config_profile(profile)
+        for address, current, target in plan:
+            self.write_config_block(address, target)
+        if(len(plan) > 0):
+            written = self._read_config_blocks([ address for address, _, _ in plan ])
+            for address, current, target in plan:
+                if(written[address][:4] != target):
+                    raise Exception(f"Config block 0x{address:02x} reads {written[address][:4].hex()} " +
+                        f"after writing {target.hex()}")
+        return plan
 
     def read_sram(self, address = 0x00, num_blocks = 1):
+        return self.transmit(self.read_sram_frame(address, num_blocks))
+
+    def read_sram_frame(self, address = 0x00, num_blocks = 1):
         # The base command always reads one block more than specified
         if(num_blocks < 1):
             raise Exception("Must read at least one block")
-        data = self.reader.transmit_iso15693(
-            bytes([ISO_FLAG_DATA_RATE, NXP_CMD_READ_SRAM, NXP_CMD_MANUF_CODE_NXP, 
-                address, num_blocks - 1]))
-        return data
+        return bytes([ISO_FLAG_DATA_RATE, NXP_CMD_READ_SRAM, NXP_CMD_MANUF_CODE_NXP, 
+            address, num_blocks - 1])
 
     def read_i2c(self, slave_address, num_bytes, stop_condition = True):
+        frame = self.read_i2c_frame(slave_address, num_bytes, stop_condition)
+        self._i2c_started()
+        return self.transmit(frame)
+
+    def read_i2c_frame(self, slave_address, num_bytes, stop_condition = True):
         # The base command always reads one block more than specified
         if(num_bytes < 1):
             raise Exception("Must read at least one byte")
         param = (slave_address & 0x7F) | (0x00 if stop_condition else 0x80)
-        data = self.reader.transmit_iso15693(
-            bytes([ISO_FLAG_DATA_RATE, NXP_CMD_READ_I2C, NXP_CMD_MANUF_CODE_NXP, 
-                param, num_bytes - 1]))
-        return data
+        return bytes([ISO_FLAG_DATA_RATE, NXP_CMD_READ_I2C, NXP_CMD_MANUF_CODE_NXP, 
+            param, num_bytes - 1])
 
     def write_i2c(self, slave_address, data, stop_condition = True):
+        frame = self.write_i2c_frame(slave_address, data, stop_condition)
+        self._i2c_started()
+        return self.transmit(frame)
+
+    def write_i2c_frame(self, slave_address, data, stop_condition = True):
         # The base command always writes one byte more than specified
         if(len(data) < 1):
             raise Exception("Must write at least one byte")
         param = (slave_address & 0x7F) | (0x00 if stop_condition else 0x80)
-        data = self.reader.transmit_iso15693(
-            bytes([ISO_FLAG_DATA_RATE, NXP_CMD_WRITE_I2C, NXP_CMD_MANUF_CODE_NXP, 
-                param, len(data) - 1]) + data)
-        return data
-
-    def check_i2c_write_result(self):
-        status = self.read_config_block(NXP_CONFIG_ADDR_I2C_M_STATUS_REG)
-        status = status[0]
+        return bytes([ISO_FLAG_DATA_RATE, NXP_CMD_WRITE_I2C, NXP_CMD_MANUF_CODE_NXP, 
+            param, len(data) - 1]) + bytes(data)
+
+    def transmit_batch(self, frames):
+        # Send several frames in as few reader transactions as possible
+        # Returns per frame the response data, the exception raised for it,
+        # or None if it was not sent because an earlier frame failed
+        if(any(frame[1] in (NXP_CMD_READ_I2C, NXP_CMD_WRITE_I2C) for frame in frames)):
+            self._i2c_started()
+        # A batch may both start I2C transactions and write the configuration
+        if(any(frame[1] == NXP_CMD_WRITE_CONFIG for frame in frames)):
+            self.invalidate_session()
+            for frame in frames:
+                if(frame[1] == NXP_CMD_WRITE_CONFIG):
+                    self._config_written(frame[3])
+        frames = [ self.address_frame(frame) for frame in frames ]
+        if(hasattr(self.reader, "transmit_iso15693_batch")):
+            return self.reader.transmit_iso15693_batch(frames)
+        results = []
+        for frame in frames:
+            try:
+                results.append(self.reader.transmit_iso15693(frame))
+            except Exception as e:
+                results.append(e)
+                break
+        return results + [ None ] * (len(frames) - len(results))
+
+    def _i2c_started(self):
+        # A new I2C transaction makes the master status and the session snapshot stale
+        self.i2c_idle = False
+        self.invalidate_session()
+
+    def invalidate_session(self):
+        self.session = None
+
+    def _config_written(self, address):
+        # A persistent config write may change any cached capability, e.g. extended command support
+        # Session registers are volatile and never cached, writing them keeps the cache entry
+        if(self.cache != None and address < NXP_SESSION_ADDR_FIRST):
+            self.cache.invalidate(self.uid)
+
+    def read_session(self, force = False):
+        # Fetch all session registers in one multi-block read, unless the last snapshot is still valid
+        now = time.monotonic()
+        if(force or self.session == None or now - self.session.timestamp >= self.session_validity):
+            self.session = SessionSnapshot(self.read_config_block(NXP_SESSION_ADDR_FIRST,
+                NXP_SESSION_ADDR_LAST - NXP_SESSION_ADDR_FIRST + 1), now)
+        return self.session
+
+    def read_i2c_status(self):
+        return self.parse_i2c_status(self.read_session().register(NXP_CONFIG_ADDR_I2C_M_STATUS_REG))
+
+    def parse_i2c_status(self, data):
+        # Extract the I2C master status from a session register read
+        status = data[0]
+        self.i2c_idle = (status & NXP_I2C_M_BUSY_MASK == 0x00)
+        return status
+
+    def check_i2c_write_result(self, status = None):
+        # An already fetched status can be passed in to save an exchange
+        if(status == None):
+            status = self.read_i2c_status()
         if(status & NXP_I2C_M_WDT_EXPIRED_MASK != 0x00):
-            raise Exception("WDT expired in last transaction")
+            raise I2CWatchdogError("WDT expired in last transaction")
         trans_status = status & NXP_I2C_M_TRANS_STATUS_MASK
         if(trans_status == NXP_I2C_M_TRANS_STATUS_RESET):
-            raise Exception("Transaction status has been reset")
+            raise I2CError("Transaction status has been reset")
         if(trans_status == NXP_I2C_M_TRANS_STATUS_ADDRESS_NAK):
-            raise Exception("Address was not acknowledged")
+            raise I2CNakError("Address was not acknowledged")
         elif(trans_status == NXP_I2C_M_TRANS_STATUS_DATA_NAK):
-            raise Exception("Data was not acknowledged")
+            raise I2CNakError("Data was not acknowledged")
         elif(trans_status == NXP_I2C_M_TRANS_STATUS_SUCCESS):
             return True
         return False
     
-    def check_i2c_busy(self):
-        status = self.read_config_block(NXP_CONFIG_ADDR_I2C_M_STATUS_REG)
-        status = status[0]
+    def check_i2c_busy(self, status = None):
+        if(status == None):
+            status = self.read_i2c_status()
         return (status & NXP_I2C_M_BUSY_MASK != 0x00)
 
-    def eh_control(self, trigger = True, enable = True):
-        flags = 0x00
+    def eh_control(self, trigger = True, enable = True, 
+            current = NXP_EH_CONFIG_EH_VOUT_I_SEL_0_4, voltage = NXP_EH_CONFIG_EH_VOUT_V_SEL_1_8):
+        # The session register takes the same output current and voltage selection as EH_CONFIG,
+        # which applies them right away without an EEPROM write
+        flags = current | voltage
         if(trigger):
             flags |= NXP_EH_TRIGGER
         if(enable):
@@ -462,7 +579,6 @@ class NTAG5Link(ISO15693):
             flags, 0x00, 0x00, 0x00
         ]))
 
-    def check_eh_load_ok(self):
-        status = self.read_config_block(NXP_CONFIG_ADDR_EH_CONFIG_REG)
-        status = status[0]
+    def check_eh_load_ok(self, force = False):
+        status = self.read_session(force).eh_config()
         return (status & NXP_EH_LOAD_OK == NXP_EH_LOAD_OK)
@@ -0,0 +1,52 @@
+import time, math
+
+# Polls per conversion time while waiting for a late result
+ONESHOT_RETRIES =                   4
+# Polls without a result before the conversion is considered lost and started again
+ONESHOT_RETRY_LIMIT =               3 * ONESHOT_RETRIES
+# Default time between two oneshot conversions, in seconds
+ONESHOT_PERIOD =                    2.0
+
+
+class OneshotScheduler:
+    def __init__(self, device, period = ONESHOT_PERIOD):
+        # Device with prepare_oneshot(), trigger_oneshot() and read_temperature()
+        self.device = device
+        self.period = period
+        # Conversions that could not start on their deadline and were skipped
+        self.missed = 0
+        # Conversions whose result never showed up and that were started again
+        self.lost = 0
+
+    def run(self):
+        # Generator of (temperature or None, seconds to wait before continuing)
+        # Conversions start on a fixed grid of deadlines, so slow exchanges do not shift the later ones
+        conversion = self.device.prepare_oneshot()
+        retry = conversion / ONESHOT_RETRIES
+        deadline = time.monotonic()
+        while(True):
+            self.device.trigger_oneshot()
+            # The conversion started during the trigger exchange, its result is due one conversion time later
+            wait = conversion
+            triggered = time.monotonic()
+            reading = None
+            for poll in range(ONESHOT_RETRY_LIMIT + 1):
+                yield (None, max(0.0, triggered + wait - time.monotonic()))
+                reading = self.device.read_temperature()
+                if(reading != None):
+                    break
+                wait += retry
+            if(reading == None):
+                # The device does not convert again by itself, trigger a new conversion right away
+                self.lost += 1
+                continue
+            now = time.monotonic()
+            deadline += self.period
+            if(self.period <= 0):
+                deadline = now
+            elif(deadline < now):
+                # Skip the deadlines that already passed instead of bunching conversions up
+                skipped = math.ceil((now - deadline) / self.period)
+                self.missed += skipped
+                deadline += skipped * self.period
+            yield (reading, deadline - now)
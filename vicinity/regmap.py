@@ -0,0 +1,198 @@
+# Bitfields of a device's registers, described once per device
+# Decoding and encoding run through functions compiled from the description when the map is built
+
+
+class Field:
+    # Common part of the field kinds, each provides decoder(), encode() and decode_array()
+    def __init__(self, name, register, mask):
+        # The name is the path in the decoded record, dots nest it, e.g. "status_flags.data_ready"
+        self.name = name
+        self.path = tuple(name.split("."))
+        self.register = register
+        self.mask = mask
+        # Position of the lowest bit of the field
+        self.shift = (mask & -mask).bit_length() - 1 if(mask != 0) else 0
+
+
+class Flag(Field):
+    def decoder(self, width, byteorder):
+        mask = self.mask
+        return lambda value: bool(value & mask)
+
+    def encode(self, value, width, byteorder):
+        return self.mask if(value) else 0
+
+    def decode_array(self, values, np, width, byteorder):
+        return (values & self.mask) != 0
+
+
+class Enum(Field):
+    def __init__(self, name, register, mask, values, default = "unknown"):
+        # Values are keyed by the masked field bits in place, as the flag constants are defined
+        super().__init__(name, register, mask)
+        self.values = dict(values)
+        self.default = default
+        # Several bit patterns may decode to the same value, the first one is written back
+        self.encodings = {}
+        for bits, value in self.values.items():
+            self.encodings.setdefault(value, bits)
+        self.table = None
+
+    def decoder(self, width, byteorder):
+        values, default, mask = self.values, self.default, self.mask
+        return lambda value: values.get(value & mask, default)
+
+    def encode(self, value, width, byteorder):
+        if(value not in self.encodings):
+            raise Exception(f"Unknown value {value} for register field {self.name}")
+        return self.encodings[value]
+
+    def decode_array(self, values, np, width, byteorder):
+        if(self.table is None):
+            # Lookup table over every possible field value, built on first use
+            self.table = np.array([ self.values.get(bits << self.shift, self.default)
+                for bits in range((self.mask >> self.shift) + 1) ])
+        return self.table[(values & self.mask) >> self.shift]
+
+
+class Number(Field):
+    def __init__(self, name, register, mask, signed = False, scale = None, divisor = None):
+        # Integer field, two's complement if signed, converted to value * scale / divisor if scaled
+        super().__init__(name, register, mask)
+        self.signed = signed
+        self.scale = scale
+        self.divisor = divisor if(divisor != None) else 1
+        self.bits = (mask >> self.shift).bit_length()
+
+    def decoder(self, width, byteorder):
+        mask, shift, scale, divisor = self.mask, self.shift, self.scale, self.divisor
+        if(not self.signed and scale == None):
+            return lambda value: (value & mask) >> shift
+        sign = (1 << (self.bits - 1)) if(self.signed) else 0
+        offset = 1 << self.bits
+        def decode(value):
+            value = (value & mask) >> shift
+            if(value & sign):
+                value -= offset
+            return value if(scale == None) else (value * scale) / divisor
+        return decode
+
+    def encode(self, value, width, byteorder):
+        if(self.scale != None):
+            value = round(value * self.divisor / self.scale)
+        return (value << self.shift) & self.mask
+
+    def decode_array(self, values, np, width, byteorder):
+        values = (values & self.mask) >> self.shift
+        if(self.signed):
+            values = np.where(values & (1 << (self.bits - 1)), values - (1 << self.bits), values)
+        if(self.scale == None):
+            return values
+        return (values * self.scale) / self.divisor
+
+
+class Raw(Field):
+    def __init__(self, name, register):
+        # Unparsed register content as bytes
+        super().__init__(name, register, 0)
+
+    def decoder(self, width, byteorder):
+        return lambda value: value.to_bytes(width, byteorder = byteorder)
+
+    def encode(self, value, width, byteorder):
+        return int.from_bytes(value, byteorder = byteorder)
+
+    def decode_array(self, values, np, width, byteorder):
+        # Void instead of bytes strings, those would drop trailing zero bytes
+        return values.astype(f"{'>' if(byteorder == 'big') else '<'}u{width}").view(f"V{width}")
+
+
+class RegisterMap:
+    def __init__(self, fields, width = 1, byteorder = "big", block_size = None):
+        # Registers are width bytes wide. Maps of a block, e.g. a configuration block or a command response,
+        # address their registers by byte offset into the block instead of by register address
+        self.fields = fields
+        self.width = width
+        self.byteorder = byteorder
+        self.registers = sorted(set(field.register for field in fields))
+        self.by_name = { field.name: field for field in fields }
+        # Byte offset of each register in a record, registers follow each other in address order if not a block
+        if(block_size != None):
+            self.offsets = { register: register * width for register in self.registers }
+            self.record_size = block_size
+        else:
+            self.offsets = { register: index * width for index, register in enumerate(self.registers) }
+            self.record_size = len(self.registers) * width
+        self.decoders = [ (field.path, field.register, field.decoder(width, byteorder)) for field in fields ]
+
+    def decode(self, registers):
+        # Decode register contents keyed by register address into nested dicts, in field order
+        values = { register: int.from_bytes(registers[register], byteorder = self.byteorder) for register in self.registers }
+        res = {}
+        for path, register, decoder in self.decoders:
+            target = res
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = decoder(values[register])
+        return res
+
+    def decode_bytes(self, data):
+        # Decode one record, e.g. a block read from the tag
+        return self.decode({ register: data[offset:offset + self.width] for register, offset in self.offsets.items() })
+
+    def encode(self, values, registers = None):
+        # Encode field values keyed by field name on top of the given register contents
+        # Returns the content of every given or changed register, keyed by register address
+        res = { register: int.from_bytes(data, byteorder = self.byteorder) for register, data in (registers or {}).items() }
+        for name, value in values.items():
+            field = self.by_name[name]
+            bits = field.encode(value, self.width, self.byteorder)
+            if(field.mask == 0):
+                res[field.register] = bits
+            else:
+                res[field.register] = (res.get(field.register, 0) & ~field.mask) | bits
+        return { register: value.to_bytes(self.width, byteorder = self.byteorder) for register, value in res.items() }
+
+    def dtype(self, np):
+        # Nested structured dtype matching the dicts returned by decode
+        tree = {}
+        for field in self.fields:
+            target = tree
+            for key in field.path[:-1]:
+                target = target.setdefault(key, {})
+            target[field.path[-1]] = field
+        return np.dtype(self._dtype_spec(tree, np))
+
+    def _dtype_spec(self, tree, np):
+        spec = []
+        for key, node in tree.items():
+            if(isinstance(node, dict)):
+                spec.append((key, self._dtype_spec(node, np)))
+            else:
+                spec.append((key, node.decode_array(np.zeros(1, dtype = np.int64), np, self.width, self.byteorder).dtype))
+        return spec
+
+    def decode_array(self, records):
+        # Decode many records at once into a NumPy structured array with the same nesting as decode
+        # Records are back to back in a bytes-like object or in an array of bytes, laid out as for decode_bytes
+        # NumPy is only needed here, the single record paths do without it
+        import numpy as np
+        if(isinstance(records, (bytes, bytearray, memoryview))):
+            data = np.frombuffer(records, dtype = np.uint8)
+        else:
+            data = np.asarray(records, dtype = np.uint8)
+        data = data.reshape(-1, self.record_size)
+        order = list(range(self.width)) if(self.byteorder == "big") else list(reversed(range(self.width)))
+        values = {}
+        for register, offset in self.offsets.items():
+            column = np.zeros(len(data), dtype = np.int64)
+            for index in order:
+                column = (column << 8) | data[:, offset + index]
+            values[register] = column
+        res = np.empty(len(data), dtype = self.dtype(np))
+        for field in self.fields:
+            target = res
+            for key in field.path[:-1]:
+                target = target[key]
+            target[field.path[-1]] = field.decode_array(values[field.register], np, self.width, self.byteorder)
+        return res
@@ -0,0 +1,95 @@
+import os
+
+from .tagcache import JsonStore
+
+# Default location of the recorded sensor sessions
+SESSION_FILE = os.path.join(os.path.expanduser("~"), ".cache", "ntag5sensor", "sessions.json")
+
+
+class SessionStore(JsonStore):
+    def __init__(self, path = SESSION_FILE):
+        # Configuration steps done per sensor, keyed by reader name and tag UID
+        super().__init__(path)
+
+    @staticmethod
+    def key(reader_name, uid):
+        return f"{reader_name}/{uid.hex()}"
+
+    def get(self, key):
+        with self.lock:
+            return dict(self.entries.get(key, {}))
+
+    def put(self, key, state):
+        with self.lock:
+            self.entries[key] = state
+            self.save()
+
+
+class ConfigStep:
+    def __init__(self, name, apply, value, register = None, mask = None):
+        # One configuration step and the register bytes it leaves behind, compared under the mask
+        # Steps without a register, e.g. parameter RAM writes, cannot be read back
+        self.name = name
+        self.apply = apply
+        self.value = bytes(value)
+        self.register = register
+        self.mask = bytes(mask) if(mask != None) else bytes([0xFF] * len(self.value))
+
+    def holds(self, data):
+        return all(current & mask == value & mask for current, value, mask in zip(data, self.value, self.mask))
+
+
+class SensorSession:
+    def __init__(self, device, name, steps, store = None, key = None):
+        # Configuration of one sensor, recorded in the store so a later session only redoes what is missing
+        # Without a store the record only lives as long as this object, e.g. across harvesting re-arms
+        self.device = device
+        self.sensor = f"{name}@{device.address}"
+        self.steps = steps
+        self.store = store
+        self.key = key
+        self.state = store.get(key) if(store != None) else {}
+        # Names of the steps done by the last resume
+        self.redone = []
+
+    def _recorded(self):
+        # Steps recorded for this sensor with the same target value as now
+        if(self.state.get("sensor") != self.sensor):
+            return set()
+        values = self.state.get("steps", {})
+        return set(step.name for step in self.steps if values.get(step.name) == step.value.hex())
+
+    def _verify(self, recorded):
+        # Read the registers of all recorded steps at once, returns the names of the steps that still hold
+        readable = [ step for step in self.steps if step.register != None and step.name in recorded ]
+        if(len(readable) == 0):
+            return set()
+        data = self.device.read_registers([ step.register for step in readable ])
+        held = set(step.name for step in readable if step.holds(data[step.register]))
+        if(len(held) == len(readable)):
+            # Steps that cannot be read back are trusted as long as every readable step holds,
+            # the sensor resets them all together when it loses power
+            held |= recorded
+        return held
+
+    def _record(self, state):
+        self.state = state
+        if(self.store != None):
+            self.store.put(self.key, state)
+
+    def resume(self):
+        # Verify the recorded steps with one register read and redo only the missing ones, in order
+        # The sensor may have lost power since the last resume, forget the register values known from before
+        self.device.invalidate_shadow()
+        recorded = self._recorded()
+        held = self._verify(recorded)
+        self.redone = [ step.name for step in self.steps if step.name not in held ]
+        if(len(self.redone) == 0):
+            return self.redone
+        # Forget the record until all steps are done, a failed step must not be trusted later
+        self._record({})
+        for step in self.steps:
+            if(step.name not in held):
+                step.apply()
+        self._record({ "sensor": self.sensor, "steps": { step.name: step.value.hex() for step in self.steps } })
+        return self.redone
@@ -1,6 +1,7 @@
 import time
 
 from .i2cbase import I2CBase
+from .regmap import RegisterMap, Enum, Number
 
 
 SI1143_I2C_ADDRESS =                0x5A
@@ -223,6 +224,21 @@ SI1143_PS1_INT_FLAG =                0x04
 SI1143_ALS_INT_FLAG =                0x03
 SI1143_INT_CLEARED =                 0x00
 
+# Register map of the identification registers
+SI1143_REGISTER_MAP = RegisterMap([
+    Enum("part_id",                     SI1143_I2C_REG_PART_ID, 0xFF, {
+        SI1143_PART_ID_SI1141:          "Si1141",
+        SI1143_PART_ID_SI1142:          "Si1142",
+        SI1143_PART_ID_SI1143:          "Si1143" }, default = "Unknown"),
+    Number("rev_id",                    SI1143_I2C_REG_REV_ID, 0xFF),
+    Enum("seq_id",                      SI1143_I2C_REG_SEQ_ID, 0xFF, {
+        SI1143_SEQ_ID_A01:              "Si114x-A01",
+        SI1143_SEQ_ID_A02:              "Si114x-A02",
+        SI1143_SEQ_ID_A03:              "Si114x-A03",
+        SI1143_SEQ_ID_A10:              "Si114x-A10",
+        SI1143_SEQ_ID_A11:              "Si114x-A11" }, default = "Unknown"),
+])
+
 
 class SI1143(I2CBase):
     def __init__(self, ntag5link):
@@ -233,36 +249,8 @@ class SI1143(I2CBase):
         self.write_register(SI1143_I2C_REG_HW_KEY, [SI1143_HW_KEY_VALUE])
 
     def get_info(self):
-        res = {}
-
-        # Part, revision and sequencer information
-        part_id = self.read_register(SI1143_I2C_REG_PART_ID, 1)[0]
-        if(part_id == SI1143_PART_ID_SI1141):
-            res["part_id"] = "Si1141"
-        elif(part_id == SI1143_PART_ID_SI1142):
-            res["part_id"] = "Si1142"
-        elif(part_id == SI1143_PART_ID_SI1143):
-            res["part_id"] = "Si1143"
-        else:
-            res["part_id"] = "Unknown"
-        
-        res["rev_id"] = self.read_register(SI1143_I2C_REG_REV_ID, 1)[0]
-        
-        seq_id = self.read_register(SI1143_I2C_REG_SEQ_ID, 1)[0]
-        if(seq_id == SI1143_SEQ_ID_A01):
-            res["seq_id"] = "Si114x-A01"
-        elif(seq_id == SI1143_SEQ_ID_A02):
-            res["seq_id"] = "Si114x-A02"
-        elif(seq_id == SI1143_SEQ_ID_A03):
-            res["seq_id"] = "Si114x-A03"
-        elif(seq_id == SI1143_SEQ_ID_A10):
-            res["seq_id"] = "Si114x-A10"
-        elif(seq_id == SI1143_SEQ_ID_A11):
-            res["seq_id"] = "Si114x-A11"
-        else:
-            res["seq_id"] = "Unknown"
-
-        return res
+        # Part, revision and sequencer information, consecutive registers read in one burst
+        return SI1143_REGISTER_MAP.decode(self.read_registers(SI1143_REGISTER_MAP.registers))
 
     def command(self, command, param_w = None):
         # First, clear the response register by sensing a NOP command
@@ -0,0 +1,82 @@
+import os, json, threading
+
+# Default location of the tag capability cache
+TAG_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "ntag5sensor", "tags.json")
+
+# Response that identifies a tag and validates its cache entry, read again on every connect
+TAG_CACHE_VALIDATOR =                       "system_info"
+
+
+class JsonStore:
+    def __init__(self, path):
+        # Entries kept in a JSON file, shared by the threads of one process
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as file:
+                self.entries = json.load(file)
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError) as e:
+            print(f"warning: Ignoring unreadable file {self.path}: {e}")
+            self.entries = {}
+
+    def save(self):
+        # Replace the file in one step, an interrupted save must not leave a truncated file behind
+        directory = os.path.dirname(self.path)
+        if(directory != ""):
+            os.makedirs(directory, exist_ok = True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "w") as file:
+                json.dump(self.entries, file, indent = 1, sort_keys = True)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            print(f"warning: Could not write {self.path}: {e}")
+
+
+class TagCache(JsonStore):
+    def __init__(self, path = TAG_CACHE_FILE):
+        # Raw identification responses as hex strings, keyed by UID and response name
+        self.hits = 0
+        self.misses = 0
+        super().__init__(path)
+
+    def validate(self, uid, system_info):
+        # Keep the entry of a known tag if it still answers GET SYSTEM INFO identically,
+        # start a new entry otherwise. Returns True for a known tag
+        with self.lock:
+            key = uid.hex()
+            entry = self.entries.get(key)
+            if(entry != None and entry.get(TAG_CACHE_VALIDATOR) == system_info.hex()):
+                return True
+            self.entries[key] = { TAG_CACHE_VALIDATOR: system_info.hex() }
+            self.save()
+            return False
+
+    def get(self, uid, name):
+        with self.lock:
+            value = self.entries.get(uid.hex(), {}).get(name)
+            if(value == None):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return bytes.fromhex(value)
+
+    def put(self, uid, name, data):
+        with self.lock:
+            entry = self.entries.get(uid.hex())
+            if(entry == None):
+                # The entry was invalidated since the tag was identified, it is not trusted anymore
+                return
+            entry[name] = bytes(data).hex()
+            self.save()
+
+    def invalidate(self, uid):
+        with self.lock:
+            if(self.entries.pop(uid.hex(), None) != None):
+                self.save()
@@ -1,5 +1,6 @@
 import time
 from .i2cbase import I2CBase
+from .regmap import RegisterMap, Flag, Enum, Number
 
 # Register addresses
 TMP112_I2C_REG_TEMP_RESULT =            0x00
@@ -33,8 +34,48 @@ TMP112_CONFIG_FLAG_CONVERSION_1 =       (1 << 6)
 TMP112_CONFIG_FLAG_CONVERSION_4 =       (2 << 6)
 TMP112_CONFIG_FLAG_CONVERSION_8 =       (3 << 6)
 
+# Conversion time per resolution, in ms, with the longest one for unknown settings
+TMP112_CONVERSION_TIME = {
+    TMP112_CONFIG_FLAG_RESOLUTION_12:   26,
+}
+TMP112_CONVERSION_TIME_MAX =            35
+
+# Register map of the limit and configuration registers
+TMP112_REGISTER_MAP = RegisterMap([
+    Number("tlow_limit",                    TMP112_I2C_REG_TLOW_LIMIT, 0xFFF0, scale = 62.5, divisor = 1000.0),
+    Number("thigh_limit",                   TMP112_I2C_REG_THIGH_LIMIT, 0xFFF0, scale = 62.5, divisor = 1000.0),
+    Flag("shutdown_mode",                   TMP112_I2C_REG_CONFIG, TMP112_CONFIG_FLAG_SHUTDOWN_MODE),
+    Flag("thermostat_mode",                 TMP112_I2C_REG_CONFIG, TMP112_CONFIG_FLAG_THERMOSTAT_MODE),
+    Flag("alert_polarity_high",             TMP112_I2C_REG_CONFIG, TMP112_CONFIG_FLAG_ALERT_POL),
+    Flag("oneshot",                         TMP112_I2C_REG_CONFIG, TMP112_CONFIG_FLAG_ONESHOT),
+    Flag("extended_mode",                   TMP112_I2C_REG_CONFIG, TMP112_CONFIG_FLAG_EXTENDED_MODE),
+    Flag("alert",                           TMP112_I2C_REG_CONFIG, TMP112_CONFIG_FLAG_ALERT),
+    Enum("fault_queue",                     TMP112_I2C_REG_CONFIG, TMP112_CONFIG_FLAG_FAULT_QUEUE_MASK, {
+        TMP112_CONFIG_FLAG_FAULT_QUEUE_1:   1,
+        TMP112_CONFIG_FLAG_FAULT_QUEUE_2:   2,
+        TMP112_CONFIG_FLAG_FAULT_QUEUE_4:   4,
+        TMP112_CONFIG_FLAG_FAULT_QUEUE_6:   6 }, default = 0),
+    Enum("resolution",                      TMP112_I2C_REG_CONFIG, TMP112_CONFIG_FLAG_RESOLUTION_MASK, {
+        TMP112_CONFIG_FLAG_RESOLUTION_12:   "12 Bit" }, default = "Unknown"),
+    Enum("conversion_rate",                 TMP112_I2C_REG_CONFIG, TMP112_CONFIG_FLAG_CONV_RATE_MASK, {
+        TMP112_CONFIG_FLAG_CONVERSION_0_25: "0.25 Hz",
+        TMP112_CONFIG_FLAG_CONVERSION_1:    "1 Hz",
+        TMP112_CONFIG_FLAG_CONVERSION_4:    "4 Hz",
+        TMP112_CONFIG_FLAG_CONVERSION_8:    "8 Hz" }, default = "Unknown"),
+], width = 2)
+
 
 class TMP112(I2CBase):
+    # 16 bit registers, the pointer stays on the addressed register
+    register_width = 2
+    auto_increment = False
+    # The conversion ready and alert flags are never served from the shadow
+    shadow_registers = {
+        TMP112_I2C_REG_CONFIG: TMP112_CONFIG_FLAG_ONESHOT | TMP112_CONFIG_FLAG_ALERT,
+        TMP112_I2C_REG_TLOW_LIMIT: 0x0000,
+        TMP112_I2C_REG_THIGH_LIMIT: 0x0000,
+    }
+
     def __init__(self, ntag5link, address):
         super().__init__(ntag5link, address)
 
@@ -42,72 +83,41 @@ class TMP112(I2CBase):
         return ((int.from_bytes(data, byteorder = "big", signed = False) >> 4) * 62.5) / 1000.0
 
     def get_config_info(self):
-        config = self.read_register(TMP112_I2C_REG_CONFIG, 2)
-        config = int.from_bytes(config[0:2], byteorder="big")
-
-        res = {}
-
-        # Limits
-        res["tlow_limit"] = self.raw_to_celsius(self.read_register(TMP112_I2C_REG_TLOW_LIMIT, 2))
-        res["thigh_limit"] = self.raw_to_celsius(self.read_register(TMP112_I2C_REG_THIGH_LIMIT, 2))
-
-        # Config flags
-        res["shutdown_mode"] = bool(config & TMP112_CONFIG_FLAG_SHUTDOWN_MODE)
-        res["thermostat_mode"] = bool(config & TMP112_CONFIG_FLAG_THERMOSTAT_MODE)
-        res["alert_polarity_high"] = bool(config & TMP112_CONFIG_FLAG_ALERT_POL)
-        res["oneshot"] = bool(config & TMP112_CONFIG_FLAG_ONESHOT)
-        res["extended_mode"] = bool(config & TMP112_CONFIG_FLAG_EXTENDED_MODE)
-        res["alert"] = bool(config & TMP112_CONFIG_FLAG_ALERT)
-
-        # Fault queue
-        fault_queue = config & TMP112_CONFIG_FLAG_FAULT_QUEUE_MASK
-        fault_queue_lookup = {
-            TMP112_CONFIG_FLAG_FAULT_QUEUE_1: 1,
-            TMP112_CONFIG_FLAG_FAULT_QUEUE_2: 2,
-            TMP112_CONFIG_FLAG_FAULT_QUEUE_4: 4,
-            TMP112_CONFIG_FLAG_FAULT_QUEUE_6: 6,
-        }
-        res["fault_queue"] = fault_queue_lookup.get(fault_queue, 0)
-
-        # Resolution
-        resolution = config & TMP112_CONFIG_FLAG_RESOLUTION_MASK
-        res["resolution"] = "12 Bit" if resolution == TMP112_CONFIG_FLAG_RESOLUTION_12 else "Unknown"
-
-        # Conversion rate
-        conv_rate = config & TMP112_CONFIG_FLAG_CONV_RATE_MASK
-        conv_rate_lookup = {
-            TMP112_CONFIG_FLAG_CONVERSION_0_25: "0.25 Hz",
-            TMP112_CONFIG_FLAG_CONVERSION_1: "1 Hz",
-            TMP112_CONFIG_FLAG_CONVERSION_4: "4 Hz",
-            TMP112_CONFIG_FLAG_CONVERSION_8: "8 Hz",
-        }
-        res["conversion_rate"] = conv_rate_lookup.get(conv_rate, "Unknown")
-
-        return res
-            
+        # All registers in one batch of I2C transactions
+        return TMP112_REGISTER_MAP.decode(self.read_registers(TMP112_REGISTER_MAP.registers))
+
     def write_config(self, shutdown_mode = False, oneshot = None):
-        # Read current values
-        config = self.read_register(TMP112_I2C_REG_CONFIG, 2)
-        config = int.from_bytes(config[0:2], byteorder="big")
-        
-        # Apply new parameters
+        # Apply new parameters on top of the current values, from the shadow if known
+        values = {}
         if(shutdown_mode != None):
-            config &= ~TMP112_CONFIG_FLAG_SHUTDOWN_MODE
-            config |= TMP112_CONFIG_FLAG_SHUTDOWN_MODE if shutdown_mode else 0x00
+            values["shutdown_mode"] = shutdown_mode
         if(oneshot != None):
-            config &= ~TMP112_CONFIG_FLAG_ONESHOT
-            config |= TMP112_CONFIG_FLAG_ONESHOT if oneshot else 0x00
-       
-        self.write_register(TMP112_I2C_REG_CONFIG, list(config.to_bytes(2, byteorder="big")))
-       
+            values["oneshot"] = oneshot
+        registers = TMP112_REGISTER_MAP.encode(values, { TMP112_I2C_REG_CONFIG: self.read_shadowed(TMP112_I2C_REG_CONFIG) })
+        self.write_register(TMP112_I2C_REG_CONFIG, list(registers[TMP112_I2C_REG_CONFIG]))
+
+    def prepare_oneshot(self):
+        # Returns the expected conversion time at the configured resolution, in seconds
+        config = int.from_bytes(self.read_shadowed(TMP112_I2C_REG_CONFIG), byteorder="big")
+        resolution = config & TMP112_CONFIG_FLAG_RESOLUTION_MASK
+        return TMP112_CONVERSION_TIME.get(resolution, TMP112_CONVERSION_TIME_MAX) / 1000.0
+
+    def trigger_oneshot(self):
+        # A single write, the rest of the configuration comes from the shadow
+        self.write_config(shutdown_mode = True, oneshot = True)
+
     def read_temperature(self):
-        config = self.read_register(TMP112_I2C_REG_CONFIG, 2)
-        config = int.from_bytes(config[0:2], byteorder="big")
+        config = int.from_bytes(self.read_shadowed(TMP112_I2C_REG_CONFIG), byteorder="big")
+        if(not bool(config & TMP112_CONFIG_FLAG_SHUTDOWN_MODE)):
+            # Converting continuously, the result register always holds the latest conversion
+            return self.raw_to_celsius(self.read_register(TMP112_I2C_REG_TEMP_RESULT, 2))
+        # CONFIG and TEMP_RESULT in one batch, the result is dropped while a oneshot conversion runs
+        registers = self.read_registers([ TMP112_I2C_REG_CONFIG, TMP112_I2C_REG_TEMP_RESULT ])
+        config = int.from_bytes(registers[TMP112_I2C_REG_CONFIG], byteorder="big")
         # Oneshot mode starts from shutdown
         if(bool(config & TMP112_CONFIG_FLAG_SHUTDOWN_MODE)):
             # OS = 0 during conversion, OS = 1 when finished
             if(not bool(config & TMP112_CONFIG_FLAG_ONESHOT)):
                 # Caller should try again, no data ready yet
                 return None
-        data = self.read_register(TMP112_I2C_REG_TEMP_RESULT, 2)
-        return self.raw_to_celsius(data)
+        return self.raw_to_celsius(registers[TMP112_I2C_REG_TEMP_RESULT])
@@ -1,5 +1,6 @@
 import time
 from .i2cbase import I2CBase
+from .regmap import RegisterMap, Flag, Enum, Number, Raw
 
 # Register addresses
 TMP117_I2C_REG_TEMP_RESULT =        0x00
@@ -42,118 +43,104 @@ TMP117_CONFIG_FLAG_MOD_ONESHOT =    (3 << 10)
 TMP117_DEVICE_ID_DID_MASK =         0x0FFF
 TMP117_DEVICE_ID_REV_MASK =         0xF000
 
+# Active conversion time of a oneshot conversion per averaging mode, in ms
+TMP117_CONVERSION_TIME = {
+    TMP117_CONFIG_FLAG_AVG_NONE:    15.5,
+    TMP117_CONFIG_FLAG_AVG_8:       125,
+    TMP117_CONFIG_FLAG_AVG_32:      500,
+    TMP117_CONFIG_FLAG_AVG_64:      1000,
+}
+
+# Time between two conversion results in continuous mode, in ms
+# One row per conversion cycle setting, one column per averaging mode from none to 64 samples
+TMP117_CONVERSION_CYCLES = [
+    (15.5,  125,   500,   1000),
+    (125,   125,   500,   1000),
+    (250,   250,   500,   1000),
+    (500,   500,   500,   1000),
+    (1000,  1000,  1000,  1000),
+    (4000,  4000,  4000,  4000),
+    (8000,  8000,  8000,  8000),
+    (16000, 16000, 16000, 16000),
+]
+# The same keyed by the conversion cycle and averaging bits of the config register
+TMP117_CONVERSION_CYCLE = { (cycle << 7) | (avg << 5): cycle_time
+    for cycle, times in enumerate(TMP117_CONVERSION_CYCLES) for avg, cycle_time in enumerate(times) }
+
+# Polls per conversion cycle while waiting for a late result when streaming
+TMP117_STREAM_RETRIES =             8
+
 # EEPROM unlock flags
 TMP117_EEPROM_UL_EUN =              (1 << 15)
 TMP117_EEPROM_UL_EEPROM_BUSY =      (1 << 14)
 
+# Register map of the configuration and identification registers
+TMP117_REGISTER_MAP = RegisterMap([
+    Flag("status_flags.high_alert",             TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_HIGH_ALERT),
+    Flag("status_flags.low_alert",              TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_LOW_ALERT),
+    Flag("status_flags.data_ready",             TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_DATA_READY),
+    Flag("status_flags.eeprom_busy",            TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_EEPROM_BUSY),
+    Enum("mode",                                TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_MOD_MASK, {
+        TMP117_CONFIG_FLAG_MOD_CONT:            "continuous",
+        TMP117_CONFIG_FLAG_MOD_SHUTDOWN:        "shutdown",
+        TMP117_CONFIG_FLAG_MOD_CONT2:           "continuous",
+        TMP117_CONFIG_FLAG_MOD_ONESHOT:         "one_shot" }),
+    Enum("averaging",                           TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_AVG_MASK, {
+        TMP117_CONFIG_FLAG_AVG_NONE:            "none",
+        TMP117_CONFIG_FLAG_AVG_8:               "8",
+        TMP117_CONFIG_FLAG_AVG_32:              "32",
+        TMP117_CONFIG_FLAG_AVG_64:              "64" }),
+    Enum("conversion_cycle",                    TMP117_I2C_REG_CONFIG,
+        TMP117_CONFIG_FLAG_CONV_MASK | TMP117_CONFIG_FLAG_AVG_MASK, TMP117_CONVERSION_CYCLE),
+    Flag("alert_config.therm_mode",             TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_TA_MODE),
+    Flag("alert_config.alert_polarity_high",    TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_ALERT_POL),
+    Flag("alert_config.alert_select_data_ready", TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_ALERT_SEL),
+    Flag("soft_reset",                          TMP117_I2C_REG_CONFIG, TMP117_CONFIG_FLAG_SOFT_RESET),
+    Number("thigh_limit",                       TMP117_I2C_REG_THIGH_LIMIT, 0xFFFF, signed = True, scale = 7.8125, divisor = 1000.0),
+    Number("tlow_limit",                        TMP117_I2C_REG_TLOW_LIMIT, 0xFFFF, signed = True, scale = 7.8125, divisor = 1000.0),
+    Raw("eeprom1",                              TMP117_I2C_REG_EEPROM1),
+    Raw("eeprom2",                              TMP117_I2C_REG_EEPROM2),
+    Raw("eeprom3",                              TMP117_I2C_REG_EEPROM3),
+    Number("temperature_offset",                TMP117_I2C_REG_TEMP_OFFSET, 0xFFFF, signed = True, scale = 7.8125, divisor = 1000.0),
+    Number("device_id.id",                      TMP117_I2C_REG_DEVICE_ID, TMP117_DEVICE_ID_DID_MASK),
+    Number("device_id.rev",                     TMP117_I2C_REG_DEVICE_ID, TMP117_DEVICE_ID_REV_MASK),
+], width = 2)
+
 
 class TMP117(I2CBase):
+    # 16 bit registers, the pointer stays on the addressed register
+    register_width = 2
+    auto_increment = False
+    # Status flags and the self-clearing reset bit are never served from the shadow
+    shadow_registers = {
+        TMP117_I2C_REG_CONFIG: TMP117_CONFIG_FLAG_HIGH_ALERT | TMP117_CONFIG_FLAG_LOW_ALERT |
+            TMP117_CONFIG_FLAG_DATA_READY | TMP117_CONFIG_FLAG_EEPROM_BUSY | TMP117_CONFIG_FLAG_SOFT_RESET,
+        TMP117_I2C_REG_THIGH_LIMIT: 0x0000,
+        TMP117_I2C_REG_TLOW_LIMIT: 0x0000,
+        TMP117_I2C_REG_TEMP_OFFSET: 0x0000,
+    }
+
     def __init__(self, ntag5link, address):
         super().__init__(ntag5link, address)
+        # A oneshot conversion was triggered and its result was not read yet
+        self.oneshot_pending = False
 
     def raw_to_celsius(self, data):
         return (int.from_bytes(data, byteorder = "big", signed = True) * 7.8125) / 1000.0
 
-    def get_config_info(self):
-        config = self.read_register(TMP117_I2C_REG_CONFIG, 2)
-        config = int.from_bytes(config[0:2], byteorder="big")
-
-        res = {}
-
-        # Status flags
-        res["status_flags"] = {
-            "high_alert": bool(config & TMP117_CONFIG_FLAG_HIGH_ALERT),
-            "low_alert": bool(config & TMP117_CONFIG_FLAG_LOW_ALERT),
-            "data_ready": bool(config & TMP117_CONFIG_FLAG_DATA_READY),
-            "eeprom_busy": bool(config & TMP117_CONFIG_FLAG_EEPROM_BUSY),
-        }
-
-        # Operating mode
-        mode_lookup = {
-            TMP117_CONFIG_FLAG_MOD_CONT: "continuous",
-            TMP117_CONFIG_FLAG_MOD_SHUTDOWN: "shutdown",
-            TMP117_CONFIG_FLAG_MOD_CONT2: "continuous",
-            TMP117_CONFIG_FLAG_MOD_ONESHOT: "one_shot",
-        }
-        mode_bits = config & TMP117_CONFIG_FLAG_MOD_MASK
-        res["mode"] = mode_lookup.get(mode_bits, "unknown")
-
-        # Averaging
-        avg_lookup = {
-            TMP117_CONFIG_FLAG_AVG_NONE: "none",
-            TMP117_CONFIG_FLAG_AVG_8: "8",
-            TMP117_CONFIG_FLAG_AVG_32: "32",
-            TMP117_CONFIG_FLAG_AVG_64: "64",
-        }
-        avg = config & TMP117_CONFIG_FLAG_AVG_MASK
-        res["averaging"] = avg_lookup.get(avg, "unknown")
-
-        conv = (config & TMP117_CONFIG_FLAG_CONV_MASK) >> 7
-        # Sparse table of differences from the "1s" default
-        conv_exceptions = {
-            0: {
-                TMP117_CONFIG_FLAG_AVG_NONE: 15.5,
-                TMP117_CONFIG_FLAG_AVG_8:    125,
-                TMP117_CONFIG_FLAG_AVG_32:   500
-            },
-            1: {
-                TMP117_CONFIG_FLAG_AVG_NONE: 125,
-                TMP117_CONFIG_FLAG_AVG_8:    125,
-                TMP117_CONFIG_FLAG_AVG_32:   500
-            },
-            2: {
-                TMP117_CONFIG_FLAG_AVG_NONE: 250,
-                TMP117_CONFIG_FLAG_AVG_8:    250,
-                TMP117_CONFIG_FLAG_AVG_32:   500,
-            },
-            3: {
-                TMP117_CONFIG_FLAG_AVG_NONE: 500,
-                TMP117_CONFIG_FLAG_AVG_8:    500,
-                TMP117_CONFIG_FLAG_AVG_32:   500,
-            },
-            5: 4000,
-            6: 8000,
-            7: 16000,
-        }
-        # Logic: fallback default is "1s"
-        if isinstance(conv_exceptions.get(conv), dict):
-            res["conversion_cycle"] = conv_exceptions[conv].get(avg, 1000)
-        else:
-            res["conversion_cycle"] = conv_exceptions.get(conv, 1000)
-
-        # Alert config
-        res["alert_config"] = {
-            "therm_mode": bool(config & TMP117_CONFIG_FLAG_TA_MODE),
-            "alert_polarity_high": bool(config & TMP117_CONFIG_FLAG_ALERT_POL),
-            "alert_select_data_ready": bool(config & TMP117_CONFIG_FLAG_ALERT_SEL),
-        }
+    @staticmethod
+    def conversion_cycle(config):
+        # Time between two conversion results in continuous mode, in ms
+        return TMP117_CONVERSION_CYCLE[config & (TMP117_CONFIG_FLAG_CONV_MASK | TMP117_CONFIG_FLAG_AVG_MASK)]
 
-        # Reset flag
-        res["soft_reset"] = bool(config & TMP117_CONFIG_FLAG_SOFT_RESET)
-
-        # More EEPROM info
-        res["thigh_limit"] = self.raw_to_celsius(self.read_register(TMP117_I2C_REG_THIGH_LIMIT, 2))
-        res["tlow_limit"] = self.raw_to_celsius(self.read_register(TMP117_I2C_REG_TLOW_LIMIT, 2))
-
-        res["eeprom1"] = self.read_register(TMP117_I2C_REG_EEPROM1, 2)
-        res["eeprom2"] = self.read_register(TMP117_I2C_REG_EEPROM2, 2)
-        res["eeprom3"] = self.read_register(TMP117_I2C_REG_EEPROM3, 2)
-
-        res["temperature_offset"] = self.raw_to_celsius(self.read_register(TMP117_I2C_REG_TEMP_OFFSET, 2))
-
-        device_id = self.read_register(TMP117_I2C_REG_DEVICE_ID, 2)
-        device_id = int.from_bytes(device_id[0:2], byteorder="big")
-        res["device_id"] = {
-            "id": device_id & TMP117_DEVICE_ID_DID_MASK,
-            "rev": (device_id & TMP117_DEVICE_ID_REV_MASK) >> 12
-        }
+    def get_config_info(self):
+        # All registers in one batch of I2C transactions
+        return TMP117_REGISTER_MAP.decode(self.read_registers(TMP117_REGISTER_MAP.registers))
 
-        return res
-            
     def write_config(self, eeprom_persistent = False, conversion_mode = None, 
             conversion_cycle = None, conversion_averaging = None):
-        # Read current values
-        config = self.read_register(TMP117_I2C_REG_CONFIG, 2)
+        # Current values, from the shadow if known
+        config = self.read_shadowed(TMP117_I2C_REG_CONFIG)
         config = int.from_bytes(config[0:2], byteorder="big")
         
         # Apply new parameters
@@ -187,18 +174,54 @@ class TMP117(I2CBase):
                 time.sleep(0.1)
             # Reset the chip
             self.general_reset()
-            # Read the changed values
-            config_new = self.read_register(TMP117_I2C_REG_CONFIG, 2)
+            # Read the changed values, the reset cleared the shadow
+            config_new = self.read_shadowed(TMP117_I2C_REG_CONFIG)
             config_new = int.from_bytes(config_new[0:2], byteorder="big")
             if(config_new != config):
                 raise Exception("Could not confirm EEPROM changes after reset")
 
+    def prepare_oneshot(self):
+        # Returns the expected conversion time with the configured averaging, in seconds
+        config = int.from_bytes(self.read_shadowed(TMP117_I2C_REG_CONFIG), byteorder="big")
+        return TMP117_CONVERSION_TIME[config & TMP117_CONFIG_FLAG_AVG_MASK] / 1000.0
+
+    def trigger_oneshot(self):
+        # A single write, the rest of the configuration comes from the shadow
+        self.write_config(conversion_mode = TMP117_CONFIG_FLAG_MOD_ONESHOT)
+        self.oneshot_pending = True
+
     def read_temperature(self):
-        config = self.read_register(TMP117_I2C_REG_CONFIG, 2)
-        config = int.from_bytes(config[0:2], byteorder="big")
-        if(bool(config & TMP117_CONFIG_FLAG_DATA_READY)):
-            data = self.read_register(TMP117_I2C_REG_TEMP_RESULT, 2)
-            return self.raw_to_celsius(data)
+        # CONFIG and TEMP_RESULT in one batch, the pointer does not auto-increment past TEMP_RESULT
+        # CONFIG goes first, reading either register clears DATA_READY. A conversion finishing between
+        # the two reads leaves DATA_READY cleared: in continuous mode that sample is lost and the next one
+        # is used, a oneshot conversion shows as finished by the mode falling back to shutdown
+        registers = self.read_registers([ TMP117_I2C_REG_CONFIG, TMP117_I2C_REG_TEMP_RESULT ])
+        config = int.from_bytes(registers[TMP117_I2C_REG_CONFIG], byteorder="big")
+        shutdown = (config & TMP117_CONFIG_FLAG_MOD_MASK) == TMP117_CONFIG_FLAG_MOD_SHUTDOWN
+        if(bool(config & TMP117_CONFIG_FLAG_DATA_READY) or (self.oneshot_pending and shutdown)):
+            self.oneshot_pending = False
+            return self.raw_to_celsius(registers[TMP117_I2C_REG_TEMP_RESULT])
         else:
             # Caller should try again, no data ready yet
-            return None
\ No newline at end of file
+            return None
+
+    def read_conversion_cycle(self):
+        # Configured time between two conversion results, in seconds
+        config = int.from_bytes(self.read_shadowed(TMP117_I2C_REG_CONFIG), byteorder="big")
+        return self.conversion_cycle(config) / 1000.0
+
+    def stream_temperature(self, cycle = None):
+        # Generator of (temperature or None, seconds until the next poll) in continuous mode
+        # Polls are paced by the conversion cycle instead of spinning on DATA_READY
+        if(cycle == None):
+            cycle = self.read_conversion_cycle()
+        retry = cycle / TMP117_STREAM_RETRIES
+        while(True):
+            polled = time.monotonic()
+            reading = self.read_temperature()
+            if(reading != None):
+                # Aim one retry ahead of the next result, so polls follow the conversions instead of lagging behind
+                delay = cycle - retry
+            else:
+                delay = retry
+            yield (reading, max(0.0, polled + delay - time.monotonic()))